@@ -0,0 +1,108 @@
+"""
+Event-loop blocking benchmark: sync Session vs AsyncSession.
+
+Runs concurrent `GET /notes/` list requests (one full 500-note page) against a seeded SQLite file
+while a probe coroutine hits `GET /` and records its latency. With the
+sync Session every list query blocks the loop, so probe p99 tracks the
+list query time; with the async engine the probe stays responsive.
+
+    python -m benchmarks.async_db --notes 5000 --concurrency 16 --duration 5
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlmodel import Session, select
+
+from core.models import Note, NotePage
+from benchmarks.common import app_using, auth_headers, percentile, scratch_db, seed_notes, seed_user
+
+LIST_URL = "/notes/?limit=500"
+
+
+def build_sync_app(engine, owner_id):
+    """The pre-async pattern: an `async def` route calling a blocking Session"""
+    app = FastAPI()
+
+    def get_session():
+        with Session(engine) as session:
+            yield session
+
+    @app.get("/")
+    async def read_root():
+        return {"Message": "Hello World!"}
+
+    @app.get("/notes/", response_model=NotePage)
+    async def get_notes(limit: int = 500, session: Session = Depends(get_session)):
+        notes = session.exec(
+            select(Note).where(Note.owner_id == owner_id).order_by(Note.id).limit(limit)
+        ).all()
+        return {"items": notes, "next_cursor": None}
+
+    return app
+
+
+async def drive(app, concurrency, duration, headers=None):
+    transport = httpx.ASGITransport(app=app)
+    probe_latencies = []
+    list_latencies = []
+    deadline = time.perf_counter() + duration
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers) as client:
+        async def lister():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = await client.get(LIST_URL)
+                response.raise_for_status()
+                list_latencies.append(time.perf_counter() - start)
+
+        async def prober():
+            # Latency is measured from when the probe was due, so time spent
+            # waiting for a blocked loop to wake the sleeper is counted too
+            due = time.perf_counter()
+            while time.perf_counter() < deadline:
+                await asyncio.sleep(max(0.0, due - time.perf_counter()))
+                await client.get("/")
+                probe_latencies.append(time.perf_counter() - due)
+                due = time.perf_counter() + 0.005
+
+        await asyncio.gather(prober(), *(lister() for _ in range(concurrency)))
+
+    return probe_latencies, list_latencies
+
+
+def report(label, probe, listing):
+    print(f"{label}")
+    for name, samples in (("GET /", probe), ("GET /notes/", listing)):
+        print(
+            f"  {name:<12} n={len(samples):<6} "
+            f"p50={percentile(samples, 50) * 1000:8.2f}ms "
+            f"p99={percentile(samples, 99) * 1000:8.2f}ms "
+            f"mean={statistics.fmean(samples) * 1000 if samples else 0:8.2f}ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--notes", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    with scratch_db() as (engine, async_engine):
+        owner_id = seed_user(engine)
+        seed_notes(engine, owner_id, args.notes)
+
+        probe, listing = asyncio.run(drive(build_sync_app(engine, owner_id), args.concurrency, args.duration))
+        report("sync Session (blocking)", probe, listing)
+
+        with app_using(async_engine) as app:
+            probe, listing = asyncio.run(drive(app, args.concurrency, args.duration, auth_headers()))
+        report("AsyncSession (aiosqlite)", probe, listing)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Shared helpers for the scripts in this package."""
+import os
+import random
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import Session, SQLModel, create_engine
+
+from core.app import app
+from core.database import create_async_db_engine, get_async_session, get_session_factory, open_async_session
+from core.models import Note, User
+from core.storage.sql import ensure_palettes, split_palette
+from core.utils.palettes import palette_cache, palette_key
+from core.utils.jwt import create_access_token
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+@contextmanager
+def scratch_db(profile=None):
+    """
+    Yield (sync engine, async engine) over a throwaway SQLite file with the
+    schema created. With `profile`, the async engine is built like the app's,
+    with that DB_PROFILE's pragmas and pool; otherwise it's a bare NullPool.
+    """
+    db_dir = tempfile.mkdtemp()
+    db_path = os.path.join(db_dir, "bench.sqlite3")
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    if profile:
+        async_engine = create_async_db_engine(f"sqlite+aiosqlite:///{db_path}", profile=profile, echo=False)
+    else:
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}", poolclass=NullPool)
+    SQLModel.metadata.create_all(engine)
+    # Palette ids restart with every scratch database
+    palette_cache.clear()
+    try:
+        yield engine, async_engine
+    finally:
+        engine.dispose()
+        shutil.rmtree(db_dir, ignore_errors=True)
+
+
+def seed_user(engine, username="bench"):
+    with Session(engine) as session:
+        user = User(username=username, email=f"{username}@example.com", password_hash="x")
+        session.add(user)
+        session.commit()
+        session.refresh(user)
+        return user.id
+
+
+def seed_notes(engine, owner_id, count, seed=0, chunk=5000):
+    """Bulk-insert `count` notes at random positions for one owner."""
+    rng = random.Random(seed)
+    colors = {"color_id": "yellow", "color_header": "#FFD700", "color_body": "#FFFACD", "color_text": "#000000"}
+    with Session(engine) as session:
+        palette = split_palette(colors, ensure_palettes(session, [palette_key(colors)]))
+        for start in range(0, count, chunk):
+            rows = [
+                {
+                    **palette,
+                    "body": f"note {i}",
+                    "pos_x": rng.randint(0, 5000),
+                    "pos_y": rng.randint(0, 5000),
+                    "owner_id": owner_id,
+                }
+                for i in range(start, min(count, start + chunk))
+            ]
+            session.exec(insert(Note), params=rows)
+        session.commit()
+
+
+def auth_headers(username="bench"):
+    return {"Authorization": f"Bearer {create_access_token({'sub': username})}"}
+
+
+@contextmanager
+def app_using(async_engine):
+    """Point the real app's session dependencies at a scratch async engine."""
+    async def get_async_session_override():
+        async with open_async_session(async_engine) as session:
+            yield session
+
+    app.dependency_overrides[get_async_session] = get_async_session_override
+    app.dependency_overrides[get_session_factory] = lambda: (lambda: open_async_session(async_engine))
+    try:
+        yield app
+    finally:
+        app.dependency_overrides.clear()
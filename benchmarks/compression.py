@@ -0,0 +1,72 @@
+"""
+Response compression benchmark: bytes on the wire and CPU per request.
+
+For boards of each size, fetches the first `GET /notes/` page (up to 500
+notes) and the full `GET /notes/export` stream with each available
+Content-Encoding, and reports the wire size, the ratio against identity and
+the process CPU time per request. The "extra" column is the CPU the encoding
+adds over identity, which is what compression costs the server.
+
+    python -m benchmarks.compression --sizes 100 500 10000 --repeat 20
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from core.utils.compression import COMPRESSION_ENCODINGS
+from benchmarks.common import app_using, auth_headers, scratch_db, seed_notes, seed_user
+
+ROUTES = {
+    "list": "/notes/?limit=500",
+    "export": "/notes/export",
+}
+
+
+async def measure(app, headers, url, encoding, repeat):
+    """Average (wire bytes, CPU seconds) of `repeat` GETs asking for `encoding`"""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers) as client:
+        # Untimed first request: warms the connection and statement caches
+        (await client.get(url, headers={"Accept-Encoding": encoding})).raise_for_status()
+        wire = 0
+        start = time.process_time()
+        for _ in range(repeat):
+            response = await client.get(url, headers={"Accept-Encoding": encoding})
+            response.raise_for_status()
+            served = response.headers.get("content-encoding", "identity")
+            assert served == encoding, f"asked for {encoding}, got {served}"
+            wire += response.num_bytes_downloaded
+        return wire / repeat, (time.process_time() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 500, 10000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    encodings = ["identity", *COMPRESSION_ENCODINGS]
+    print(f"{'rows':>7}  {'route':<7} {'encoding':<9} {'bytes':>11}  {'ratio':>6}  {'CPU/req':>10}  {'extra':>10}")
+    for size in args.sizes:
+        with scratch_db() as (engine, async_engine):
+            owner_id = seed_user(engine)
+            seed_notes(engine, owner_id, size)
+            headers = auth_headers()
+            with app_using(async_engine) as app:
+                for route, url in ROUTES.items():
+                    baseline = None
+                    for encoding in encodings:
+                        wire, cpu = asyncio.run(measure(app, headers, url, encoding, args.repeat))
+                        if baseline is None:
+                            baseline = (wire, cpu)
+                        print(
+                            f"{size:>7}  {route:<7} {encoding:<9} {wire:>11,.0f}  {baseline[0] / wire:>5.1f}x  "
+                            f"{cpu * 1000:>7.2f} ms  {(cpu - baseline[1]) * 1000:>+7.2f} ms"
+                        )
+            asyncio.run(async_engine.dispose())
+
+
+if __name__ == "__main__":
+    main()
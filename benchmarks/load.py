@@ -0,0 +1,230 @@
+"""
+Load test for the in-process ASGI app, run as `python main.py bench`.
+
+Seeds a scratch database with `--users` users holding `--notes` notes each,
+then drives core.app through httpx's ASGI transport, one scenario at a time,
+with `--concurrency` requests in flight. Reports requests/s and p50/p95/p99
+latency per route, can write them to JSON, and can compare them against a
+saved baseline (exit status 1 on a regression beyond `--tolerance`).
+
+    python main.py bench --requests 1000 --concurrency 32 --output bench.json
+    python main.py bench --baseline bench.json
+"""
+import asyncio
+import json
+import platform
+import random
+import time
+from typing import Dict, List, Optional
+
+import httpx
+from sqlalchemy import insert
+from sqlmodel import Session, select
+
+from core.models import Note, User
+from core.storage.sql import ensure_palettes, split_palette
+from core.utils.palettes import palette_key
+from core.utils.cache import note_cache
+from core.utils.security import hash_password
+from benchmarks.common import app_using, auth_headers, percentile, scratch_db
+
+SCENARIOS = ["register", "login", "list", "get", "update", "delete"]
+# Each of these costs a full bcrypt round, so they get their own, smaller request count
+AUTH_SCENARIOS = {"register", "login"}
+PASSWORD = "bench-password"
+
+NOTE = {
+    "color_id": "yellow",
+    "color_header": "#FFD700",
+    "color_body": "#FFFACD",
+    "color_text": "#000000",
+}
+
+
+def seed(engine, users: int, notes: int, seed: int = 0) -> Dict[str, List[int]]:
+    """Create the users (sharing one real bcrypt hash) and their notes; returns username -> note ids."""
+    rng = random.Random(seed)
+    password_hash = hash_password(PASSWORD)
+    with Session(engine) as session:
+        session.exec(insert(User), params=[
+            {"username": f"bench{i}", "email": f"bench{i}@example.com", "password_hash": password_hash}
+            for i in range(users)
+        ])
+        owners = session.exec(select(User.id, User.username)).all()
+        palette = split_palette(NOTE, ensure_palettes(session, [palette_key(NOTE)]))
+        session.exec(insert(Note), params=[
+            {**palette, "body": f"note {i}", "pos_x": rng.randint(0, 5000), "pos_y": rng.randint(0, 5000), "owner_id": owner_id}
+            for owner_id, _ in owners
+            for i in range(notes)
+        ])
+        session.commit()
+        ids: Dict[str, List[int]] = {username: [] for _, username in owners}
+        names = dict(owners)
+        for note_id, owner_id in session.exec(select(Note.id, Note.owner_id)).all():
+            ids[names[owner_id]].append(note_id)
+    return ids
+
+
+def build_requests(scenario: str, count: int, notes: Dict[str, List[int]], rng: random.Random):
+    """Yield (route label, method, url, username or None, json body) for one scenario."""
+    usernames = list(notes)
+    if scenario == "delete":
+        # Each note can only be deleted once
+        pool = [(username, note_id) for username, ids in notes.items() for note_id in ids]
+        rng.shuffle(pool)
+        for username, note_id in pool[:count]:
+            notes[username].remove(note_id)
+            yield "DELETE /notes/{note_id}", "DELETE", f"/notes/{note_id}", username, None
+        return
+
+    for i in range(count):
+        username = rng.choice(usernames)
+        if scenario == "register":
+            yield "POST /register", "POST", "/register", None, {
+                "username": f"new{i}", "email": f"new{i}@example.com", "password": PASSWORD
+            }
+        elif scenario == "login":
+            yield "POST /login", "POST", "/login", None, {"username": username, "password": PASSWORD}
+        elif scenario == "list":
+            yield "GET /notes/", "GET", "/notes/?limit=100", username, None
+        elif scenario == "get":
+            note_id = rng.choice(notes[username])
+            yield "GET /notes/{note_id}", "GET", f"/notes/{note_id}", username, None
+        elif scenario == "update":
+            note_id = rng.choice(notes[username])
+            yield "PUT /notes/{note_id}", "PUT", f"/notes/{note_id}", username, {
+                "body": f"edited {i}", "pos_x": rng.randint(0, 5000)
+            }
+
+
+async def drive(
+    app, requests, concurrency: int, headers: Dict[str, dict], base_url: str = "http://bench",
+    statuses: Optional[Dict[int, int]] = None,
+):
+    """
+    Run `requests` with at most `concurrency` in flight; returns (latencies,
+    errors, elapsed). With `app` None they go over real HTTP to `base_url`.
+    Error responses are tallied by status into `statuses` if given.
+    """
+    transport = httpx.ASGITransport(app=app) if app is not None else None
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    latencies: List[float] = []
+    errors = 0
+    pending = iter(requests)
+
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal errors
+            for _, method, url, username, body in pending:
+                start = time.perf_counter()
+                response = await client.request(method, url, json=body, headers=headers.get(username))
+                latencies.append(time.perf_counter() - start)
+                if response.status_code >= 400:
+                    errors += 1
+                    if statuses is not None:
+                        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, float]:
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Return one line per route that got slower than the baseline by more than `tolerance`."""
+    regressions = []
+    for route, current in results["routes"].items():
+        previous = baseline.get("routes", {}).get(route)
+        if not previous:
+            continue
+        if previous["rps"] and current["rps"] < previous["rps"] * (1 - tolerance):
+            regressions.append(f"{route}: rps {previous['rps']} -> {current['rps']}")
+        if previous["p99_ms"] and current["p99_ms"] > previous["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{route}: p99 {previous['p99_ms']} ms -> {current['p99_ms']} ms")
+    return regressions
+
+
+def print_table(results: dict, baseline: Optional[dict]) -> None:
+    print(f"{'route':<24}{'reqs':>7}{'errs':>6}{'rps':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for route, row in results["routes"].items():
+        line = (
+            f"{route:<24}{row['requests']:>7}{row['errors']:>6}{row['rps']:>10.1f}"
+            f"{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}"
+        )
+        previous = (baseline or {}).get("routes", {}).get(route)
+        if previous and previous["rps"]:
+            line += f"   rps {(row['rps'] / previous['rps'] - 1) * 100:+.1f}% vs baseline"
+        print(line)
+
+
+def run(
+    users: int = 10,
+    notes: int = 200,
+    requests: int = 500,
+    auth_requests: int = 50,
+    concurrency: int = 32,
+    scenarios: Optional[List[str]] = None,
+    profile: str = "production",
+    output: Optional[str] = None,
+    baseline: Optional[str] = None,
+    tolerance: float = 0.10,
+    seed_value: int = 0,
+) -> int:
+    scenarios = scenarios or SCENARIOS
+    rng = random.Random(seed_value)
+    config = {
+        "users": users, "notes": notes, "requests": requests, "auth_requests": auth_requests, "concurrency": concurrency,
+        "scenarios": scenarios, "profile": profile, "python": platform.python_version(),
+    }
+    results = {"config": config, "routes": {}}
+
+    with scratch_db(profile) as (engine, async_engine):
+        note_ids = seed(engine, users, notes, seed_value)
+        headers = {username: auth_headers(username) for username in note_ids}
+        note_cache.clear()
+
+        async def run_scenarios(app):
+            # One event loop for every scenario: a pooled async engine is bound to it
+            for scenario in scenarios:
+                count = auth_requests if scenario in AUTH_SCENARIOS else requests
+                planned = list(build_requests(scenario, count, note_ids, rng))
+                if not planned:
+                    continue
+                latencies, errors, elapsed = await drive(app, planned, concurrency, headers)
+                results["routes"][planned[0][0]] = summarize(latencies, errors, elapsed)
+            await async_engine.dispose()
+
+        with app_using(async_engine) as app:
+            asyncio.run(run_scenarios(app))
+
+    saved = None
+    if baseline:
+        with open(baseline) as f:
+            saved = json.load(f)
+    print_table(results, saved)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {output}")
+
+    if saved:
+        regressions = compare(results, saved, tolerance)
+        if regressions:
+            print(f"\nRegressions beyond {tolerance:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\nNo regressions beyond {tolerance:.0%} against {baseline}")
+    return 0
@@ -0,0 +1,158 @@
+"""
+Palette storage benchmark: database size and full-board reads, before and
+after the note palettes migration.
+
+Builds a database in the pre-palette layout (four color strings on every
+note), fills it with synthetic notes drawn from a handful of palettes, then
+runs the real Alembic migration on it. Reports the VACUUMed file size, the
+pages used by `note` and its indexes, and the time to read one owner's whole
+board into NoteRead-shaped dicts, on both sides.
+
+    python -m benchmarks.palettes --notes 500000 --users 50
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from core.storage.base import NOTE_READ_FIELDS
+from core.storage.sql import expand_palettes
+from core.utils.palettes import palette_cache
+from core.utils.search import NOTE_FTS_CREATE
+from core.utils.serialization import rows_to_dicts
+from core.utils.spatial import GRID_CELL_EXPR
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BEFORE_REVISION = "f2a7c93d1e60"
+
+# The note table as the migrations before palettes leave it
+OLD_SCHEMA = [
+    """CREATE TABLE user (
+        id INTEGER NOT NULL, username VARCHAR(30) NOT NULL, email VARCHAR NOT NULL,
+        password_hash VARCHAR NOT NULL, notes_version INTEGER DEFAULT '0' NOT NULL, PRIMARY KEY (id)
+    )""",
+    f"""CREATE TABLE note (
+        body VARCHAR(500) NOT NULL, color_id VARCHAR(20) NOT NULL, color_header VARCHAR NOT NULL,
+        color_body VARCHAR NOT NULL, color_text VARCHAR NOT NULL, pos_x INTEGER NOT NULL, pos_y INTEGER NOT NULL,
+        id INTEGER NOT NULL, owner_id INTEGER, version INTEGER DEFAULT '1' NOT NULL,
+        revision INTEGER DEFAULT '0' NOT NULL, grid_cell INTEGER GENERATED ALWAYS AS ({GRID_CELL_EXPR}) VIRTUAL,
+        PRIMARY KEY (id), FOREIGN KEY(owner_id) REFERENCES user (id)
+    )""",
+    "CREATE INDEX ix_note_owner_id_id ON note (owner_id, id)",
+    "CREATE INDEX ix_note_owner_id_revision ON note (owner_id, revision)",
+    "CREATE INDEX ix_note_owner_id_grid_cell ON note (owner_id, grid_cell)",
+    """CREATE TABLE note_tombstone (
+        id INTEGER NOT NULL, note_id INTEGER NOT NULL, owner_id INTEGER NOT NULL, revision INTEGER NOT NULL,
+        PRIMARY KEY (id), FOREIGN KEY(owner_id) REFERENCES user (id)
+    )""",
+    "CREATE INDEX ix_note_tombstone_owner_id_revision ON note_tombstone (owner_id, revision)",
+    *NOTE_FTS_CREATE,
+]
+
+# What the frontend offers: a few named palettes
+PALETTES = [
+    ("yellow", "#FFD700", "#FFFACD", "#000000"),
+    ("blue", "#1E90FF", "#E0F0FF", "#000000"),
+    ("green", "#32CD32", "#E8FFE8", "#000000"),
+    ("pink", "#FF69B4", "#FFE4F1", "#000000"),
+    ("purple", "#8A2BE2", "#F0E6FF", "#FFFFFF"),
+    ("gray", "#808080", "#F0F0F0", "#000000"),
+]
+
+NOTE_TABLES = ("note", "ix_note_owner_id_id", "ix_note_owner_id_revision", "ix_note_owner_id_grid_cell")
+
+
+def seed(path, notes, users, chunk=50000):
+    rng = random.Random(0)
+    db = sqlite3.connect(path)
+    for statement in OLD_SCHEMA:
+        db.execute(statement)
+    db.executemany(
+        "INSERT INTO user (username, email, password_hash) VALUES (?, ?, 'x')",
+        [(f"bench{i}", f"bench{i}@example.com") for i in range(users)]
+    )
+    for start in range(0, notes, chunk):
+        db.executemany(
+            "INSERT INTO note (body, color_id, color_header, color_body, color_text, pos_x, pos_y, owner_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (f"note {i}", *rng.choice(PALETTES), rng.randint(0, 5000), rng.randint(0, 5000), i % users + 1)
+                for i in range(start, min(notes, start + chunk))
+            ]
+        )
+    db.commit()
+    db.close()
+
+
+def measure(path):
+    """(file bytes, bytes in note + its indexes) after a VACUUM"""
+    db = sqlite3.connect(path)
+    db.execute("VACUUM")
+    placeholders = ", ".join("?" * len(NOTE_TABLES))
+    note_bytes = db.execute(f"SELECT SUM(pgsize) FROM dbstat WHERE name IN ({placeholders})", NOTE_TABLES).fetchone()[0]
+    db.close()
+    return os.path.getsize(path), note_bytes
+
+
+def read_board(path, columns, expand, repeat=5):
+    """Best-of-`repeat` seconds to read owner 1's notes into NoteRead-shaped dicts"""
+    db = sqlite3.connect(path)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = db.execute(f"SELECT {columns} FROM note WHERE owner_id = 1 ORDER BY id").fetchall()
+        notes = rows_to_dicts(NOTE_READ_FIELDS, expand(rows))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    db.close()
+    return best, len(notes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--notes", type=int, default=500000)
+    parser.add_argument("--users", type=int, default=50)
+    args = parser.parse_args()
+
+    db_dir = tempfile.mkdtemp()
+    path = os.path.join(db_dir, "palettes.sqlite3")
+    try:
+        seed(path, args.notes, args.users)
+        before_size, before_note = measure(path)
+        before_read, count = read_board(path, ", ".join(NOTE_READ_FIELDS), lambda rows: rows)
+
+        env = {**os.environ, "DB_PATH": path}
+        subprocess.run([sys.executable, "-m", "alembic", "stamp", BEFORE_REVISION], cwd=ROOT, env=env, check=True, capture_output=True)
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], cwd=ROOT, env=env, check=True, capture_output=True)
+        migration = time.perf_counter() - start
+        after_size, after_note = measure(path)
+
+        db = sqlite3.connect(path)
+        palette_cache.clear()
+        for palette_id, *key in db.execute("SELECT id, color_id, color_header, color_body, color_text FROM palette"):
+            palette_cache.add(palette_id, tuple(key))
+        db.close()
+        # NOTE_ROW_COLUMNS order: NoteRead's fields minus the colors, then the palette id
+        stored = [field for field in NOTE_READ_FIELDS if not field.startswith("color_")]
+        after_read, _ = read_board(path, ", ".join([*stored, "palette_id"]), expand_palettes)
+    finally:
+        shutil.rmtree(db_dir, ignore_errors=True)
+
+    print(f"{args.notes:,} notes, {args.users} owners, {len(palette_cache)} palettes; migration took {migration:.1f} s")
+    print(f"{'':<22} {'before':>12} {'after':>12} {'change':>8}")
+    for label, before, after in (
+        ("database file (MB)", before_size / 2**20, after_size / 2**20),
+        ("note + indexes (MB)", before_note / 2**20, after_note / 2**20),
+        (f"read {count:,} notes (ms)", before_read * 1000, after_read * 1000),
+    ):
+        print(f"{label:<22} {before:>12.1f} {after:>12.1f} {(after - before) / before:>+8.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+List serialization benchmark: validated responses vs FAST_JSON.
+
+For boards of each size, times (a) turning N rows into the response body
+the old way (NoteRead validation per ORM row, then stdlib json) against the
+fast path (column tuples to dicts, pydantic-core to bytes), and (b) paging
+through the whole board with `GET /notes/?limit=500` in both modes.
+
+    python -m benchmarks.serialization --sizes 1000 10000 100000
+"""
+import argparse
+import asyncio
+import json
+import time
+from unittest import mock
+
+import httpx
+from sqlmodel import Session, select
+
+from core.storage.base import NOTE_READ_FIELDS
+from core.storage.sql import NOTE_ROW_COLUMNS, expand_palettes
+from core.models import Note, NoteRead
+from core.utils.serialization import dump_json, rows_to_dicts
+from benchmarks.common import app_using, auth_headers, scratch_db, seed_notes, seed_user
+
+
+def encode_validated(notes):
+    items = [NoteRead.model_validate(note).model_dump(mode="json") for note in notes]
+    return json.dumps({"items": items, "next_cursor": None}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode_fast(rows):
+    return dump_json({"items": rows_to_dicts(NOTE_READ_FIELDS, expand_palettes(rows)), "next_cursor": None})
+
+
+def time_encoding(engine, owner_id):
+    with Session(engine) as session:
+        notes = session.exec(select(Note).where(Note.owner_id == owner_id).order_by(Note.id)).all()
+        rows = session.exec(select(*NOTE_ROW_COLUMNS).where(Note.owner_id == owner_id).order_by(Note.id)).all()
+
+    start = time.perf_counter()
+    validated = encode_validated(notes)
+    validated_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fast = encode_fast(rows)
+    fast_time = time.perf_counter() - start
+
+    assert fast == validated, "fast path output differs"
+    return validated_time, fast_time
+
+
+async def page_through(app, headers):
+    transport = httpx.ASGITransport(app=app)
+    count = 0
+    start = time.perf_counter()
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers) as client:
+        url = "/notes/?limit=500"
+        while url:
+            response = await client.get(url)
+            response.raise_for_status()
+            page = response.json()
+            count += len(page["items"])
+            url = f"/notes/?limit=500&cursor={page['next_cursor']}" if page["next_cursor"] else None
+    return count, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>8}  {'encode validated':>17}  {'encode fast':>12}  {'GET pages validated':>20}  {'GET pages fast':>15}")
+    for size in args.sizes:
+        with scratch_db() as (engine, async_engine):
+            owner_id = seed_user(engine)
+            seed_notes(engine, owner_id, size)
+            validated_time, fast_time = time_encoding(engine, owner_id)
+
+            headers = auth_headers()
+            with app_using(async_engine) as app:
+                with mock.patch("core.app.FAST_JSON", False):
+                    _, pages_validated = asyncio.run(page_through(app, headers))
+                with mock.patch("core.app.FAST_JSON", True):
+                    count, pages_fast = asyncio.run(page_through(app, headers))
+            asyncio.run(async_engine.dispose())
+            assert count == size
+
+        print(
+            f"{size:>8}  {validated_time * 1000:>14.1f} ms  {fast_time * 1000:>9.1f} ms  "
+            f"{pages_validated * 1000:>17.1f} ms  {pages_fast * 1000:>12.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
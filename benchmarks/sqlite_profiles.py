@@ -0,0 +1,88 @@
+"""
+Write-throughput benchmark for the SQLite engine profiles in core.database.
+
+For each profile, inserts notes one transaction at a time from a single
+writer (sync engine), then from concurrent writers on the async engine,
+and reports committed rows per second.
+
+    python -m benchmarks.sqlite_profiles --rows 2000 --writers 8
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+from sqlmodel import Session, SQLModel
+
+from core.database import DB_PROFILES, create_async_db_engine, create_db_engine, open_async_session
+from core.models import Note
+from core.storage.sql import ensure_palettes
+from core.utils.palettes import palette_cache
+
+YELLOW = ("yellow", "#FFD700", "#FFFACD", "#000000")
+
+
+def make_note(i, palette_id):
+    return Note(
+        body=f"note {i}",
+        palette_id=palette_id,
+        pos_x=i % 5000,
+        pos_y=(i * 7) % 5000,
+    )
+
+
+def single_writer(engine, rows, palette_id):
+    start = time.perf_counter()
+    for i in range(rows):
+        with Session(engine) as session:
+            session.add(make_note(i, palette_id))
+            session.commit()
+    return rows / (time.perf_counter() - start)
+
+
+async def concurrent_writers(async_engine, rows, writers, palette_id):
+    per_writer = rows // writers
+
+    async def writer(offset):
+        for i in range(per_writer):
+            async with open_async_session(async_engine) as session:
+                session.add(make_note(offset + i, palette_id))
+                await session.commit()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(writer(w * per_writer) for w in range(writers)))
+    elapsed = time.perf_counter() - start
+    await async_engine.dispose()
+    return per_writer * writers / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--writers", type=int, default=8)
+    args = parser.parse_args()
+
+    print(f"{'profile':<12} {'1 writer':>14} {f'{args.writers} writers':>14}")
+    for profile in DB_PROFILES:
+        db_dir = tempfile.mkdtemp()
+        db_path = os.path.join(db_dir, "bench.sqlite3")
+        try:
+            engine = create_db_engine(f"sqlite:///{db_path}", profile=profile, echo=False)
+            SQLModel.metadata.create_all(engine)
+            palette_cache.clear()
+            with Session(engine) as session:
+                palette_id = ensure_palettes(session, [YELLOW])[YELLOW]
+            sync_rate = single_writer(engine, args.rows, palette_id)
+            engine.dispose()
+
+            async_engine = create_async_db_engine(f"sqlite+aiosqlite:///{db_path}", profile=profile, echo=False)
+            async_rate = asyncio.run(concurrent_writers(async_engine, args.rows, args.writers, palette_id))
+            print(f"{profile:<12} {sync_rate:>10.0f} r/s {async_rate:>10.0f} r/s")
+        finally:
+            shutil.rmtree(db_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
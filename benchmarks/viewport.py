@@ -0,0 +1,55 @@
+"""
+Viewport query benchmark.
+
+Seeds boards of increasing size and times `GET /notes/` for a fixed
+1920x1080 viewport (grid-index path) next to a full-board viewport
+(id-order path), through the real app. Viewport time should stay roughly
+flat as the board grows, since only nearby grid cells are read.
+
+    python -m benchmarks.viewport --sizes 1000 10000 50000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from benchmarks.common import app_using, auth_headers, scratch_db, seed_notes, seed_user
+
+VIEWPORTS = {
+    "1920x1080": {"x0": 1000, "y0": 1000, "x1": 2920, "y1": 2080},
+    "full board": {"x0": 0, "y0": 0, "x1": 5000, "y1": 5000},
+}
+
+
+async def time_query(app, params, repeat):
+    transport = httpx.ASGITransport(app=app)
+    timings = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=auth_headers()) as client:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = await client.get("/notes/", params={**params, "limit": 500})
+            response.raise_for_status()
+            timings.append(time.perf_counter() - start)
+    return statistics.median(timings), len(response.json()["items"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'notes':>8}  {'viewport':<12} {'median':>10}  rows")
+    for size in args.sizes:
+        with scratch_db() as (engine, async_engine):
+            seed_notes(engine, seed_user(engine), size)
+            with app_using(async_engine) as app:
+                for name, params in VIEWPORTS.items():
+                    median, rows = asyncio.run(time_query(app, params, args.repeat))
+                    print(f"{size:>8}  {name:<12} {median * 1000:8.2f}ms  {rows}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Multi-worker throughput benchmark: `runserver --workers N --no-reload`.
+
+Seeds one scratch database, then for each worker count starts the real
+server as a subprocess on that file and drives it over HTTP, one scenario at
+a time. Reports requests/s, p50/p99 latency, errors and how many requests
+came back 503 (the write-lock retries ran out), so scaling and SQLite write
+contention show up side by side. Throughput only scales up to the number of
+cores; writes stay serialized by SQLite whatever the worker count.
+
+    python -m benchmarks.workers --workers 1 2 4 --requests 2000 --concurrency 64
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.common import auth_headers, scratch_db
+from benchmarks.load import build_requests, drive, seed, summarize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ["login", "get", "list", "update"]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(db_path: str, workers: int, port: int) -> subprocess.Popen:
+    env = {**os.environ, "DB_PATH": db_path, "DB_PROFILE": "production"}
+    server = subprocess.Popen(
+        [sys.executable, "main.py", "runserver", "--port", str(port), "--workers", str(workers), "--no-reload"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return server
+        except httpx.TransportError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"server with {workers} workers did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--notes", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--auth-requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPU(s)\n")
+    print(f"{'workers':>7}  {'route':<24}{'reqs':>7}{'errs':>6}{'rps':>10}{'p50 ms':>9}{'p99 ms':>9}{'503s':>6}")
+    with scratch_db() as (engine, _):
+        db_path = engine.url.database
+        note_ids = seed(engine, args.users, args.notes)
+        headers = {username: auth_headers(username) for username in note_ids}
+        engine.dispose()
+
+        for workers in args.workers:
+            port = free_port()
+            server = start_server(db_path, workers, port)
+            try:
+                for scenario in args.scenarios:
+                    count = args.auth_requests if scenario == "login" else args.requests
+                    planned = list(build_requests(scenario, count, note_ids, random.Random(workers)))
+                    statuses = {}
+                    latencies, errors, elapsed = asyncio.run(drive(
+                        None, planned, args.concurrency, headers, base_url=f"http://127.0.0.1:{port}", statuses=statuses
+                    ))
+                    row = summarize(latencies, errors, elapsed)
+                    print(
+                        f"{workers:>7}  {planned[0][0]:<24}{row['requests']:>7}{row['errors']:>6}"
+                        f"{row['rps']:>10.1f}{row['p50_ms']:>9.2f}{row['p99_ms']:>9.2f}{statuses.get(503, 0):>6}"
+                    )
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+WebSocket fan-out load test.
+
+Opens N idle `/ws/notes` connections for one user against the real app,
+in-process on a single event loop (the same as one uvicorn worker), then
+creates notes through `POST /notes/` and measures how long each event
+takes to reach every socket. Also reports memory held per idle socket.
+
+    python -m benchmarks.ws_fanout --sockets 3000 --events 20
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+import httpx
+
+from core.utils.events import note_events
+from benchmarks.common import app_using, auth_headers, percentile, scratch_db, seed_user
+
+NOTE = {
+    "body": "fan-out",
+    "color_id": "yellow",
+    "color_header": "#FFD700",
+    "color_body": "#FFFACD",
+    "color_text": "#000000",
+    "pos_x": 0,
+    "pos_y": 0,
+}
+
+
+class IdleSocket:
+    """A raw ASGI WebSocket client that connects, then only listens."""
+
+    def __init__(self, app, token):
+        self.app = app
+        self.scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "scheme": "ws",
+            "path": "/ws/notes",
+            "raw_path": b"/ws/notes",
+            "query_string": f"token={token}".encode(),
+            "headers": [],
+            "client": ("127.0.0.1", 0),
+            "server": ("bench", 80),
+            "subprotocols": [],
+        }
+        self.incoming = asyncio.Queue()
+        self.accepted = asyncio.Event()
+        self.received = []  # arrival times
+        self.arrived = None  # set by the driver to wait for one event
+        self.task = None
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send(self, message):
+        if message["type"] == "websocket.accept":
+            self.accepted.set()
+        elif message["type"] == "websocket.send":
+            self.received.append(time.perf_counter())
+            if self.arrived is not None:
+                self.arrived()
+        elif message["type"] == "websocket.close":
+            self.accepted.set()
+
+    async def connect(self):
+        self.incoming.put_nowait({"type": "websocket.connect"})
+        self.task = asyncio.create_task(self.app(self.scope, self.receive, self.send))
+        await self.accepted.wait()
+
+    async def disconnect(self):
+        self.incoming.put_nowait({"type": "websocket.disconnect", "code": 1000})
+        await self.task
+
+
+async def run(sockets, events, connect_batch):
+    with scratch_db() as (engine, async_engine):
+        seed_user(engine)
+        headers = auth_headers()
+        token = headers["Authorization"].split()[1]
+
+        with app_using(async_engine) as app:
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            clients = [IdleSocket(app, token) for _ in range(sockets)]
+            start = time.perf_counter()
+            # Connect in batches: each handshake looks the user up in SQLite
+            for offset in range(0, sockets, connect_batch):
+                await asyncio.gather(*(client.connect() for client in clients[offset:offset + connect_batch]))
+            connect_time = time.perf_counter() - start
+            per_socket = (tracemalloc.get_traced_memory()[0] - before) / sockets
+            tracemalloc.stop()
+            assert note_events.subscriber_count() == sockets, note_events.stats()
+
+            transport = httpx.ASGITransport(app=app)
+            fan_out = []
+            delivery = []
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers) as http:
+                for _ in range(events):
+                    remaining = sockets
+                    done = asyncio.Event()
+
+                    def arrived():
+                        nonlocal remaining
+                        remaining -= 1
+                        if remaining == 0:
+                            done.set()
+
+                    for client in clients:
+                        client.arrived = arrived
+                    sent = time.perf_counter()
+                    response = await http.post("/notes/", json=NOTE)
+                    response.raise_for_status()
+                    await asyncio.wait_for(done.wait(), timeout=30)
+                    fan_out.append(time.perf_counter() - sent)
+                    delivery.extend(client.received[-1] - sent for client in clients)
+
+            stats = note_events.stats()
+            await asyncio.gather(*(client.disconnect() for client in clients))
+        await async_engine.dispose()
+
+    print(f"sockets: {sockets}  events: {events}  connect: {connect_time:.2f} s  memory/socket: {per_socket / 1024:.1f} KiB")
+    print(
+        f"fan-out (request start -> last socket): "
+        f"p50 {percentile(fan_out, 50) * 1000:7.2f} ms  p99 {percentile(fan_out, 99) * 1000:7.2f} ms"
+    )
+    print(
+        f"per-socket delivery:                     "
+        f"p50 {percentile(delivery, 50) * 1000:7.2f} ms  p99 {percentile(delivery, 99) * 1000:7.2f} ms"
+    )
+    print(f"hub: {stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sockets", type=int, default=3000)
+    parser.add_argument("--events", type=int, default=20)
+    parser.add_argument("--connect-batch", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(run(args.sockets, args.events, args.connect_batch))
+
+
+if __name__ == "__main__":
+    main()
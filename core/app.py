@@ -1,20 +1,52 @@
-from fastapi import FastAPI, Depends, Path, Query, HTTPException
-from sqlmodel import Session, select
+import asyncio
+import csv
+import io
+import json
+import time
+from typing import Literal, Optional
+from fastapi import FastAPI, Depends, Header, Path, Query, HTTPException, Response, WebSocket
+from fastapi.responses import StreamingResponse
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-from .models import Note, NoteBase, NoteCreate, NoteRead, NoteUpdate, UserBase, UserCreate, LoginRequest, User
-from .utils.jwt import create_access_token, create_refresh_token, verify_token_type, decode_token, get_token_expiration, create_token_pair
-from .utils.security import hash_password, verify_password
+from .models import NoteChanges, NoteBase, NoteCreate, NoteRead, NotePage, NoteSearchPage, NoteUpdate, NotePosition, NotePositionRead, NoteBatchRequest, NoteBatchResponse, NoteBatchResult, UserBase, UserCreate, LoginRequest, User
+from .utils.jwt import create_access_token, create_refresh_token, verify_token_type, decode_token, get_token_expiration, create_token_pair, token_cache
+from .utils.cache import note_cache
+from .utils.positions import position_buffer
+from .utils.events import note_events, TOKEN_EXPIRED_CLOSE
+from .utils.retry import LockRetryMiddleware, DatabaseLocked
+from .utils.compression import CompressionMiddleware
+from .utils.idempotency import IdempotencyMiddleware
+from .utils.metrics import MetricsMiddleware, Counter, Gauge, registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from .utils.search import search_terms, render_snippet
+from .utils.serialization import FAST_JSON, default_response_class, dump_json
+from .utils.pagination import encode_cursor, decode_cursor, encode_sync_cursor, decode_sync_cursor
+from .utils.palettes import PaletteLimitExceeded
+from .utils.tombstones import run_pruner
+from .utils.security import hash_password_async, verify_password_async, password_hasher, PasswordPoolBusy
 
-from .database import initialize_db, get_session
+from .storage.base import NOTE_READ_FIELDS, NoteConflict, Repository
+from .database import initialize_async_db, get_session_factory, get_repository, get_repository_factory, idempotency_store
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    initialize_db()
+    await initialize_async_db()
+    repository_factory = get_repository_factory(get_session_factory())
+    flusher = asyncio.create_task(position_buffer.run(repository_factory))
+    pruner = asyncio.create_task(run_pruner(repository_factory))
     yield   
+    for task in (flusher, pruner):
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    # Whatever the last interval buffered still has to reach the database
+    await position_buffer.flush(repository_factory)
+    password_hasher.shutdown()
 
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=default_response_class())
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,57 +55,179 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Inside LockRetryMiddleware, so a replayed attempt re-takes its key; inside
+# compression, so stored responses are re-encoded for each client
+app.add_middleware(IdempotencyMiddleware, store=idempotency_store, routes=[("POST", "/notes/"), ("POST", "/register")])
+app.add_middleware(LockRetryMiddleware)
+app.add_middleware(CompressionMiddleware)
+# Outermost, so CORS and error handling are inside the measured time
+app.add_middleware(MetricsMiddleware, router=app.router)
+registry.register(Gauge(
+    "password_jobs_pending", "bcrypt jobs running or queued.", callback=lambda: password_hasher.pending
+))
+registry.register(Gauge(
+    "note_positions_pending", "Note moves buffered but not yet flushed.", callback=lambda: len(position_buffer)
+))
+registry.register(Counter(
+    "token_cache_hits_total", "Bearer tokens whose payload came from the token cache.", callback=lambda: token_cache.hits
+))
+registry.register(Counter(
+    "token_cache_misses_total", "Bearer tokens verified with jwt.decode.", callback=lambda: token_cache.misses
+))
+registry.register(Gauge(
+    "token_cache_size", "Verified token payloads cached.", callback=lambda: len(token_cache)
+))
+registry.register(Counter(
+    "note_cache_hits_total", "GET /notes/{note_id} reads served from the note cache.", callback=lambda: note_cache.hits
+))
+registry.register(Counter(
+    "note_cache_misses_total", "GET /notes/{note_id} reads that went to the database.", callback=lambda: note_cache.misses
+))
+registry.register(Counter(
+    "note_cache_invalidations_total", "Cached notes dropped by writes.", callback=lambda: note_cache.invalidations
+))
+registry.register(Gauge(
+    "websocket_subscribers", "Open /ws/notes connections.", callback=lambda: note_events.subscriber_count()
+))
+
+bearer_scheme = HTTPBearer(auto_error=False)
+
+NOTES_PAGE_DEFAULT = 100
+NOTES_PAGE_MAX = 500
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_FIELDS = NOTE_READ_FIELDS
+SEARCH_PAGE_DEFAULT = 20
+SEARCH_PAGE_MAX = 100
+CHANGES_PAGE_DEFAULT = 500
+CHANGES_PAGE_MAX = 1000
+# Offered ahead of the access token in Sec-WebSocket-Protocol, and echoed back on accept
+WS_AUTH_SUBPROTOCOL = "bearer"
+
+
+async def get_current_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
+    repository: Repository = Depends(get_repository)
+) -> User:
+    """
+    Resolve the bearer token to a User. FastAPI caches dependencies per
+    request, so the token is decoded once however many routes/sub-dependencies
+    ask for it, and decode_token serves repeat tokens from its payload cache.
+    """
+    if credentials is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    payload = decode_token(credentials.credentials)
+    if not payload or payload.get("type") != "access":
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid or expired token",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    user = await repository.get_user_by_username(payload.get("sub"))
+    if not user:
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid or expired token",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    return user
+
+
+def note_not_found() -> HTTPException:
+    # Other users' notes are reported as missing rather than forbidden
+    return HTTPException(status_code=404, detail="Note not found")
+
+
+def collection_etag(user: User) -> str:
+    # Buffered moves haven't bumped notes_version yet, so they tag the ETag instead
+    moves = position_buffer.owner_token(user.id)
+    if moves:
+        return f'W/"notes-{user.id}-{user.notes_version}-m{moves}"'
+    return f'W/"notes-{user.id}-{user.notes_version}"'
+
+
+def note_etag(note, moved: Optional[int] = None) -> str:
+    # SQLite hands a deleted note's id to the next insert, which starts again
+    # at version 1; the owner's revision never repeats, so it tells them apart
+    tag = f"note-{note.owner_id}-{note.id}-{note.revision}"
+    if moved:
+        return f'W/"{tag}-m{moved}"'
+    return f'W/"{tag}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
 
 @app.get("/")
 async def read_root():
     return {"Message":"Hello World!"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus text exposition of request, query and bcrypt metrics."""
+    return Response(content=registry.render(), media_type=METRICS_CONTENT_TYPE)
+
 @app.post("/register")
-async def register(credentials: UserCreate, session: Session = Depends(get_session)):
+async def register(credentials: UserCreate, repository: Repository = Depends(get_repository)):
     try:
-        db_user = session.exec(
-            select(User).where(User.username == credentials.username)).first()
+        db_user = await repository.get_user_by_username(credentials.username)
         if db_user:
             raise HTTPException(
                 status_code=400, 
                 detail="Username already registered"
             )
 
-        db_user = session.exec(
-            select(User).where(User.email == credentials.email)
-        ).first()
+        db_user = await repository.get_user_by_email(credentials.email)
         if db_user:
             raise HTTPException(
                 status_code=400, 
                 detail="Email already registered"
             )
 
-        new_user = User(
+        await repository.create_user(
             username=credentials.username,
             email=credentials.email,
-            password_hash=hash_password(credentials.password)
+            password_hash=await hash_password_async(credentials.password)
         )
 
-        session.add(new_user)
-        session.commit()
-        session.refresh(new_user)
-
         return {"Message": "Register endpoint"}
     except HTTPException:
         raise
+    except PasswordPoolBusy:
+        raise HTTPException(
+            status_code=503,
+            detail="Server busy, try again shortly",
+            headers={"Retry-After": "1"}
+        )
     
+    except DatabaseLocked:
+        # Nothing was committed; LockRetryMiddleware replays the request
+        raise
     except Exception as e:
         # put e in a log file
         raise HTTPException(status_code=500, detail="Failed to register user")
 
 @app.post("/login")
-async def login(credentials: LoginRequest, session: Session = Depends(get_session)):
+async def login(credentials: LoginRequest, repository: Repository = Depends(get_repository)):
     try:
-        user_query = select(User).where(User.username == credentials.username)  # Changed from UserBase to User
-        found_user = session.exec(user_query).first()
+        found_user = await repository.get_user_by_username(credentials.username)
         if not found_user:
             raise HTTPException(status_code=401, detail="Invalid username or password")
-        if not verify_password(credentials.password, found_user.password_hash):
+        if not await verify_password_async(credentials.password, found_user.password_hash):
             raise HTTPException(status_code=401, detail="Invalid username or password")
         
         access_token = create_access_token({"sub": found_user.username})
@@ -85,42 +239,390 @@ async def login(credentials: LoginRequest, session: Session = Depends(get_sessio
         }
     except HTTPException:
         raise
+    except PasswordPoolBusy:
+        raise HTTPException(
+            status_code=503,
+            detail="Server busy, try again shortly",
+            headers={"Retry-After": "1"}
+        )
     except Exception as e:
         # put e in a log file
         raise HTTPException(status_code=500, detail="Failed to login user")
     
 @app.post("/notes/", response_model=NoteRead)
-async def create_notes(note: NoteCreate, session: Session = Depends(get_session)):
+async def create_notes(
+    note: NoteCreate,
+    current_user: User = Depends(get_current_user),
+    repository: Repository = Depends(get_repository)
+):
     try:
-        db_note = Note.model_validate(note)
-
-        session.add(db_note)
-        session.commit()
-        session.refresh(db_note)
+        db_note = await repository.create_note(current_user.id, note.model_dump())
+        note_events.publish(db_note.owner_id, {
+            "type": "note.created", "revision": db_note.revision, "note": NoteRead.model_validate(db_note).model_dump()
+        })
 
         return db_note
+    except PaletteLimitExceeded as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except DatabaseLocked:
+        # Nothing was committed; LockRetryMiddleware replays the request
+        raise
     except Exception as e:
         # put e in a log file
         raise HTTPException(status_code=500, detail="Failed to create note")
 
         
 
-@app.get("/notes/", response_model=list[NoteRead])
-async def get_notes(session: Session = Depends(get_session)):
+@app.post("/notes/batch", response_model=NoteBatchResponse)
+async def batch_notes(
+    batch: NoteBatchRequest,
+    current_user: User = Depends(get_current_user),
+    repository: Repository = Depends(get_repository)
+):
+    """
+    Apply a mixed list of create/update/delete operations in one transaction.
+    Operations are resolved in order against an in-memory view of the caller's
+    notes, then written with one bulk statement per kind and a single commit.
+    Items that target a missing note get a 404 result; the rest still apply.
+    Updates are written only over the versions read here: if another write
+    got in between, nothing applies and the answer is 409.
+    """
     try:
-        notes = session.exec(select(Note)).all()
-        return notes
+        owner_id = current_user.id
+        target_ids = {op.id for op in batch.operations if op.op != "create"}
+        update_ids = [op.id for op in batch.operations if op.op == "update"]
+        # The notes are read inside too: a flush finishing meanwhile would
+        # leave this batch writing back the positions from before it
+        async with position_buffer.folding(owner_id, update_ids):
+            current = await repository.get_notes(owner_id, target_ids) if target_ids else {}
+            read_versions = {note_id: row["version"] for note_id, row in current.items()}
+
+            results = []
+            creates = []  # (index into results, column values)
+            dirty = set()
+            deleted = set()
+            buffered = {}  # note id -> seq of the pending move folded into this batch
+            for op in batch.operations:
+                if op.op == "create":
+                    creates.append((len(results), op.note.model_dump()))
+                    results.append(None)
+                    continue
+
+                if op.id not in current:
+                    results.append(NoteBatchResult(op=op.op, id=op.id, status=404, detail="Note not found"))
+                    continue
+
+                if op.op == "update":
+                    # A pending drag on this note is folded into the update, so the
+                    # flusher can't later overwrite what this batch writes
+                    moved = position_buffer.get(owner_id, op.id)
+                    if moved is not None:
+                        current[op.id].update(pos_x=moved[0], pos_y=moved[1])
+                        buffered[op.id] = moved[2]
+                    current[op.id].update(op.note.model_dump(exclude_unset=True, exclude_none=True))
+                    current[op.id]["version"] += 1
+                    dirty.add(op.id)
+                    results.append(NoteBatchResult(
+                        op=op.op, id=op.id, status=200, note=NoteRead.model_validate(current[op.id])
+                    ))
+                else:
+                    del current[op.id]
+                    dirty.discard(op.id)
+                    deleted.add(op.id)
+                    results.append(NoteBatchResult(op=op.op, id=op.id, status=200, detail="Note deleted"))
+
+            revision = None
+            if creates or dirty or deleted:
+                revision, new_ids = await repository.apply_batch(
+                    owner_id,
+                    [values for _, values in creates],
+                    [current[note_id] for note_id in sorted(dirty)],
+                    deleted,
+                    read_versions,
+                )
+                for (index, values), new_id in zip(creates, new_ids):
+                    results[index] = NoteBatchResult(
+                        op="create", id=new_id, status=200, note=NoteRead.model_validate({**values, "id": new_id, "owner_id": owner_id})
+                    )
+            note_cache.invalidate(owner_id, *dirty, *deleted)
+            for note_id, seq in buffered.items():
+                position_buffer.discard(owner_id, note_id, seq)
+            for note_id in deleted:
+                position_buffer.discard(owner_id, note_id)
+        for result in results:
+            if result.status != 200:
+                continue
+            if result.op == "delete":
+                event = {"type": "note.deleted", "revision": revision, "id": result.id}
+            else:
+                event_type = "note.created" if result.op == "create" else "note.updated"
+                event = {"type": event_type, "revision": revision, "note": result.note.model_dump()}
+            note_events.publish(owner_id, event)
+
+        return {"results": results}
+    except PaletteLimitExceeded as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except NoteConflict:
+        # Nothing was written; the client re-reads and sends the batch again
+        raise HTTPException(status_code=409, detail="A note changed while the batch ran; nothing was applied")
+    except DatabaseLocked:
+        # Nothing was committed; LockRetryMiddleware replays the request
+        raise
+    except Exception as e:
+        # put e in a log file
+        raise HTTPException(status_code=500, detail="Failed to apply batch")
+
+@app.get("/notes/", response_model=NotePage)
+async def get_notes(
+    response: Response,
+    limit: int = Query(default=NOTES_PAGE_DEFAULT, ge=1, le=NOTES_PAGE_MAX),
+    cursor: Optional[str] = Query(default=None),
+    x0: Optional[int] = Query(default=None, ge=0, le=5000),
+    y0: Optional[int] = Query(default=None, ge=0, le=5000),
+    x1: Optional[int] = Query(default=None, ge=0, le=5000),
+    y1: Optional[int] = Query(default=None, ge=0, le=5000),
+    if_none_match: Optional[str] = Header(default=None),
+    current_user: User = Depends(get_current_user),
+    repository: Repository = Depends(get_repository)
+):
+    viewport = (x0, y0, x1, y1)
+    if any(v is not None for v in viewport):
+        if any(v is None for v in viewport):
+            raise HTTPException(status_code=400, detail="Viewport needs all of x0, y0, x1, y1")
+        if x0 > x1 or y0 > y1:
+            raise HTTPException(status_code=400, detail="Viewport corners are reversed")
+    else:
+        viewport = None
+
+    after_id = 0
+    if cursor:
+        try:
+            cursor_owner, after_id = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if cursor_owner != current_user.id:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    # The version came with the user row, so an unchanged board costs no list query
+    etag = collection_etag(current_user)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+
+    try:
+        # Notes with a buffered move may have been dragged into view; the
+        # repository returns them too and they're filtered on the buffered
+        # position below
+        moved_ids = list(position_buffer.pending_for(current_user.id))
+        # Fetch one extra row to learn whether another page exists
+        notes = await repository.list_notes(current_user.id, after_id, limit + 1, viewport, moved_ids)
+
+        next_cursor = None
+        if len(notes) > limit:
+            notes = notes[:limit]
+            next_cursor = encode_cursor(current_user.id, notes[-1]["id"])
+
+        if moved_ids:
+            notes = [position_buffer.apply(current_user.id, note) for note in notes]
+            if viewport:
+                notes = [note for note in notes if x0 <= note["pos_x"] <= x1 and y0 <= note["pos_y"] <= y1]
+
+        page = {"items": notes, "next_cursor": next_cursor}
+        if FAST_JSON:
+            # Rows already have NoteRead's shape; skip response_model validation
+            return Response(content=dump_json(page), media_type="application/json", headers={"ETag": etag})
+        return page
     except Exception as e:
         # pput e in a log file
         raise HTTPException(status_code=500, detail="Failed to fetch notes")
 
+@app.get("/notes/changes", response_model=NoteChanges)
+async def get_note_changes(
+    since: Optional[str] = Query(default=None),
+    limit: int = Query(default=CHANGES_PAGE_DEFAULT, ge=1, le=CHANGES_PAGE_MAX),
+    current_user: User = Depends(get_current_user),
+    repository: Repository = Depends(get_repository)
+):
+    """
+    Delta sync: notes created/updated and ids deleted after the `since` cursor,
+    at most `limit` notes at a time. Without `since`, returns every note (a
+    full sync). With `has_more`, sync again from the returned cursor. Deletions
+    are kept for TOMBSTONE_RETENTION_DAYS; a cursor older than that gets 410
+    and the client starts over with a full sync.
+    """
+    after_revision, after_id = -1, None
+    if since:
+        try:
+            cursor_owner, after_revision, after_id = decode_sync_cursor(since)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if cursor_owner != current_user.id:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if after_revision < current_user.pruned_revision:
+            raise HTTPException(status_code=410, detail="Cursor too old; resync without since")
+
+    # SQLite doesn't hold a transaction across the reads below, so the delta
+    # stops at the revision read with the user row: a write landing meanwhile
+    # has a later revision and goes out with the next sync
+    current_revision = current_user.notes_version
+    if after_id is None and after_revision >= current_revision:
+        return {"changed": [], "deleted": [], "cursor": encode_sync_cursor(current_user.id, current_revision)}
+
+    try:
+        changed, deleted, next_position = await repository.changes_since(
+            current_user.id, (after_revision, after_id), current_revision, limit
+        )
+        if position_buffer.owner_token(current_user.id):
+            changed = [position_buffer.apply(current_user.id, note) for note in changed]
+        if next_position is None:
+            cursor = encode_sync_cursor(current_user.id, current_revision)
+        else:
+            cursor = encode_sync_cursor(current_user.id, *next_position)
+        changes = {"changed": changed, "deleted": deleted, "cursor": cursor, "has_more": next_position is not None}
+        if FAST_JSON:
+            return Response(content=dump_json(changes), media_type="application/json")
+        return changes
+    except Exception as e:
+        # put e in a log file
+        raise HTTPException(status_code=500, detail="Failed to fetch changes")
+
+@app.get("/notes/search", response_model=NoteSearchPage)
+async def search_notes(
+    q: str = Query(min_length=1, max_length=200),
+    limit: int = Query(default=SEARCH_PAGE_DEFAULT, ge=1, le=SEARCH_PAGE_MAX),
+    cursor: Optional[str] = Query(default=None),
+    current_user: User = Depends(get_current_user),
+    repository: Repository = Depends(get_repository)
+):
+    """
+    Full-text search over the caller's note bodies, best match first (bm25).
+    Every word in `q` must appear; the last may be a prefix. Each hit carries
+    a snippet with the matches in <mark>. Ranks shift as notes change, so the
+    cursor is an offset rather than a keyset position.
+    """
+    if not search_terms(q):
+        raise HTTPException(status_code=400, detail="Search needs at least one word")
+
+    offset = 0
+    if cursor:
+        try:
+            cursor_owner, offset = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if cursor_owner != current_user.id:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    try:
+        hits = await repository.search_notes(current_user.id, q, offset, limit + 1)
+
+        next_cursor = None
+        if len(hits) > limit:
+            hits = hits[:limit]
+            next_cursor = encode_cursor(current_user.id, offset + limit)
+
+        items = [{**note, "snippet": render_snippet(snippet)} for note, snippet in hits]
+        if position_buffer.owner_token(current_user.id):
+            items = [position_buffer.apply(current_user.id, item) for item in items]
+        page = {"items": items, "next_cursor": next_cursor}
+        if FAST_JSON:
+            return Response(content=dump_json(page), media_type="application/json")
+        return page
+    except Exception as e:
+        # put e in a log file
+        raise HTTPException(status_code=500, detail="Failed to search notes")
+
+@app.get("/notes/export")
+async def export_notes(
+    format: Literal["ndjson", "csv"] = Query(default="ndjson"),
+    current_user: User = Depends(get_current_user),
+    repository_factory = Depends(get_repository_factory)
+):
+    """
+    Stream every note the caller owns as NDJSON (one NoteRead object per line)
+    or CSV. Rows are pulled through a server-side cursor EXPORT_CHUNK_SIZE at a
+    time and written out chunk by chunk, so memory stays flat for any board size.
+    """
+    owner_id = current_user.id
+
+    def encode_ndjson(rows):
+        return "".join(
+            json.dumps(dict(zip(EXPORT_FIELDS, row)), ensure_ascii=False, separators=(",", ":")) + "\n"
+            for row in rows
+        ).encode("utf-8")
+
+    def encode_csv(rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode("utf-8")
+
+    encode = encode_csv if format == "csv" else encode_ndjson
+    id_index = EXPORT_FIELDS.index("id")
+    pos_x_index, pos_y_index = EXPORT_FIELDS.index("pos_x"), EXPORT_FIELDS.index("pos_y")
+
+    def with_buffered_positions(rows):
+        moved = position_buffer.pending_for(owner_id)
+        if not moved:
+            return rows
+        rows = [list(row) for row in rows]
+        for row in rows:
+            entry = moved.get(row[id_index])
+            if entry is not None:
+                row[pos_x_index], row[pos_y_index] = entry[0], entry[1]
+        return rows
+
+    async def body():
+        if format == "csv":
+            yield encode_csv([EXPORT_FIELDS])
+        async with repository_factory() as repository:
+            async for rows in repository.export_notes(owner_id, EXPORT_CHUNK_SIZE):
+                yield encode(with_buffered_positions(rows))
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        body(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="notes.{format}"'}
+    )
+
 @app.get("/notes/{note_id}", response_model=NoteRead)
-async def get_note(note_id: int = Path(ge=1), session: Session = Depends(get_session)):
+async def get_note(
+    note_id: int = Path(ge=1),
+    if_none_match: Optional[str] = Header(default=None),
+    current_user: User = Depends(get_current_user),
+    repository: Repository = Depends(get_repository)
+):
     try:
-        note = session.get(Note, note_id)
-        if not note:
-            raise HTTPException(status_code=404, detail="Note not found")
-        return note
+        moved = position_buffer.get(current_user.id, note_id)
+        if moved is not None:
+            # A buffered move isn't in the database (or the cache) yet; serve it
+            # laid over the stored row, tagged so the ETag changes with each move
+            note = await repository.get_note(current_user.id, note_id)
+            if note is None:
+                raise note_not_found()
+            etag = note_etag(note, moved[2])
+            if etag_matches(if_none_match, etag):
+                return not_modified(etag)
+            note = position_buffer.apply(current_user.id, NoteRead.model_validate(note).model_dump())
+            # Same encoder as the cached path, so the bytes don't depend on a pending drag
+            payload = NoteRead.model_validate(note).model_dump_json().encode("utf-8")
+            return Response(content=payload, media_type="application/json", headers={"ETag": etag})
+
+        cached = note_cache.get(current_user.id, note_id)
+        if cached is None:
+            generation = note_cache.generation
+            note = await repository.get_note(current_user.id, note_id)
+            if note is None:
+                raise note_not_found()
+            etag = note_etag(note)
+            payload = NoteRead.model_validate(note).model_dump_json().encode("utf-8")
+            note_cache.set(current_user.id, note_id, etag, payload, generation)
+        else:
+            etag, payload = cached
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        return Response(content=payload, media_type="application/json", headers={"ETag": etag})
+    except HTTPException:
+        raise
     except Exception as e:
         # put e in a log file
         raise HTTPException(status_code=500, detail="Failed to fetch note")
@@ -129,44 +631,176 @@ async def get_note(note_id: int = Path(ge=1), session: Session = Depends(get_ses
 async def update_note(
     note_update: NoteUpdate,
     note_id: int = Path(ge=1),
-    session: Session = Depends(get_session)
+    current_user: User = Depends(get_current_user),
+    repository: Repository = Depends(get_repository)
 ):
     try:
-        db_note = session.get(Note, note_id)
-        if not db_note:
-            raise HTTPException(status_code=404, detail="Note not found")
-
-        note_data = note_update.model_dump(exclude_unset=True)
-        for key, value in note_data.items():
-            setattr(db_note, key, value)
+        owner_id = current_user.id
+        # Fold a pending drag into this write so the flusher can't later
+        # overwrite it with an older position
+        async with position_buffer.folding(owner_id, [note_id]):
+            moved = position_buffer.get(owner_id, note_id)
+            values = {"pos_x": moved[0], "pos_y": moved[1]} if moved is not None else {}
+            values.update(note_update.model_dump(exclude_unset=True))
 
-        session.add(db_note)
-        session.commit()
-        session.refresh(db_note)
+            db_note = await repository.update_note(owner_id, note_id, values)
+            if db_note is None:
+                raise note_not_found()
+            note_cache.invalidate(db_note.owner_id, note_id)
+            if moved is not None:
+                position_buffer.discard(db_note.owner_id, note_id, moved[2])
+        note_events.publish(db_note.owner_id, {
+            "type": "note.updated", "revision": db_note.revision, "note": NoteRead.model_validate(db_note).model_dump()
+        })
 
         return db_note
+    except HTTPException:
+        raise
+    except PaletteLimitExceeded as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except DatabaseLocked:
+        # Nothing was committed; LockRetryMiddleware replays the request
+        raise
     except Exception as e:
         # put e in a log file
         raise HTTPException(status_code=500, detail="Failed to update note")
     
+@app.patch("/notes/{note_id}/position", response_model=NotePositionRead, status_code=202)
+async def move_note(
+    position: NotePosition,
+    note_id: int = Path(ge=1),
+    current_user: User = Depends(get_current_user),
+    repository: Repository = Depends(get_repository)
+):
+    """
+    Fast path for dragging: records the position in the write-behind buffer
+    and returns without writing. Only the latest move per note is kept; the
+    background flusher persists it within POSITION_FLUSH_INTERVAL_MS, and reads
+    see it immediately. A cached note or an earlier buffered move already
+    proves ownership, so a drag stream costs one existence check at most;
+    202 therefore means the move was accepted, not that the note still
+    exists. A note another process deleted meanwhile is skipped by the flush.
+
+    With POSITION_FLUSH_INTERVAL_MS=0, which runserver --workers sets, nothing
+    is buffered: each move is written here, like a PUT of the position, and
+    a missing note gets 404.
+    """
+    try:
+        owner_id = current_user.id
+        if position_buffer.write_through:
+            db_note = await repository.update_note(owner_id, note_id, {"pos_x": position.pos_x, "pos_y": position.pos_y})
+            if db_note is None:
+                raise note_not_found()
+            note_cache.invalidate(owner_id, note_id)
+        else:
+            known = position_buffer.get(owner_id, note_id) is not None or note_cache.contains(owner_id, note_id)
+            if not known:
+                if not await repository.note_exists(owner_id, note_id):
+                    raise note_not_found()
+            position_buffer.put(owner_id, note_id, position.pos_x, position.pos_y)
+
+        note_events.publish(owner_id, {"type": "note.moved", "id": note_id, "pos_x": position.pos_x, "pos_y": position.pos_y})
+        return {"id": note_id, "pos_x": position.pos_x, "pos_y": position.pos_y}
+    except HTTPException:
+        raise
+    except DatabaseLocked:
+        # Nothing was committed; LockRetryMiddleware replays the request
+        raise
+    except Exception as e:
+        # put e in a log file
+        raise HTTPException(status_code=500, detail="Failed to move note")
+
 @app.delete("/notes/{note_id}")
 async def delete_note(
     note_id: int = Path(ge=1),
-    session: Session = Depends(get_session)
+    current_user: User = Depends(get_current_user),
+    repository: Repository = Depends(get_repository)
 ):
     try:
-        db_note = session.get(Note, note_id)
-        if not db_note:
-            raise HTTPException(status_code=404, detail="Note not found")
-
-        session.delete(db_note)
-        session.commit()
+        owner_id = current_user.id
+        revision = await repository.delete_note(owner_id, note_id)
+        if revision is None:
+            raise note_not_found()
+        note_cache.invalidate(owner_id, note_id)
+        position_buffer.discard(owner_id, note_id)
+        note_events.publish(owner_id, {"type": "note.deleted", "revision": revision, "id": note_id})
 
         return {"detail": "Note deleted"}
+    except HTTPException:
+        raise
+    except DatabaseLocked:
+        # Nothing was committed; LockRetryMiddleware replays the request
+        raise
     except Exception as e:
         # put e in a log file
         raise HTTPException(status_code=500, detail="Failed to delete note")
 
+@app.websocket("/ws/notes")
+async def notes_socket(
+    websocket: WebSocket,
+    token: Optional[str] = Query(default=None),
+    repository_factory = Depends(get_repository_factory)
+):
+    """
+    Live feed of the caller's note changes. Authenticate with an access token.
+    Browsers can't set headers on a WebSocket, so offer the subprotocols
+    `bearer` and the token (Sec-WebSocket-Protocol); the socket is accepted
+    with `bearer`. A Bearer header works too. `?token=` is still accepted,
+    but the URL, token included, ends up in server and proxy access logs.
+    Each message is one JSON event: note.created / note.updated carry
+    the note, note.deleted its id, note.moved the buffered position. A socket
+    that falls WS_QUEUE_SIZE events behind is closed with 1013; reconnect and
+    catch up from GET /notes/changes. At the token's exp the socket is closed
+    with 1008; reconnect with a fresh token.
+    """
+    subprotocol = None
+    offered = [value.strip() for value in websocket.headers.get("sec-websocket-protocol", "").split(",")]
+    if len(offered) == 2 and offered[0] == WS_AUTH_SUBPROTOCOL:
+        subprotocol, token = WS_AUTH_SUBPROTOCOL, offered[1]
+    elif token is None:
+        scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+        token = credentials if scheme.lower() == "bearer" else None
+    payload = decode_token(token) if token else None
+    if not payload or payload.get("type") != "access":
+        await websocket.close(code=1008)
+        return
+    # Short-lived repository: the socket may stay open for hours
+    async with repository_factory() as repository:
+        user = await repository.get_user_by_username(payload.get("sub"))
+    if user is None:
+        await websocket.close(code=1008)
+        return
+    owner_id = user.id
+
+    await websocket.accept(subprotocol=subprotocol)
+    subscription = note_events.subscribe(owner_id)
+
+    async def watch_client():
+        # Client messages are ignored; this only notices the disconnect
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+        note_events.close(subscription)
+
+    async def expire():
+        await asyncio.sleep(payload["exp"] - time.time())
+        note_events.close(subscription, TOKEN_EXPIRED_CLOSE)
+
+    tasks = [asyncio.create_task(watch_client())]
+    if isinstance(payload.get("exp"), (int, float)):
+        tasks.append(asyncio.create_task(expire()))
+    try:
+        while (message := await subscription.get()) is not None:
+            await websocket.send_text(message)
+        if subscription.close_code is not None:
+            await websocket.close(code=subscription.close_code)
+    except Exception:
+        # The client went away mid-send
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        note_events.unsubscribe(subscription)
+
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,12 +1,117 @@
+import os
+from typing import Any, Callable, Dict
+from fastapi import Depends
+from sqlalchemy import event
 from sqlmodel import create_engine, SQLModel, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
 from .models import *
+from .utils.metrics import before_cursor_execute, after_cursor_execute
+from .utils.retry import raise_database_locked
+from .utils.idempotency import IDEMPOTENCY_STORE, InMemoryIdempotencyStore, SQLiteIdempotencyStore
+from .storage.base import Repository
+from .storage.memory import InMemoryRepository
+from .storage.sql import SQLModelRepository
 
-DATABASE_URL = "sqlite:///db.sqlite3"
-engine = create_engine(DATABASE_URL, echo=True)
+DB_PATH: str = os.getenv("DB_PATH", "db.sqlite3")
+DATABASE_URL = f"sqlite:///{DB_PATH}"
+ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{DB_PATH}"
+
+# "dev" keeps SQLite's defaults; "production" trades a little durability on
+# power loss (synchronous=NORMAL under WAL) for much cheaper commits
+DB_PROFILE: str = os.getenv("DB_PROFILE", "dev")
+DB_ECHO: bool = os.getenv("DB_ECHO", "0").lower() in ("1", "true", "yes")
+
+# "sqlmodel" stores everything in the SQLite file above; "memory" keeps it in
+# this process only (gone on restart, and not shared between --workers)
+STORAGE_BACKEND: str = os.getenv("STORAGE_BACKEND", "sqlmodel")
+if STORAGE_BACKEND not in ("sqlmodel", "memory"):
+    raise RuntimeError("STORAGE_BACKEND must be sqlmodel or memory")
+if IDEMPOTENCY_STORE == "sqlite" and STORAGE_BACKEND == "memory":
+    raise RuntimeError("IDEMPOTENCY_STORE=sqlite needs STORAGE_BACKEND=sqlmodel")
+
+DB_PROFILES: Dict[str, Dict[str, Any]] = {
+    "dev": {
+        "pragmas": {
+            "busy_timeout": 5000,
+        },
+        "pool": {},
+    },
+    "production": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "mmap_size": int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024))),
+            "cache_size": int(os.getenv("DB_CACHE_SIZE", "-65536")),  # negative = KiB, so 64 MiB
+            "busy_timeout": int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000")),
+            "temp_store": "MEMORY",
+        },
+        "pool": {
+            "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+            "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+            "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+        },
+    },
+}
+
+
+def get_profile(profile: str = DB_PROFILE) -> Dict[str, Any]:
+    if profile not in DB_PROFILES:
+        raise RuntimeError(f"DB_PROFILE must be one of {', '.join(DB_PROFILES)}")
+    return DB_PROFILES[profile]
+
+
+def _pragma_listener(pragmas: Dict[str, Any]):
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+    return set_sqlite_pragmas
+
+
+def instrument_engine(sync_engine) -> None:
+    """Feed statement count and timing into the /metrics registry."""
+    event.listen(sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", after_cursor_execute)
+
+
+def retry_locked_writes(sync_engine) -> None:
+    """Raise DatabaseLocked for lock contention, so LockRetryMiddleware can replay the request."""
+    event.listen(sync_engine, "handle_error", raise_database_locked)
+
+
+def create_db_engine(url: str = DATABASE_URL, profile: str = DB_PROFILE, echo: bool = DB_ECHO):
+    settings = get_profile(profile)
+    db_engine = create_engine(url, echo=echo, **settings["pool"])
+    event.listen(db_engine, "connect", _pragma_listener(settings["pragmas"]))
+    instrument_engine(db_engine)
+    retry_locked_writes(db_engine)
+    return db_engine
+
+
+def create_async_db_engine(url: str = ASYNC_DATABASE_URL, profile: str = DB_PROFILE, echo: bool = DB_ECHO):
+    settings = get_profile(profile)
+    db_engine = create_async_engine(url, echo=echo, **settings["pool"])
+    event.listen(db_engine.sync_engine, "connect", _pragma_listener(settings["pragmas"]))
+    instrument_engine(db_engine.sync_engine)
+    retry_locked_writes(db_engine.sync_engine)
+    return db_engine
+
+
+# Sync engine is kept for alembic and scripts; routes use the async engine
+engine = create_db_engine()
+async_engine = create_async_db_engine()
 
 def initialize_db():
     SQLModel.metadata.create_all(engine)
 
+async def initialize_async_db():
+    if STORAGE_BACKEND == "memory":
+        return
+    async with async_engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+
 def get_session():
     session = Session(engine)
     try:
@@ -15,4 +120,56 @@ def get_session():
         session.rollback()
         raise
     finally:
-        session.close()
\ No newline at end of file
+        session.close()
+
+def open_async_session(bind=None) -> AsyncSession:
+    """
+    New AsyncSession on `bind` (the app's async engine by default). Objects
+    stay loaded after commit: writes read their rows back with RETURNING in
+    the same statement, so there is nothing to refresh.
+    """
+    return AsyncSession(async_engine if bind is None else bind, expire_on_commit=False)
+
+def get_session_factory():
+    """
+    Dependency returning a callable that opens a new AsyncSession. For work
+    that outlives the handler, such as a StreamingResponse body, which runs
+    after yield-dependencies like get_async_session have already closed.
+    """
+    return open_async_session
+
+async def get_async_session():
+    session = open_async_session()
+    try:
+        yield session
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
+
+
+memory_repository = InMemoryRepository()
+
+# Responses kept for Idempotency-Key replays
+if IDEMPOTENCY_STORE == "sqlite":
+    idempotency_store = SQLiteIdempotencyStore(async_engine)
+else:
+    idempotency_store = InMemoryIdempotencyStore()
+
+
+def get_repository(session: AsyncSession = Depends(get_async_session)) -> Repository:
+    """Dependency returning the request's repository; the SQL one shares the request's session."""
+    if STORAGE_BACKEND == "memory":
+        return memory_repository
+    return SQLModelRepository(session)
+
+
+def get_repository_factory(session_factory=Depends(get_session_factory)) -> Callable[[], Repository]:
+    """
+    Dependency returning a callable that opens a repository, to use as
+    `async with factory() as repository:` where get_session_factory would be.
+    """
+    if STORAGE_BACKEND == "memory":
+        return lambda: memory_repository
+    return lambda: SQLModelRepository(session_factory())
@@ -1,5 +1,11 @@
+from pydantic import model_validator
+from sqlalchemy import DDL, Column, Computed, Index, Integer, UniqueConstraint, event
 from sqlmodel import SQLModel, Field, Relationship
-from typing import Optional, List
+from typing import Optional, List, Literal, Union
+from typing_extensions import Annotated
+from .utils.spatial import GRID_CELL_EXPR
+from .utils.search import NOTE_FTS_CREATE, NOTE_FTS_DROP
+from .utils.palettes import PaletteKey, palette_cache
 
 
 class TokenPayload(SQLModel):
@@ -27,6 +33,10 @@ class User(UserBase, table=True):
     username: str = Field(index=True, unique=True, nullable=False, min_length=3, max_length=30)
     email: str = Field(index=True, unique=True, nullable=False, regex=r"^[\w\.-]+@[\w\.-]+\.\w+$")
     password_hash: str = Field(nullable=False)  # stored as hash, not raw password
+    # Bumped on every write to this user's notes; drives the collection ETag
+    notes_version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    # Newest revision whose tombstones were pruned; older sync cursors get 410
+    pruned_revision: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
 
     # Relationship
     notes: List["Note"] = Relationship(back_populates="owner")
@@ -50,11 +60,110 @@ class NoteBase(SQLModel):
     pos_y: int = Field(ge=0, le=5000)
 
 
-class Note(NoteBase, table=True):
+class Palette(SQLModel, table=True):
+    """One distinct set of note colors. Rows are never changed, so they can be cached; runserver prunes unused ones."""
+    __table_args__ = (
+        UniqueConstraint("color_id", "color_header", "color_body", "color_text", name="uq_palette_colors"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    color_id: str = Field(max_length=20, nullable=False)
+    color_header: str = Field(nullable=False)
+    color_body: str = Field(nullable=False)
+    color_text: str = Field(nullable=False)
+
+
+class Note(SQLModel, table=True):
+    # Keyset pagination walks (owner_id, id); viewport queries seek (owner_id, grid_cell)
+    __table_args__ = (
+        Index("ix_note_owner_id_id", "owner_id", "id"),
+        Index("ix_note_owner_id_grid_cell", "owner_id", "grid_cell"),
+        Index("ix_note_owner_id_revision", "owner_id", "revision"),
+    )
+
+    body: str = Field(max_length=500, nullable=False)
+    pos_x: int = Field(nullable=False)
+    pos_y: int = Field(nullable=False)
+    # The colors live in `palette`, shared by every note that uses them
+    palette_id: int = Field(foreign_key="palette.id", nullable=False)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     owner_id: Optional[int] = Field(default=None, foreign_key="user.id")
+    version: int = Field(default=1, sa_column_kwargs={"server_default": "1"})  # bumped on every update
+    # Owner's notes_version as of the last write to this note; feeds /notes/changes
+    revision: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    # Computed by SQLite from pos_x/pos_y, never written by the app
+    grid_cell: Optional[int] = Field(
+        default=None,
+        sa_column=Column(Integer, Computed(GRID_CELL_EXPR, persisted=False))
+    )
     owner: Optional["User"] = Relationship(back_populates="notes")
 
+    # NoteRead's color fields, resolved through palette_cache; whoever loads
+    # a note makes sure its palette is cached
+    @property
+    def palette(self) -> PaletteKey:
+        palette = palette_cache.get(self.palette_id)
+        if palette is None:
+            raise LookupError(f"palette {self.palette_id} is not cached")
+        return palette
+
+    @property
+    def color_id(self) -> str:
+        return self.palette[0]
+
+    @property
+    def color_header(self) -> str:
+        return self.palette[1]
+
+    @property
+    def color_body(self) -> str:
+        return self.palette[2]
+
+    @property
+    def color_text(self) -> str:
+        return self.palette[3]
+
+
+# The FTS5 index and its sync triggers aren't mapped tables, so create_all()
+# (tests, initialize_db) builds them alongside `note`; Alembic has its own migration
+for statement in NOTE_FTS_CREATE:
+    event.listen(Note.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+for statement in NOTE_FTS_DROP:
+    event.listen(Note.__table__, "before_drop", DDL(statement).execute_if(dialect="sqlite"))
+
+
+class NoteTombstone(SQLModel, table=True):
+    """Left behind by a delete so delta sync can report it; pruned after TOMBSTONE_RETENTION_DAYS."""
+    __tablename__ = "note_tombstone"
+    __table_args__ = (Index("ix_note_tombstone_owner_id_revision", "owner_id", "revision"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    note_id: int = Field(nullable=False)
+    owner_id: int = Field(foreign_key="user.id", nullable=False)
+    revision: int = Field(nullable=False)
+    deleted_at: float = Field(index=True, nullable=False)  # unix time
+
+
+class ImportCheckpoint(SQLModel, table=True):
+    """How many records of a file `main.py import` has committed; advanced in the same transaction as each chunk."""
+    __tablename__ = "import_checkpoint"
+
+    source: str = Field(primary_key=True)  # "users:" or "notes:" plus the file's absolute path
+    rows: int = Field(default=0, nullable=False)
+
+
+class IdempotencyRecord(SQLModel, table=True):
+    """A response kept for replay under its Idempotency-Key; `status` is NULL while the first request is running."""
+    __tablename__ = "idempotency_key"
+
+    key: str = Field(primary_key=True)  # scope (user or anonymous), method, path and the client's key
+    fingerprint: str = Field(nullable=False)  # hash of the request, so a reused key with another body is caught
+    status: Optional[int] = Field(default=None)
+    headers: Optional[str] = Field(default=None)  # JSON list of [name, value]
+    body: Optional[bytes] = Field(default=None)
+    expires_at: float = Field(index=True, nullable=False)  # epoch seconds
+
 
 class NoteCreate(NoteBase):
     pass
@@ -65,6 +174,27 @@ class NoteRead(NoteBase):
     owner_id: Optional[int]
 
 
+class NotePage(SQLModel):
+    items: List[NoteRead]
+    next_cursor: Optional[str] = None  # pass back as ?cursor= to get the next page
+
+
+class NoteSearchHit(NoteRead):
+    snippet: str  # HTML-escaped excerpt of the body, matches wrapped in <mark>
+
+
+class NoteSearchPage(SQLModel):
+    items: List[NoteSearchHit]
+    next_cursor: Optional[str] = None
+
+
+class NoteChanges(SQLModel):
+    changed: List[NoteRead]  # created or updated since the cursor
+    deleted: List[int]  # ids deleted since the cursor
+    cursor: str  # pass back as ?since= on the next sync
+    has_more: bool = False  # the delta was cut at `limit`; sync again from `cursor` right away
+
+
 class NoteUpdate(SQLModel):
     body: Optional[str] = Field(default=None, min_length=1, max_length=500)
     color_id: Optional[str] = Field(default=None, max_length=20)
@@ -73,3 +203,60 @@ class NoteUpdate(SQLModel):
     color_text: Optional[str] = Field(default=None, regex=r"^#(?:[0-9a-fA-F]{3}){1,2}$")
     pos_x: Optional[int] = Field(default=None, ge=0, le=5000)
     pos_y: Optional[int] = Field(default=None, ge=0, le=5000)
+
+    # Fields are optional to leave out, but every note column is NOT NULL
+    @model_validator(mode="before")
+    @classmethod
+    def reject_nulls(cls, data):
+        if isinstance(data, dict):
+            nulls = sorted(field for field, value in data.items() if value is None)
+            if nulls:
+                raise ValueError(f"{', '.join(nulls)} can't be null")
+        return data
+
+
+class NotePosition(SQLModel):
+    pos_x: int = Field(ge=0, le=5000)
+    pos_y: int = Field(ge=0, le=5000)
+
+
+class NotePositionRead(NotePosition):
+    id: int
+
+
+class NoteBatchCreate(SQLModel):
+    op: Literal["create"]
+    note: NoteCreate
+
+
+class NoteBatchUpdate(SQLModel):
+    op: Literal["update"]
+    id: int = Field(ge=1)
+    note: NoteUpdate
+
+
+class NoteBatchDelete(SQLModel):
+    op: Literal["delete"]
+    id: int = Field(ge=1)
+
+
+NoteBatchOperation = Annotated[
+    Union[NoteBatchCreate, NoteBatchUpdate, NoteBatchDelete],
+    Field(discriminator="op"),
+]
+
+
+class NoteBatchRequest(SQLModel):
+    operations: List[NoteBatchOperation] = Field(min_length=1, max_length=500)
+
+
+class NoteBatchResult(SQLModel):
+    op: str
+    status: int  # per-item HTTP-style status: 200 applied, 404 note not found
+    id: Optional[int] = None
+    note: Optional[NoteRead] = None
+    detail: Optional[str] = None
+
+
+class NoteBatchResponse(SQLModel):
+    results: List[NoteBatchResult]
@@ -0,0 +1,126 @@
+from typing import AsyncIterator, Collection, Dict, Iterable, List, Optional, Protocol, Tuple
+
+from ..models import Note, NoteRead, User
+
+# Collection reads hand back plain NoteRead-shaped dicts (or tuples in this
+# field order, for export) rather than model objects; routes serialize them as is
+NOTE_READ_FIELDS = list(NoteRead.model_fields)
+
+# (x0, y0, x1, y1), inclusive
+Viewport = Tuple[int, int, int, int]
+# owner id -> note id -> (pos_x, pos_y)
+PositionMoves = Dict[int, Dict[int, Tuple[int, int]]]
+# (revision, note id) a delta sync has delivered up to; a None id means all of that revision
+SyncPosition = Tuple[int, Optional[int]]
+
+
+class NoteConflict(Exception):
+    """A batch update found a note changed or deleted since the batch read it; nothing was written."""
+
+
+class UserRepository(Protocol):
+    """User lookups and registration. Returned users expose User's attributes."""
+
+    async def get_user_by_username(self, username: str) -> Optional[User]: ...
+    async def get_user_by_email(self, email: str) -> Optional[User]: ...
+    async def create_user(self, username: str, email: str, password_hash: str) -> User: ...
+
+
+class NoteRepository(Protocol):
+    """
+    Note storage. Every method is scoped to one owner, and every write is its
+    own transaction: it bumps the owner's notes_version once and stamps the new
+    value as the revision of each note (or tombstone) it produces. Single-note
+    methods return an object with Note's attributes.
+    """
+
+    async def get_note(self, owner_id: int, note_id: int) -> Optional[Note]: ...
+    async def note_exists(self, owner_id: int, note_id: int) -> bool: ...
+
+    async def get_notes(self, owner_id: int, note_ids: Iterable[int]) -> Dict[int, dict]:
+        """Every column of the given notes, colors included, by id; missing ids are left out."""
+
+    async def list_notes(
+        self,
+        owner_id: int,
+        after_id: int,
+        limit: int,
+        viewport: Optional[Viewport] = None,
+        include_ids: Collection[int] = (),
+    ) -> List[dict]:
+        """
+        Up to `limit` notes with id > after_id in id order. With `viewport`,
+        only notes inside it, plus any in `include_ids` wherever they are.
+        """
+
+    async def changes_since(
+        self, owner_id: int, after: SyncPosition, through_revision: int, limit: int
+    ) -> Tuple[List[dict], List[int], Optional[SyncPosition]]:
+        """
+        Up to `limit` notes written after `after` and no later than
+        `through_revision`, in (revision, id) order, and the ids deleted in the
+        revisions those notes cover that haven't come back. The last value is
+        where the next page starts, or None once through_revision is reached.
+        Revision -1 means everything, with no deletions.
+        """
+
+    async def search_notes(self, owner_id: int, q: str, offset: int, limit: int) -> List[Tuple[dict, str]]:
+        """
+        (note, snippet) pairs for notes containing every word of `q`, the last
+        one as a prefix, best match first. Snippets mark matches with
+        SNIPPET_OPEN/SNIPPET_CLOSE and are not escaped.
+        """
+
+    def export_notes(self, owner_id: int, chunk_size: int) -> AsyncIterator[List[tuple]]:
+        """All the owner's notes in id order as NOTE_READ_FIELDS tuples, chunk_size at a time."""
+
+    async def create_note(self, owner_id: int, values: dict) -> Note: ...
+
+    async def update_note(self, owner_id: int, note_id: int, values: dict) -> Optional[Note]:
+        """
+        Apply `values` and bump the note's version; None if the owner has no
+        such note. None values are skipped, since no note column is nullable.
+        """
+
+    async def delete_note(self, owner_id: int, note_id: int) -> Optional[int]:
+        """Delete and leave a tombstone; returns the revision, or None if the owner has no such note."""
+
+    async def apply_batch(
+        self,
+        owner_id: int,
+        creates: List[dict],
+        updates: List[dict],
+        deletes: Collection[int],
+        read_versions: Dict[int, int],
+    ) -> Tuple[int, List[int]]:
+        """
+        Insert `creates`, overwrite notes with the full rows in `updates` and
+        delete `deletes`, all under one revision. Returns the revision and the
+        new ids, in the order of `creates`. An updated note whose version is
+        no longer its `read_versions` entry (written or deleted since it was
+        read) raises NoteConflict, and nothing is written.
+        """
+
+    async def apply_positions(self, moves: PositionMoves) -> int:
+        """
+        Write buffered positions: one revision per owner, version + 1 per note.
+        Notes deleted (or never owned) are skipped. Returns the notes written.
+        """
+
+    async def prune_tombstones(self, before: float) -> int:
+        """
+        Drop tombstones deleted before `before` (unix time), raising each
+        affected owner's pruned_revision to the newest one dropped. Returns
+        the tombstones dropped.
+        """
+
+
+class Repository(UserRepository, NoteRepository, Protocol):
+    """
+    What the routes talk to. Used as an async context manager when opened
+    outside a request (export bodies, the position flusher, the tombstone
+    pruner, sockets).
+    """
+
+    async def __aenter__(self) -> "Repository": ...
+    async def __aexit__(self, *exc) -> None: ...
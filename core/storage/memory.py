@@ -0,0 +1,337 @@
+import bisect
+import threading
+import time
+import unicodedata
+from typing import AsyncIterator, Collection, Dict, Iterable, List, Optional, Tuple
+
+from ..utils.search import SNIPPET_CLOSE, SNIPPET_ELLIPSIS, SNIPPET_OPEN, SNIPPET_TOKENS, search_terms, term_spans
+from .base import NOTE_READ_FIELDS, NoteConflict, PositionMoves, SyncPosition, Viewport
+
+NOTE_FIELDS = (
+    "id", "body", "color_id", "color_header", "color_body", "color_text",
+    "pos_x", "pos_y", "owner_id", "version", "revision",
+)
+USER_FIELDS = ("id", "username", "email", "password_hash", "notes_version", "pruned_revision")
+
+
+class NoteRecord:
+    """A stored note: Note's columns as slots, no per-instance dict."""
+    __slots__ = NOTE_FIELDS
+
+    def __init__(self, **values):
+        for field in NOTE_FIELDS:
+            setattr(self, field, values.get(field))
+
+    def to_dict(self, fields: Iterable[str] = NOTE_FIELDS) -> dict:
+        return {field: getattr(self, field) for field in fields}
+
+
+class UserRecord:
+    """A stored user, as slots."""
+    __slots__ = USER_FIELDS
+
+    def __init__(self, **values):
+        for field in USER_FIELDS:
+            setattr(self, field, values.get(field))
+
+
+def _fold(word: str) -> str:
+    # What FTS5's unicode61 tokenizer with remove_diacritics does: case- and accent-insensitive
+    decomposed = unicodedata.normalize("NFKD", word.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+class InMemoryRepository:
+    """
+    Process-local repository for ephemeral deployments and fast tests. Notes
+    and users live in dicts keyed by id, with secondary indexes on username,
+    email and owner. Each owner's note ids are kept in a sorted list, so a
+    keyset page is a bisect plus a slice. Ids are never reused.
+
+    Every method finishes without awaiting, so each call is atomic on its
+    event loop; the lock covers callers on other threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.users: Dict[int, UserRecord] = {}
+        self.users_by_username: Dict[str, UserRecord] = {}
+        self.users_by_email: Dict[str, UserRecord] = {}
+        self.notes: Dict[int, NoteRecord] = {}
+        self.note_ids_by_owner: Dict[int, List[int]] = {}
+        # owner id -> [(revision, note id, deleted_at)], in revision order
+        self.tombstones: Dict[int, List[Tuple[int, int, float]]] = {}
+        self._next_user_id = 1
+        self._next_note_id = 1
+
+    async def __aenter__(self) -> "InMemoryRepository":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        pass
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reset()
+
+    # Users
+
+    async def get_user_by_username(self, username: str) -> Optional[UserRecord]:
+        return self.users_by_username.get(username)
+
+    async def get_user_by_email(self, email: str) -> Optional[UserRecord]:
+        return self.users_by_email.get(email)
+
+    async def create_user(self, username: str, email: str, password_hash: str) -> UserRecord:
+        with self._lock:
+            if username in self.users_by_username or email in self.users_by_email:
+                raise ValueError("username or email already registered")
+            user = UserRecord(
+                id=self._next_user_id, username=username, email=email, password_hash=password_hash,
+                notes_version=0, pruned_revision=0,
+            )
+            self._next_user_id += 1
+            self.users[user.id] = user
+            self.users_by_username[username] = user
+            self.users_by_email[email] = user
+            return user
+
+    # Note reads
+
+    def _owned(self, owner_id: int, note_id: int) -> Optional[NoteRecord]:
+        note = self.notes.get(note_id)
+        return note if note is not None and note.owner_id == owner_id else None
+
+    def _bump(self, owner_id: int) -> int:
+        user = self.users[owner_id]
+        user.notes_version += 1
+        return user.notes_version
+
+    async def get_note(self, owner_id: int, note_id: int) -> Optional[NoteRecord]:
+        return self._owned(owner_id, note_id)
+
+    async def note_exists(self, owner_id: int, note_id: int) -> bool:
+        return self._owned(owner_id, note_id) is not None
+
+    async def get_notes(self, owner_id: int, note_ids: Iterable[int]) -> Dict[int, dict]:
+        with self._lock:
+            found = (self._owned(owner_id, note_id) for note_id in set(note_ids))
+            return {note.id: note.to_dict() for note in found if note is not None}
+
+    async def list_notes(
+        self,
+        owner_id: int,
+        after_id: int,
+        limit: int,
+        viewport: Optional[Viewport] = None,
+        include_ids: Collection[int] = (),
+    ) -> List[dict]:
+        with self._lock:
+            ids = self.note_ids_by_owner.get(owner_id, [])
+            start = bisect.bisect_right(ids, after_id)
+            if viewport is None:
+                return [self.notes[note_id].to_dict(NOTE_READ_FIELDS) for note_id in ids[start:start + limit]]
+
+            x0, y0, x1, y1 = viewport
+            page = []
+            for note_id in ids[start:]:
+                note = self.notes[note_id]
+                if (x0 <= note.pos_x <= x1 and y0 <= note.pos_y <= y1) or note_id in include_ids:
+                    page.append(note.to_dict(NOTE_READ_FIELDS))
+                    if len(page) == limit:
+                        break
+            return page
+
+    async def changes_since(
+        self, owner_id: int, after: SyncPosition, through_revision: int, limit: int
+    ) -> Tuple[List[dict], List[int], Optional[SyncPosition]]:
+        after_revision, after_id = after
+        start = (after_revision, float("inf") if after_id is None else after_id)
+        with self._lock:
+            ids = self.note_ids_by_owner.get(owner_id, [])
+            changed = sorted(
+                (
+                    note for note in (self.notes[note_id] for note_id in ids)
+                    if start < (note.revision, note.id) and note.revision <= through_revision
+                ),
+                key=lambda note: (note.revision, note.id),
+            )
+            next_position = None
+            if len(changed) > limit:
+                changed = changed[:limit]
+                next_position = (changed[-1].revision, changed[-1].id)
+                through_revision = changed[-1].revision
+            deleted: List[int] = []
+            if after_revision >= 0:
+                tombstones = self.tombstones.get(owner_id, [])
+                first = bisect.bisect_right(tombstones, (after_revision, float("inf")))
+                seen = set()
+                for revision, note_id, _ in tombstones[first:]:
+                    if revision > through_revision:
+                        break
+                    if note_id not in seen and self._owned(owner_id, note_id) is None:
+                        seen.add(note_id)
+                        deleted.append(note_id)
+            return [note.to_dict(NOTE_READ_FIELDS) for note in changed], deleted, next_position
+
+    async def search_notes(self, owner_id: int, q: str, offset: int, limit: int) -> List[Tuple[dict, str]]:
+        terms = [_fold(term) for term in search_terms(q)]
+        if not terms:
+            return []
+        *whole, prefix = terms
+        hits = []
+        with self._lock:
+            for note_id in self.note_ids_by_owner.get(owner_id, []):
+                note = self.notes[note_id]
+                words = [_fold(word) for word in search_terms(note.body)]
+                matched = [word in whole or word.startswith(prefix) for word in words]
+                if not all(term in words for term in whole) or not any(word.startswith(prefix) for word in words):
+                    continue
+                # Term density stands in for bm25: more of the note matching ranks higher
+                score = sum(matched) / len(words)
+                hits.append((-score, note.id, note.to_dict(NOTE_READ_FIELDS), matched))
+        hits.sort(key=lambda hit: hit[:2])
+        return [(note, _snippet(note["body"], matched)) for _, _, note, matched in hits[offset:offset + limit]]
+
+    async def export_notes(self, owner_id: int, chunk_size: int) -> AsyncIterator[List[tuple]]:
+        with self._lock:
+            ids = list(self.note_ids_by_owner.get(owner_id, []))
+        for start in range(0, len(ids), chunk_size):
+            with self._lock:
+                rows = [
+                    tuple(getattr(note, field) for field in NOTE_READ_FIELDS)
+                    for note in (self.notes.get(note_id) for note_id in ids[start:start + chunk_size])
+                    if note is not None
+                ]
+            yield rows
+
+    # Note writes
+
+    def _insert(self, owner_id: int, values: dict, revision: int) -> NoteRecord:
+        note = NoteRecord(**values, id=self._next_note_id, owner_id=owner_id, version=1, revision=revision)
+        self._next_note_id += 1
+        self.notes[note.id] = note
+        # Ids only grow, so appending keeps the owner's index sorted
+        self.note_ids_by_owner.setdefault(owner_id, []).append(note.id)
+        return note
+
+    def _remove(self, owner_id: int, note_id: int, revision: int) -> None:
+        del self.notes[note_id]
+        ids = self.note_ids_by_owner[owner_id]
+        del ids[bisect.bisect_left(ids, note_id)]
+        self.tombstones.setdefault(owner_id, []).append((revision, note_id, time.time()))
+
+    async def create_note(self, owner_id: int, values: dict) -> NoteRecord:
+        with self._lock:
+            return self._insert(owner_id, values, self._bump(owner_id))
+
+    async def update_note(self, owner_id: int, note_id: int, values: dict) -> Optional[NoteRecord]:
+        with self._lock:
+            note = self._owned(owner_id, note_id)
+            if note is None:
+                return None
+            revision = self._bump(owner_id)
+            for key, value in values.items():
+                # Every column is NOT NULL; a None means "leave it", as in the SQL backend
+                if value is not None:
+                    setattr(note, key, value)
+            note.version += 1
+            note.revision = revision
+            return note
+
+    async def delete_note(self, owner_id: int, note_id: int) -> Optional[int]:
+        with self._lock:
+            if self._owned(owner_id, note_id) is None:
+                return None
+            revision = self._bump(owner_id)
+            self._remove(owner_id, note_id, revision)
+            return revision
+
+    async def apply_batch(
+        self,
+        owner_id: int,
+        creates: List[dict],
+        updates: List[dict],
+        deletes: Collection[int],
+        read_versions: Dict[int, int],
+    ) -> Tuple[int, List[int]]:
+        with self._lock:
+            changed = [
+                row["id"] for row in updates
+                if getattr(self._owned(owner_id, row["id"]), "version", None) != read_versions[row["id"]]
+            ]
+            if changed:
+                raise NoteConflict(f"{len(changed)} note(s) changed since the batch read them")
+            revision = self._bump(owner_id)
+            new_ids = [self._insert(owner_id, values, revision).id for values in creates]
+            for row in updates:
+                note = self.notes[row["id"]]
+                for key, value in row.items():
+                    setattr(note, key, value)
+                note.revision = revision
+            for note_id in deletes:
+                if self._owned(owner_id, note_id) is not None:
+                    self._remove(owner_id, note_id, revision)
+            return revision, new_ids
+
+    async def apply_positions(self, moves: PositionMoves) -> int:
+        written = 0
+        with self._lock:
+            for owner_id, notes in moves.items():
+                if owner_id not in self.users:
+                    continue
+                revision = self._bump(owner_id)
+                for note_id, (x, y) in notes.items():
+                    note = self._owned(owner_id, note_id)
+                    if note is None:
+                        continue
+                    note.pos_x, note.pos_y = x, y
+                    note.version += 1
+                    note.revision = revision
+                    written += 1
+        return written
+
+    async def prune_tombstones(self, before: float) -> int:
+        pruned = 0
+        with self._lock:
+            for owner_id, tombstones in self.tombstones.items():
+                kept = [tombstone for tombstone in tombstones if tombstone[2] >= before]
+                if len(kept) < len(tombstones):
+                    user = self.users[owner_id]
+                    newest = max(tombstone[0] for tombstone in tombstones if tombstone[2] < before)
+                    user.pruned_revision = max(user.pruned_revision, newest)
+                    pruned += len(tombstones) - len(kept)
+                    tombstones[:] = kept
+        return pruned
+
+
+def _snippet(body: str, matched: List[bool]) -> str:
+    """
+    Mirror of FTS5's snippet(): a window of SNIPPET_TOKENS words starting at
+    the first match, matches wrapped in SNIPPET_OPEN/SNIPPET_CLOSE, elided
+    ends marked with SNIPPET_ELLIPSIS.
+    """
+    spans = term_spans(body)
+    if not spans:
+        return body
+    first = matched.index(True) if True in matched else 0
+    start = max(0, min(first, len(spans) - SNIPPET_TOKENS))
+    end = min(len(spans), start + SNIPPET_TOKENS)
+
+    parts = [SNIPPET_ELLIPSIS] if start > 0 else []
+    cursor = spans[start][0] if start > 0 else 0
+    for index in range(start, end):
+        token_start, token_end = spans[index]
+        parts.append(body[cursor:token_start])
+        token = body[token_start:token_end]
+        parts.append(SNIPPET_OPEN + token + SNIPPET_CLOSE if matched[index] else token)
+        cursor = token_end
+    if end < len(spans):
+        parts.append(SNIPPET_ELLIPSIS)
+    else:
+        parts.append(body[cursor:])
+    return "".join(parts)
+
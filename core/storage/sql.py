@@ -0,0 +1,470 @@
+import time
+from typing import AsyncIterator, Collection, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, bindparam, column, delete, exists, func, insert, literal_column, or_, table, tuple_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ..models import Note, NoteTombstone, Palette, User
+from ..utils.palettes import PALETTE_FIELDS, PALETTES_PER_OWNER_MAX, PaletteKey, PaletteLimitExceeded, palette_cache, palette_key
+from ..utils.search import NOTE_FTS_TABLE, SNIPPET_CLOSE, SNIPPET_ELLIPSIS, SNIPPET_OPEN, SNIPPET_TOKENS, match_query
+from ..utils.serialization import rows_to_dicts
+from ..utils.spatial import GRID_SEEK_MAX_CELLS, grid_cells_for
+from .base import NOTE_READ_FIELDS, NoteConflict, PositionMoves, SyncPosition, Viewport
+
+# List routes read these columns as plain tuples instead of loading Note
+# objects: NoteRead's fields minus the colors, then the palette id.
+# expand_palettes() turns them into NOTE_READ_FIELDS tuples
+NOTE_ROW_COLUMNS = [
+    *(getattr(Note, field) for field in NOTE_READ_FIELDS if field not in PALETTE_FIELDS),
+    Note.palette_id,
+]
+# NoteRead declares the four colors together; this is where they go back in
+_COLORS_AT = NOTE_READ_FIELDS.index(PALETTE_FIELDS[0])
+_PALETTE_COLUMNS = [getattr(Palette, field) for field in PALETTE_FIELDS]
+
+note_fts = table(NOTE_FTS_TABLE, column("rowid"))
+# FTS5 exposes the table itself as a hidden column for MATCH, bm25() and snippet()
+note_fts_ref = literal_column(NOTE_FTS_TABLE)
+
+_notes = Note.__table__
+# What a batch update writes back of each row, besides the revision
+_BATCH_UPDATE_COLUMNS = ("body", "pos_x", "pos_y", "palette_id", "version")
+
+
+def expand_palettes(rows: Iterable[tuple], palettes: Optional[Dict[int, PaletteKey]] = None) -> List[tuple]:
+    """
+    NOTE_ROW_COLUMNS rows as NOTE_READ_FIELDS tuples, colors from `palettes`
+    (load_palettes) or, without it, from the cache, which must hold them.
+    """
+    get = palette_cache.get if palettes is None else palettes.__getitem__
+    return [(*row[:_COLORS_AT], *get(row[-1]), *row[_COLORS_AT:-1]) for row in rows]
+
+
+def load_palettes(session: Session, palette_ids: Iterable[int]) -> Dict[int, PaletteKey]:
+    """
+    Colors of these palettes by id. The ones the cache doesn't hold (evicted,
+    or created by another worker) are read from the database and cached.
+    """
+    palette_ids = set(palette_ids)
+    palettes = palette_cache.get_many(palette_ids)
+    missing = palette_ids - palettes.keys()
+    if missing:
+        for palette_id, *key in session.exec(select(Palette.id, *_PALETTE_COLUMNS).where(Palette.id.in_(missing))):
+            palettes[palette_id] = tuple(key)
+            palette_cache.add(palette_id, tuple(key))
+    return palettes
+
+
+def ensure_palettes(session: Session, keys: Iterable[PaletteKey], owner_id: Optional[int] = None) -> Dict[PaletteKey, int]:
+    """
+    Palette ids for these color sets, inserting the new ones. Call before a
+    write transaction starts: new palettes are committed on their own, so the
+    cache never holds an id a later rollback could take back.
+
+    With `owner_id`, raises PaletteLimitExceeded instead of inserting when
+    the owner's notes would use more than PALETTES_PER_OWNER_MAX palettes.
+    """
+    ids: Dict[PaletteKey, int] = {}
+    missing = []
+    for key in set(keys):
+        palette_id = palette_cache.id_for(key)
+        if palette_id is None:
+            missing.append(key)
+        else:
+            ids[key] = palette_id
+    if missing:
+        # Evicted from the cache or created by another worker, rather than new
+        for palette_id, *key in session.exec(
+            select(Palette.id, *_PALETTE_COLUMNS).where(tuple_(*_PALETTE_COLUMNS).in_(missing))
+        ):
+            palette_cache.add(palette_id, tuple(key))
+            ids[tuple(key)] = palette_id
+        missing = [key for key in missing if key not in ids]
+    if missing and owner_id is not None:
+        used = session.exec(
+            select(func.count(Note.palette_id.distinct())).where(Note.owner_id == owner_id)
+        ).one()
+        if used + len(missing) > PALETTES_PER_OWNER_MAX:
+            raise PaletteLimitExceeded(f"Notes can use at most {PALETTES_PER_OWNER_MAX} distinct color sets")
+    if missing:
+        # The no-op DO UPDATE makes RETURNING report palettes that already exist too
+        statement = sqlite_insert(Palette).values([dict(zip(PALETTE_FIELDS, key)) for key in missing])
+        rows = session.exec(
+            statement
+            .on_conflict_do_update(index_elements=list(PALETTE_FIELDS), set_={"color_id": statement.excluded.color_id})
+            .returning(Palette.id, *_PALETTE_COLUMNS)
+        ).all()
+        session.commit()
+        for palette_id, *key in rows:
+            palette_cache.add(palette_id, tuple(key))
+            ids[tuple(key)] = palette_id
+    return ids
+
+
+def prune_palettes(session: Session) -> int:
+    """
+    Delete the palettes no note uses any more; returns how many. Only run it
+    while no server is up: a worker may still cache a pruned id and give it
+    to a new note.
+    """
+    deleted = session.exec(delete(Palette).where(Palette.id.not_in(select(Note.palette_id)))).rowcount
+    session.commit()
+    return deleted
+
+
+def split_palette(values: dict, palette_ids: Dict[PaletteKey, int]) -> dict:
+    """Note column values with the four colors replaced by their palette id."""
+    row = {key: value for key, value in values.items() if key not in PALETTE_FIELDS}
+    row["palette_id"] = palette_ids[palette_key(values)]
+    return row
+
+
+async def bump_notes_version(session: AsyncSession, user_id: int) -> int:
+    """
+    Advance the owner's notes_version and return it. Call once inside every
+    note write transaction: the new value changes the collection ETag and is
+    the revision stamped on the notes/tombstones that write produces.
+    """
+    return (await session.exec(
+        update(User)
+        .where(User.id == user_id)
+        .values(notes_version=User.notes_version + 1)
+        .returning(User.notes_version)
+    )).scalar_one()
+
+
+class SQLModelRepository:
+    """
+    Repository over an AsyncSession; the default backend. Writes read their
+    rows back with RETURNING rather than refreshing after the commit, so the
+    session should come from open_async_session (expire_on_commit=False).
+    """
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def __aenter__(self) -> "SQLModelRepository":
+        await self.session.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.session.__aexit__(*exc)
+
+    async def _load_palettes(self, palette_ids: Iterable[int]) -> Dict[int, PaletteKey]:
+        palette_ids = set(palette_ids)
+        palettes = palette_cache.get_many(palette_ids)
+        if len(palettes) < len(palette_ids):
+            palettes.update(await self.session.run_sync(load_palettes, palette_ids - palettes.keys()))
+        return palettes
+
+    async def _ensure_palettes(self, owner_id: int, values: Iterable[dict]) -> Dict[PaletteKey, int]:
+        return await self.session.run_sync(ensure_palettes, [palette_key(value) for value in values], owner_id)
+
+    async def _expand(self, rows: List[tuple]) -> List[tuple]:
+        # The page may hold more palettes than the cache, so expand from what was loaded
+        return expand_palettes(rows, await self._load_palettes(row[-1] for row in rows))
+
+    # Users
+
+    async def get_user_by_username(self, username: str) -> Optional[User]:
+        return (await self.session.exec(select(User).where(User.username == username))).first()
+
+    async def get_user_by_email(self, email: str) -> Optional[User]:
+        return (await self.session.exec(select(User).where(User.email == email))).first()
+
+    async def create_user(self, username: str, email: str, password_hash: str) -> User:
+        user = (await self.session.exec(
+            insert(User).values(username=username, email=email, password_hash=password_hash).returning(User)
+        )).scalar_one()
+        await self.session.commit()
+        return user
+
+    # Note reads
+
+    async def _owned(self, owner_id: int, note_id: int) -> Optional[Note]:
+        note = await self.session.get(Note, note_id)
+        if note is None or note.owner_id != owner_id:
+            return None
+        await self._load_palettes([note.palette_id])
+        return note
+
+    async def get_note(self, owner_id: int, note_id: int) -> Optional[Note]:
+        return await self._owned(owner_id, note_id)
+
+    async def note_exists(self, owner_id: int, note_id: int) -> bool:
+        return (await self.session.exec(
+            select(Note.id).where(Note.id == note_id, Note.owner_id == owner_id)
+        )).first() is not None
+
+    async def get_notes(self, owner_id: int, note_ids: Iterable[int]) -> Dict[int, dict]:
+        rows = (await self.session.exec(
+            select(Note).where(Note.owner_id == owner_id, Note.id.in_(list(note_ids)))
+        )).all()
+        palettes = await self._load_palettes(row.palette_id for row in rows)
+        return {
+            row.id: {**row.model_dump(exclude={"grid_cell", "palette_id"}), **dict(zip(PALETTE_FIELDS, palettes[row.palette_id]))}
+            for row in rows
+        }
+
+    async def list_notes(
+        self,
+        owner_id: int,
+        after_id: int,
+        limit: int,
+        viewport: Optional[Viewport] = None,
+        include_ids: Collection[int] = (),
+    ) -> List[dict]:
+        sort_key = Note.id
+        query = select(*NOTE_ROW_COLUMNS).where(Note.owner_id == owner_id)
+        if viewport:
+            x0, y0, x1, y1 = viewport
+            in_viewport = [Note.pos_x.between(x0, x1), Note.pos_y.between(y0, y1)]
+            cells = grid_cells_for(x0, y0, x1, y1)
+            if len(cells) <= GRID_SEEK_MAX_CELLS:
+                # "id + 0" hides the (owner_id, id) index from the planner so it
+                # seeks (owner_id, grid_cell) instead of walking every note
+                sort_key = Note.id + literal_column("0")
+                in_viewport.append(Note.grid_cell.in_(cells))
+            if include_ids:
+                query = query.where(or_(and_(*in_viewport), Note.id.in_(list(include_ids))))
+            else:
+                query = query.where(*in_viewport)
+
+        rows = (await self.session.exec(
+            query.where(sort_key > after_id).order_by(sort_key).limit(limit)
+        )).all()
+        return rows_to_dicts(NOTE_READ_FIELDS, await self._expand(rows))
+
+    async def changes_since(
+        self, owner_id: int, after: SyncPosition, through_revision: int, limit: int
+    ) -> Tuple[List[dict], List[int], Optional[SyncPosition]]:
+        after_revision, after_id = after
+        if after_id is None:
+            position = Note.revision > after_revision
+        else:
+            position = tuple_(Note.revision, Note.id) > tuple_(after_revision, after_id)
+        # Both lookups seek an (owner_id, revision) index; the id order comes
+        # free with it, since id is the rowid
+        rows = (await self.session.exec(
+            select(*NOTE_ROW_COLUMNS, Note.revision)
+            .where(Note.owner_id == owner_id, position, Note.revision <= through_revision)
+            .order_by(Note.revision, Note.id)
+            .limit(limit + 1)
+        )).all()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        changed = rows_to_dicts(NOTE_READ_FIELDS, await self._expand([row[:-1] for row in rows]))
+        next_position = None
+        if more:
+            # The next page resumes inside the last revision here; deletions
+            # up to and including it go out with this one
+            next_position = (rows[-1][-1], changed[-1]["id"])
+            through_revision = next_position[0]
+        deleted = []
+        if after_revision >= 0:
+            # SQLite may reuse a deleted id; if the owner has a live note with
+            # that id again, the upsert above supersedes the tombstone
+            deleted = list((await self.session.exec(
+                select(NoteTombstone.note_id)
+                .where(
+                    NoteTombstone.owner_id == owner_id,
+                    NoteTombstone.revision > after_revision,
+                    NoteTombstone.revision <= through_revision,
+                    ~exists().where(Note.id == NoteTombstone.note_id, Note.owner_id == owner_id)
+                )
+                .order_by(NoteTombstone.revision)
+                .distinct()
+            )).all())
+        return changed, deleted, next_position
+
+    async def search_notes(self, owner_id: int, q: str, offset: int, limit: int) -> List[Tuple[dict, str]]:
+        expression = match_query(q)
+        if expression is None:
+            return []
+        rows = (await self.session.exec(
+            select(
+                *NOTE_ROW_COLUMNS,
+                func.snippet(note_fts_ref, 0, SNIPPET_OPEN, SNIPPET_CLOSE, SNIPPET_ELLIPSIS, SNIPPET_TOKENS)
+            )
+            .select_from(note_fts.join(Note, Note.id == note_fts.c.rowid))
+            .where(note_fts_ref.op("MATCH")(expression), Note.owner_id == owner_id)
+            .order_by(func.bm25(note_fts_ref), Note.id)
+            .offset(offset)
+            .limit(limit)
+        )).all()
+        notes = await self._expand([row[:-1] for row in rows])
+        return [(dict(zip(NOTE_READ_FIELDS, note)), row[-1]) for note, row in zip(notes, rows)]
+
+    async def export_notes(self, owner_id: int, chunk_size: int) -> AsyncIterator[List[tuple]]:
+        # Server-side cursor: memory stays flat for any board size
+        result = await self.session.stream(
+            select(*NOTE_ROW_COLUMNS)
+            .where(Note.owner_id == owner_id)
+            .order_by(Note.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        async for rows in result.partitions():
+            yield await self._expand(rows)
+
+    # Note writes
+
+    async def create_note(self, owner_id: int, values: dict) -> Note:
+        row = split_palette(values, await self._ensure_palettes(owner_id, [values]))
+        revision = await bump_notes_version(self.session, owner_id)
+        note = (await self.session.exec(
+            insert(Note).values(**row, owner_id=owner_id, revision=revision).returning(Note)
+        )).scalar_one()
+        await self.session.commit()
+        return note
+
+    async def update_note(self, owner_id: int, note_id: int, values: dict) -> Optional[Note]:
+        # Every column is NOT NULL; a None means "leave it"
+        values = {key: value for key, value in values.items() if value is not None}
+        if any(field in values for field in PALETTE_FIELDS):
+            # A color change may be partial, so it needs the current palette
+            note = await self._owned(owner_id, note_id)
+            if note is None:
+                return None
+            colors = {**dict(zip(PALETTE_FIELDS, note.palette)), **values}
+            values = split_palette(colors, await self._ensure_palettes(owner_id, [colors]))
+        # Otherwise the owner check is in the UPDATE itself, so there's no
+        # load first; a miss rolls the bump back
+        revision = await bump_notes_version(self.session, owner_id)
+        note = (await self.session.exec(
+            update(Note)
+            .where(Note.id == note_id, Note.owner_id == owner_id)
+            .values(**values, version=Note.version + 1, revision=revision)
+            .returning(Note)
+        )).scalar_one_or_none()
+        if note is None:
+            await self.session.rollback()
+            return None
+        await self.session.commit()
+        await self._load_palettes([note.palette_id])
+        return note
+
+    async def delete_note(self, owner_id: int, note_id: int) -> Optional[int]:
+        revision = await bump_notes_version(self.session, owner_id)
+        deleted = (await self.session.exec(
+            delete(Note).where(Note.id == note_id, Note.owner_id == owner_id).returning(Note.id)
+        )).scalar_one_or_none()
+        if deleted is None:
+            await self.session.rollback()
+            return None
+        await self.session.exec(insert(NoteTombstone).values(
+            note_id=note_id, owner_id=owner_id, revision=revision, deleted_at=time.time()
+        ))
+        await self.session.commit()
+        return revision
+
+    async def apply_batch(
+        self,
+        owner_id: int,
+        creates: List[dict],
+        updates: List[dict],
+        deletes: Collection[int],
+        read_versions: Dict[int, int],
+    ) -> Tuple[int, List[int]]:
+        session = self.session
+        palette_ids = await self._ensure_palettes(owner_id, [*creates, *updates])
+        revision = await bump_notes_version(session, owner_id)
+        new_ids: List[int] = []
+        if creates:
+            # One multi-row INSERT. SQLite hands out rowids in row order within
+            # a statement but RETURNING order is unspecified, so sort the ids;
+            # sort_by_parameter_order would fall back to one INSERT per row
+            new_ids = sorted((await session.exec(
+                insert(Note)
+                .values([
+                    {**split_palette(values, palette_ids), "owner_id": owner_id, "revision": revision}
+                    for values in creates
+                ])
+                .returning(Note.id)
+            )).scalars().all())
+        if updates:
+            # Core executemany on the session's connection: a row is written
+            # only if it is still the owner's and at the version this batch
+            # read, so a write made meanwhile is never overwritten
+            params = []
+            for row in updates:
+                row = split_palette(row, palette_ids)
+                params.append({
+                    "b_id": row["id"],
+                    "b_read_version": read_versions[row["id"]],
+                    **{f"b_{name}": row[name] for name in _BATCH_UPDATE_COLUMNS},
+                })
+            connection = await session.connection()
+            matched = (await connection.execute(
+                update(_notes)
+                .where(
+                    _notes.c.id == bindparam("b_id"),
+                    _notes.c.owner_id == owner_id,
+                    _notes.c.version == bindparam("b_read_version"),
+                )
+                .values(**{name: bindparam(f"b_{name}") for name in _BATCH_UPDATE_COLUMNS}, revision=revision),
+                params
+            )).rowcount
+            if matched != len(updates):
+                await session.rollback()
+                raise NoteConflict(f"{len(updates) - matched} note(s) changed since the batch read them")
+        if deletes:
+            deleted = (await session.exec(
+                delete(Note).where(Note.owner_id == owner_id, Note.id.in_(list(deletes))).returning(Note.id)
+            )).scalars().all()
+            if deleted:
+                deleted_at = time.time()
+                await session.exec(insert(NoteTombstone), params=[
+                    {"note_id": note_id, "owner_id": owner_id, "revision": revision, "deleted_at": deleted_at}
+                    for note_id in deleted
+                ])
+        await session.commit()
+        # Bulk statements bypass the identity map, and commit no longer expires it
+        session.expire_all()
+        return revision, new_ids
+
+    async def apply_positions(self, moves: PositionMoves) -> int:
+        session = self.session
+        revisions = dict((await session.exec(
+            update(User)
+            .where(User.id.in_(list(moves)))
+            .values(notes_version=User.notes_version + 1)
+            .returning(User.id, User.notes_version)
+        )).all())
+        params = [
+            {"b_id": note_id, "b_owner_id": owner_id, "b_pos_x": x, "b_pos_y": y, "b_revision": revisions[owner_id]}
+            for owner_id, notes in moves.items() if owner_id in revisions
+            for note_id, (x, y) in notes.items()
+        ]
+        written = 0
+        if params:
+            # Core statement on the session's connection: a plain executemany,
+            # and the owner check skips notes deleted since they were moved
+            connection = await session.connection()
+            written = (await connection.execute(
+                update(_notes)
+                .where(_notes.c.id == bindparam("b_id"), _notes.c.owner_id == bindparam("b_owner_id"))
+                .values(
+                    pos_x=bindparam("b_pos_x"),
+                    pos_y=bindparam("b_pos_y"),
+                    version=_notes.c.version + 1,
+                    revision=bindparam("b_revision"),
+                ),
+                params
+            )).rowcount
+        await session.commit()
+        session.expire_all()
+        return written
+
+    async def prune_tombstones(self, before: float) -> int:
+        session = self.session
+        expired = and_(NoteTombstone.owner_id == User.id, NoteTombstone.deleted_at < before)
+        newest = select(func.max(NoteTombstone.revision)).where(expired).scalar_subquery()
+        # Two-argument max() is SQLite's scalar max
+        await session.exec(
+            update(User).where(exists().where(expired)).values(pruned_revision=func.max(User.pruned_revision, newest))
+        )
+        pruned = (await session.exec(delete(NoteTombstone).where(NoteTombstone.deleted_at < before))).rowcount
+        await session.commit()
+        return pruned
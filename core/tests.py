@@ -1,12 +1,61 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import tracemalloc
 import unittest
+from datetime import timedelta
+from unittest import mock
+import httpx
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
 from sqlmodel import create_engine, Session, SQLModel, select
-from sqlmodel.pool import StaticPool
 from fastapi.testclient import TestClient
-from core.app import app
-from core.database import get_session
-from core.models import Note, User
-from core.utils.security import verify_password
-from core.utils.jwt import decode_token
+from starlette.websockets import WebSocketDisconnect
+from core.app import CHANGES_PAGE_MAX, app
+from core.database import idempotency_store, get_async_session, get_repository, get_repository_factory, get_session_factory, instrument_engine, open_async_session, retry_locked_writes
+from core.models import ImportCheckpoint, Note, NoteRead, Palette, User
+from core.storage.base import NoteConflict
+from core.storage.memory import InMemoryRepository
+from core.storage.sql import SQLModelRepository, bump_notes_version, ensure_palettes, prune_palettes, split_palette
+from core.utils.security import verify_password, PasswordHasher, PasswordPoolBusy
+from core.utils.jwt import decode_token, create_access_token, create_token_pair, verify_token_type, get_token_expiration, token_cache, TokenCache
+from core.utils.pagination import encode_cursor
+from core.utils.compression import CompressionMiddleware, negotiate
+from core.utils.idempotency import PENDING, IdempotencyMiddleware, InMemoryIdempotencyStore, SQLiteIdempotencyStore, StoredResponse
+from core.utils.importer import DatabaseInUse, Importer
+from core.utils.palettes import PaletteLimitExceeded, palette_cache, palette_key
+from core.utils.cache import note_cache, NoteCache, InMemoryLRUCache
+from core.utils.positions import position_buffer
+from core.utils.tombstones import prune_tombstones
+from core.utils.events import note_events, NoteEventHub, SLOW_CONSUMER_CLOSE
+from core.utils.metrics import Histogram, count_queries, bcrypt_latency, db_lock_retries, db_queries_per_request, http_requests
+from core.utils.retry import DatabaseLocked, backoff
+from core.utils.search import SNIPPET_CLOSE, SNIPPET_OPEN
+
+
+def create_test_engines(db_dir):
+    """Create a sync engine for assertions and an async engine for the app, sharing one SQLite file"""
+    db_path = os.path.join(db_dir, "test.sqlite3")
+    engine = create_engine(
+        f"sqlite:///{db_path}",
+        connect_args={"check_same_thread": False},
+    )
+    # NullPool: TestClient runs each request on its own event loop, so
+    # aiosqlite connections must not outlive the request that opened them
+    async_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{db_path}",
+        poolclass=NullPool,
+    )
+    instrument_engine(async_engine.sync_engine)
+    return engine, async_engine
 
 
 class TestNotesAPI(unittest.TestCase):
@@ -14,11 +63,15 @@ class TestNotesAPI(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         """Set up test database engine once for all tests"""
-        cls.engine = create_engine(
-            "sqlite:///:memory:",
-            connect_args={"check_same_thread": False},
-            poolclass=StaticPool,
-        )
+        cls.db_dir = tempfile.mkdtemp()
+        cls.engine, cls.async_engine = create_test_engines(cls.db_dir)
+        cls.client = TestClient(app)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Dispose engines and remove the test database"""
+        cls.engine.dispose()
+        shutil.rmtree(cls.db_dir, ignore_errors=True)
     
     def setUp(self):
         """Create fresh database and session for each test"""
@@ -26,11 +79,18 @@ class TestNotesAPI(unittest.TestCase):
         self.session = Session(type(self).engine)
         
         # Override the dependency
-        def get_session_override():
-            return self.session
+        async def get_async_session_override():
+            async with open_async_session(type(self).async_engine) as session:
+                yield session
         
-        app.dependency_overrides[get_session] = get_session_override
+        app.dependency_overrides[get_async_session] = get_async_session_override
+        app.dependency_overrides[get_session_factory] = lambda: (lambda: open_async_session(type(self).async_engine))
         self.addCleanup(app.dependency_overrides.clear)
+        # Ids restart with every fresh database, so cached notes must not leak
+        note_cache.clear()
+        palette_cache.clear()
+        position_buffer.clear()
+        asyncio.run(idempotency_store.clear())
         
         # Sample note data
         self.sample_note = {
@@ -53,12 +113,44 @@ class TestNotesAPI(unittest.TestCase):
         """Helper method to create a note directly in database"""
         if note_data is None:
             note_data = self.sample_note
-        note = Note(**note_data)
+        note = Note(**self._note_columns(note_data))
         self.session.add(note)
         self.session.commit()
         self.session.refresh(note)
         return note
+
+    def _note_columns(self, note_data):
+        """Helper method to turn note fields into Note columns, colors stored as a palette"""
+        return split_palette(note_data, ensure_palettes(self.session, [palette_key(note_data)]))
     
+    def _create_user(self, username="noteowner"):
+        """Helper method to create a user directly in database"""
+        user = User(
+            username=username,
+            email=f"{username}@example.com",
+            password_hash="not-a-real-hash"
+        )
+        self.session.add(user)
+        self.session.commit()
+        self.session.refresh(user)
+        return user
+
+    def _auth_headers(self, user):
+        """Helper method to build a bearer header for a user"""
+        token = create_access_token({"sub": user.username})
+        return {"Authorization": f"Bearer {token}"}
+
+    def _assert_query_budget(self, budget, request):
+        """Helper method to run a request and fail if it executes more than `budget` SQL statements"""
+        with count_queries(type(self).async_engine) as queries:
+            response = request()
+        self.assertLess(response.status_code, 400, response.text)
+        self.assertLessEqual(
+            queries.count, budget,
+            f"{queries.count} queries, budget {budget}:\n" + "\n".join(queries.statements)
+        )
+        return response
+
     # Test Create Note
     def test_create_note_valid(self):
         """Test creating a note with valid data"""
@@ -72,7 +164,7 @@ class TestNotesAPI(unittest.TestCase):
         """Test creating a note with an owner"""
         note_data = self.sample_note.copy()
         note_data["owner_id"] = 1
-        note = Note(**note_data)
+        note = Note(**self._note_columns(note_data))
         self.session.add(note)
         self.session.commit()
         self.assertEqual(note.owner_id, 1)
@@ -141,9 +233,9 @@ class TestNotesAPI(unittest.TestCase):
         """Test updating a note's colors"""
         note = self._create_note()
         
-        note.color_header = "#FF0000"
-        note.color_body = "#FFE0E0"
-        note.color_text = "#FFFFFF"
+        note.palette_id = self._note_columns({
+            **self.sample_note, "color_header": "#FF0000", "color_body": "#FFE0E0", "color_text": "#FFFFFF"
+        })["palette_id"]
         self.session.add(note)
         self.session.commit()
         self.session.refresh(note)
@@ -152,6 +244,37 @@ class TestNotesAPI(unittest.TestCase):
         self.assertEqual(note.color_body, "#FFE0E0")
         self.assertEqual(note.color_text, "#FFFFFF")
     
+    def test_api_palette_limit(self):
+        """Test that writes adding a palette past the owner's limit get 422"""
+        user = self._create_user()
+        headers = self._auth_headers(user)
+        client = type(self).client
+        with mock.patch("core.storage.sql.PALETTES_PER_OWNER_MAX", 1):
+            note_id = client.post("/notes/", headers=headers, json=self.sample_note).json()["id"]
+            new_colors = {**self.sample_note, "color_id": "red"}
+            self.assertEqual(client.post("/notes/", headers=headers, json=new_colors).status_code, 422)
+            self.assertEqual(client.put(f"/notes/{note_id}", headers=headers, json={"color_id": "red"}).status_code, 422)
+            response = client.post("/notes/batch", headers=headers, json={"operations": [{"op": "create", "note": new_colors}]})
+            self.assertEqual(response.status_code, 422)
+        self.session.expire_all()
+        self.assertEqual(len(self.session.exec(select(Palette)).all()), 1)
+
+    def test_api_update_rejects_nulls(self):
+        """Test that explicit nulls in a PUT or batch update get 422 and change nothing"""
+        user = self._create_user()
+        headers = self._auth_headers(user)
+        client = type(self).client
+        note_id = client.post("/notes/", headers=headers, json=self.sample_note).json()["id"]
+
+        response = client.put(f"/notes/{note_id}", headers=headers, json={"body": None, "pos_x": 5})
+        self.assertEqual(response.status_code, 422)
+        response = client.post("/notes/batch", headers=headers, json={"operations": [
+            {"op": "update", "id": note_id, "note": {"color_id": None}},
+        ]})
+        self.assertEqual(response.status_code, 422)
+        note = client.get(f"/notes/{note_id}", headers=headers).json()
+        self.assertEqual((note["body"], note["pos_x"]), (self.sample_note["body"], self.sample_note["pos_x"]))
+
     def test_update_nonexistent_note(self):
         """Test updating a note that doesn't exist"""
         note = self.session.get(Note, 999)
@@ -236,6 +359,752 @@ class TestNotesAPI(unittest.TestCase):
         deleted = self.session.get(Note, note_id)
         self.assertIsNone(deleted)
     
+    # Test Note Routes
+    def test_api_create_and_get_note(self):
+        """Test creating a note via API and fetching it back"""
+        user = self._create_user()
+        headers = self._auth_headers(user)
+        response = type(self).client.post("/notes/", json=self.sample_note, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["owner_id"], user.id)
+        note_id = response.json()["id"]
+
+        response = type(self).client.get(f"/notes/{note_id}", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["body"], self.sample_note["body"])
+
+    def test_api_get_note_not_found(self):
+        """Test fetching a missing note via API returns 404"""
+        headers = self._auth_headers(self._create_user())
+        response = type(self).client.get("/notes/999", headers=headers)
+        self.assertEqual(response.status_code, 404)
+
+    def test_api_notes_require_auth(self):
+        """Test that note routes reject missing or invalid tokens"""
+        response = type(self).client.get("/notes/")
+        self.assertEqual(response.status_code, 401)
+
+        headers = {"Authorization": "Bearer not-a-token"}
+        response = type(self).client.get("/notes/", headers=headers)
+        self.assertEqual(response.status_code, 401)
+
+    def test_api_list_notes_paginates(self):
+        """Test keyset pagination walks every note exactly once"""
+        user = self._create_user()
+        for i in range(5):
+            self._create_note({**self.sample_note, "body": f"Note {i}", "owner_id": user.id})
+        headers = self._auth_headers(user)
+
+        seen = []
+        cursor = None
+        pages = 0
+        while True:
+            params = {"limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            response = type(self).client.get("/notes/", params=params, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            seen.extend(note["body"] for note in page["items"])
+            pages += 1
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(seen, [f"Note {i}" for i in range(5)])
+
+    def test_api_list_notes_owner_scoped(self):
+        """Test that users only see and touch their own notes"""
+        owner = self._create_user("owner")
+        other = self._create_user("other")
+        note = self._create_note({**self.sample_note, "owner_id": owner.id})
+        other_headers = self._auth_headers(other)
+
+        response = type(self).client.get("/notes/", headers=other_headers)
+        self.assertEqual(response.json(), {"items": [], "next_cursor": None})
+        response = type(self).client.get(f"/notes/{note.id}", headers=other_headers)
+        self.assertEqual(response.status_code, 404)
+        response = type(self).client.delete(f"/notes/{note.id}", headers=other_headers)
+        self.assertEqual(response.status_code, 404)
+
+    def test_api_list_notes_invalid_cursor(self):
+        """Test that malformed or foreign cursors are rejected"""
+        owner = self._create_user("owner")
+        other = self._create_user("other")
+        headers = self._auth_headers(owner)
+
+        response = type(self).client.get("/notes/", params={"cursor": "garbage"}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+        foreign = encode_cursor(other.id, 1)
+        response = type(self).client.get("/notes/", params={"cursor": foreign}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_api_note_cache_metrics(self):
+        """Test that note cache hits and misses reach /metrics, and ownership checks don't count"""
+        user = self._create_user()
+        headers = self._auth_headers(user)
+        note_id = type(self).client.post("/notes/", json=self.sample_note, headers=headers).json()["id"]
+        type(self).client.get(f"/notes/{note_id}", headers=headers)
+        type(self).client.get(f"/notes/{note_id}", headers=headers)
+        type(self).client.patch(f"/notes/{note_id}/position", headers=headers, json={"pos_x": 1, "pos_y": 2})
+
+        lines = type(self).client.get("/metrics").text.splitlines()
+        self.assertIn("note_cache_hits_total 1", lines)
+        self.assertIn("note_cache_misses_total 1", lines)
+        self.assertIn("note_cache_invalidations_total 0", lines)
+        self.assertIn("# TYPE note_cache_hits_total counter", lines)
+
+    def test_api_get_note_cached_and_invalidated(self):
+        """Test that single-note reads are cached and writes invalidate them"""
+        user = self._create_user()
+        headers = self._auth_headers(user)
+        note_id = type(self).client.post("/notes/", json=self.sample_note, headers=headers).json()["id"]
+
+        first = type(self).client.get(f"/notes/{note_id}", headers=headers)
+        second = type(self).client.get(f"/notes/{note_id}", headers=headers)
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(note_cache.stats()["hits"], 1)
+
+        type(self).client.put(f"/notes/{note_id}", json={"body": "Changed"}, headers=headers)
+        response = type(self).client.get(f"/notes/{note_id}", headers=headers)
+        self.assertEqual(response.json()["body"], "Changed")
+
+        type(self).client.delete(f"/notes/{note_id}", headers=headers)
+        response = type(self).client.get(f"/notes/{note_id}", headers=headers)
+        self.assertEqual(response.status_code, 404)
+
+    def test_api_get_note_cache_is_owner_scoped(self):
+        """Test that a cached note is not served to another user"""
+        owner = self._create_user("owner")
+        other = self._create_user("other")
+        note = self._create_note({**self.sample_note, "owner_id": owner.id})
+
+        response = type(self).client.get(f"/notes/{note.id}", headers=self._auth_headers(owner))
+        self.assertEqual(response.status_code, 200)
+        response = type(self).client.get(f"/notes/{note.id}", headers=self._auth_headers(other))
+        self.assertEqual(response.status_code, 404)
+
+    def test_api_list_notes_etag(self):
+        """Test conditional GET on the collection and invalidation by writes"""
+        user = self._create_user()
+        headers = self._auth_headers(user)
+        type(self).client.post("/notes/", json=self.sample_note, headers=headers)
+
+        response = type(self).client.get("/notes/", headers=headers)
+        etag = response.headers["etag"]
+        response = type(self).client.get("/notes/", headers={**headers, "If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+        type(self).client.post("/notes/", json=self.sample_note, headers=headers)
+        response = type(self).client.get("/notes/", headers={**headers, "If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["etag"], etag)
+        self.assertEqual(len(response.json()["items"]), 2)
+
+    def test_api_get_note_etag(self):
+        """Test conditional GET on a single note and invalidation by updates"""
+        user = self._create_user()
+        headers = self._auth_headers(user)
+        note_id = type(self).client.post("/notes/", json=self.sample_note, headers=headers).json()["id"]
+
+        etag = type(self).client.get(f"/notes/{note_id}", headers=headers).headers["etag"]
+        response = type(self).client.get(f"/notes/{note_id}", headers={**headers, "If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        type(self).client.put(f"/notes/{note_id}", json={"pos_x": 1}, headers=headers)
+        response = type(self).client.get(f"/notes/{note_id}", headers={**headers, "If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["etag"], etag)
+
+    def test_api_get_note_etag_survives_id_reuse(self):
+        """Test that a note re-created under a deleted note's id doesn't match the old ETag"""
+        user = self._create_user()
+        headers = self._auth_headers(user)
+        client = type(self).client
+        note_id = client.post("/notes/", json=self.sample_note, headers=headers).json()["id"]
+        etag = client.get(f"/notes/{note_id}", headers=headers).headers["etag"]
+        client.delete(f"/notes/{note_id}", headers=headers)
+
+        recreated = client.post("/notes/", json={**self.sample_note, "body": "Different"}, headers=headers).json()
+        self.assertEqual(recreated["id"], note_id)
+        response = client.get(f"/notes/{note_id}", headers={**headers, "If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["body"], "Different")
+
+    def test_note_cache_drops_fill_raced_by_write(self):
+        """Test that a fill started before an invalidation is discarded"""
+        cache = NoteCache(InMemoryLRUCache(maxsize=10))
+        generation = cache.generation
+        cache.invalidate(1, 5)
+        cache.set(1, 5, 'W/"note-5-1"', b"stale", generation)
+        self.assertIsNone(cache.get(1, 5))
+
+    def test_api_export_ndjson_and_csv(self):
+        """Test that export streams every owned note as NDJSON or CSV"""
+        user = self._create_user()
+        other = self._create_user("other")
+        for i in range(3):
+            self._create_note({**self.sample_note, "body": f"Note {i}", "owner_id": user.id})
+        self._create_note({**self.sample_note, "body": "Not mine", "owner_id": other.id})
+        headers = self._auth_headers(user)
+
+        response = type(self).client.get("/notes/export", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("application/x-ndjson"))
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual([line["body"] for line in lines], ["Note 0", "Note 1", "Note 2"])
+        self.assertEqual(set(lines[0]), set(NoteRead.model_fields))
+
+        response = type(self).client.get("/notes/export", params={"format": "csv"}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        self.assertEqual([row["body"] for row in rows], ["Note 0", "Note 1", "Note 2"])
+
+    def test_api_create_note_idempotency_key(self):
+        """Test that a retried create is answered from the idempotency store without touching the database"""
+        user = self._create_user()
+        headers = {**self._auth_headers(user), "Idempotency-Key": "retry-1"}
+        first = type(self).client.post("/notes/", json=self.sample_note, headers=headers)
+        self.assertEqual(first.status_code, 200)
+        self.assertNotIn("idempotent-replayed", first.headers)
+
+        with count_queries(type(self).async_engine) as queries:
+            retry = type(self).client.post("/notes/", json=self.sample_note, headers=headers)
+        self.assertEqual(queries.count, 0, queries.statements)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.headers["idempotent-replayed"], "true")
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(len(self.session.exec(select(Note)).all()), 1)
+
+        response = type(self).client.post("/notes/", json={**self.sample_note, "body": "Other"}, headers=headers)
+        self.assertEqual(response.status_code, 422)
+        # Keys are per caller
+        other = self._create_user("otherowner")
+        response = type(self).client.post("/notes/", json=self.sample_note, headers={**self._auth_headers(other), "Idempotency-Key": "retry-1"})
+        self.assertNotIn("idempotent-replayed", response.headers)
+        self.assertEqual(len(self.session.exec(select(Note)).all()), 2)
+
+    def test_api_list_compressed(self):
+        """Test that a full-board response is compressed for clients that accept gzip"""
+        user = self._create_user()
+        for _ in range(20):
+            self._create_note({**self.sample_note, "owner_id": user.id})
+        headers = self._auth_headers(user)
+        client = type(self).client
+
+        response = client.get("/notes/", headers={**headers, "Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertEqual(len(response.json()["items"]), 20)
+        response = client.get("/notes/", headers={**headers, "Accept-Encoding": "identity"})
+        self.assertNotIn("content-encoding", response.headers)
+
+    def test_api_list_notes_viewport(self):
+        """Test that a viewport query only returns notes inside the rectangle"""
+        user = self._create_user()
+        positions = [(100, 100), (600, 450), (1000, 1000), (4999, 10), (640, 480)]
+        for x, y in positions:
+            self._create_note({**self.sample_note, "pos_x": x, "pos_y": y, "owner_id": user.id})
+        headers = self._auth_headers(user)
+
+        # Small viewport goes through the grid index, the full board does not
+        for viewport, expected in (
+            ({"x0": 500, "y0": 400, "x1": 1000, "y1": 1000}, [(600, 450), (1000, 1000), (640, 480)]),
+            ({"x0": 0, "y0": 0, "x1": 5000, "y1": 5000}, positions),
+        ):
+            response = type(self).client.get("/notes/", params=viewport, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            found = [(n["pos_x"], n["pos_y"]) for n in response.json()["items"]]
+            self.assertEqual(found, expected)
+
+    def test_api_list_notes_viewport_invalid(self):
+        """Test that partial or reversed viewports are rejected"""
+        headers = self._auth_headers(self._create_user())
+        response = type(self).client.get("/notes/", params={"x0": 0, "y0": 0}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+        response = type(self).client.get(
+            "/notes/", params={"x0": 10, "y0": 0, "x1": 5, "y1": 5}, headers=headers
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_api_batch_mixed_operations(self):
+        """Test a batch of creates, updates and deletes applied together"""
+        user = self._create_user()
+        keep = self._create_note({**self.sample_note, "body": "Keep", "owner_id": user.id})
+        drop = self._create_note({**self.sample_note, "body": "Drop", "owner_id": user.id})
+        keep_id, drop_id = keep.id, drop.id
+        headers = self._auth_headers(user)
+
+        response = type(self).client.post("/notes/batch", headers=headers, json={"operations": [
+            {"op": "create", "note": {**self.sample_note, "body": "New"}},
+            {"op": "update", "id": keep_id, "note": {"pos_x": 42}},
+            {"op": "delete", "id": drop_id},
+            {"op": "update", "id": 999, "note": {"pos_x": 1}},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual([r["status"] for r in results], [200, 200, 200, 404])
+        self.assertEqual(results[0]["note"]["body"], "New")
+        self.assertEqual(results[0]["note"]["owner_id"], user.id)
+        self.assertEqual(results[1]["note"]["pos_x"], 42)
+
+        self.session.expire_all()
+        self.assertEqual(self.session.get(Note, keep_id).pos_x, 42)
+        self.assertIsNone(self.session.get(Note, drop_id))
+        self.assertIsNotNone(self.session.get(Note, results[0]["id"]))
+
+    def test_api_batch_conflicts_with_concurrent_write(self):
+        """Test a batch whose note is written between its read and its write answers 409 and applies nothing"""
+        user = self._create_user()
+        note = self._create_note({**self.sample_note, "owner_id": user.id})
+        note_id = note.id
+        headers = self._auth_headers(user)
+        real_get_notes = SQLModelRepository.get_notes
+
+        async def get_notes_then_concurrent_put(repository, owner_id, note_ids):
+            rows = await real_get_notes(repository, owner_id, note_ids)
+            with Session(type(self).engine) as session:
+                session.get(Note, note_id).version += 1
+                session.commit()
+            return rows
+
+        with mock.patch.object(SQLModelRepository, "get_notes", get_notes_then_concurrent_put):
+            response = type(self).client.post("/notes/batch", headers=headers, json={"operations": [
+                {"op": "create", "note": self.sample_note},
+                {"op": "update", "id": note_id, "note": {"body": "Batched"}},
+            ]})
+        self.assertEqual(response.status_code, 409)
+        self.session.expire_all()
+        self.assertEqual(self.session.get(Note, note_id).body, self.sample_note["body"])
+        self.assertEqual(len(self.session.exec(select(Note)).all()), 1)
+
+    def test_api_note_changes_delta_sync(self):
+        """Test that /notes/changes returns only what changed since the cursor"""
+        user = self._create_user()
+        headers = self._auth_headers(user)
+        client = type(self).client
+        first = client.post("/notes/", headers=headers, json={**self.sample_note, "body": "First"}).json()
+        second = client.post("/notes/", headers=headers, json={**self.sample_note, "body": "Second"}).json()
+
+        full = client.get("/notes/changes", headers=headers)
+        self.assertEqual(full.status_code, 200)
+        self.assertEqual([n["id"] for n in full.json()["changed"]], [first["id"], second["id"]])
+        self.assertEqual(full.json()["deleted"], [])
+        cursor = full.json()["cursor"]
+
+        empty = client.get("/notes/changes", headers=headers, params={"since": cursor}).json()
+        self.assertEqual(empty, {"changed": [], "deleted": [], "cursor": cursor, "has_more": False})
+
+        client.put(f"/notes/{first['id']}", headers=headers, json={"pos_x": 7})
+        third = client.post("/notes/batch", headers=headers, json={"operations": [
+            {"op": "create", "note": {**self.sample_note, "body": "Third"}},
+        ]}).json()["results"][0]["id"]
+        client.delete(f"/notes/{second['id']}", headers=headers)
+
+        delta = client.get("/notes/changes", headers=headers, params={"since": cursor}).json()
+        self.assertEqual([n["id"] for n in delta["changed"]], [first["id"], third])
+        self.assertEqual(delta["changed"][0]["pos_x"], 7)
+        self.assertEqual(delta["deleted"], [second["id"]])
+        self.assertNotEqual(delta["cursor"], cursor)
+
+    def test_api_note_changes_pages(self):
+        """Test that a delta larger than `limit` comes in pages that chain through the cursor"""
+        user = self._create_user()
+        headers = self._auth_headers(user)
+        client = type(self).client
+        ids = [client.post("/notes/", headers=headers, json=self.sample_note).json()["id"] for _ in range(5)]
+
+        seen, cursor, pages = [], None, 0
+        while True:
+            params = {"limit": 2, **({"since": cursor} if cursor else {})}
+            page = client.get("/notes/changes", headers=headers, params=params).json()
+            seen += [note["id"] for note in page["changed"]]
+            cursor, pages = page["cursor"], pages + 1
+            if not page["has_more"]:
+                break
+        self.assertEqual((seen, pages), (ids, 3))
+        self.assertEqual(client.get("/notes/changes", headers=headers, params={"since": cursor}).json()["changed"], [])
+        response = client.get("/notes/changes", headers=headers, params={"limit": CHANGES_PAGE_MAX + 1})
+        self.assertEqual(response.status_code, 422)
+
+    def test_api_note_changes_cursor_older_than_retention(self):
+        """Test that a cursor from before the pruned tombstones gets 410, and a full sync still works"""
+        user = self._create_user()
+        headers = self._auth_headers(user)
+        client = type(self).client
+        note_id = client.post("/notes/", headers=headers, json=self.sample_note).json()["id"]
+        cursor = client.get("/notes/changes", headers=headers).json()["cursor"]
+        client.delete(f"/notes/{note_id}", headers=headers)
+        with mock.patch("core.utils.tombstones.TOMBSTONE_RETENTION_DAYS", 0):
+            self.assertEqual(
+                asyncio.run(prune_tombstones(lambda: SQLModelRepository(open_async_session(type(self).async_engine)))), 1
+            )
+
+        response = client.get("/notes/changes", headers=headers, params={"since": cursor})
+        self.assertEqual(response.status_code, 410)
+        full = client.get("/notes/changes", headers=headers).json()
+        self.assertEqual(full["changed"], [])
+        self.assertEqual(client.get("/notes/changes", headers=headers, params={"since": full["cursor"]}).status_code, 200)
+
+    def test_api_note_changes_invalid_cursor(self):
+        """Test that malformed or foreign change cursors are rejected"""
+        owner = self._create_user("owner")
+        other = self._create_user("other")
+        foreign = type(self).client.get("/notes/changes", headers=self._auth_headers(other)).json()["cursor"]
+
+        for cursor in ("not-a-cursor", foreign):
+            response = type(self).client.get("/notes/changes", headers=self._auth_headers(owner), params={"since": cursor})
+            self.assertEqual(response.status_code, 400)
+
+    def _flush_positions(self):
+        """Helper method to run one write-behind flush against the test database"""
+        return asyncio.run(position_buffer.flush(lambda: SQLModelRepository(open_async_session(type(self).async_engine))))
+
+    def test_api_move_note_buffers_until_flush(self):
+        """Test that position moves are coalesced in memory and readable before the flush"""
+        user = self._create_user()
+        note = self._create_note({**self.sample_note, "owner_id": user.id})
+        note_id = note.id
+        headers = self._auth_headers(user)
+        client = type(self).client
+
+        for x in (10, 20, 30):
+            response = client.patch(f"/notes/{note_id}/position", headers=headers, json={"pos_x": x, "pos_y": x + 1})
+            self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(position_buffer), 1)
+
+        # Not written yet, but every read sees the latest move
+        self.session.expire_all()
+        self.assertEqual(self.session.get(Note, note_id).pos_x, 100)
+        moved = client.get(f"/notes/{note_id}", headers=headers)
+        self.assertEqual(moved.json()["pos_x"], 30)
+        # Encoded like the unbuffered path: compact pydantic JSON
+        self.assertEqual(moved.content, NoteRead.model_validate(moved.json()).model_dump_json().encode("utf-8"))
+        self.assertEqual(client.get("/notes/", headers=headers).json()["items"][0]["pos_x"], 30)
+        in_view = client.get("/notes/", headers=headers, params={"x0": 0, "y0": 0, "x1": 50, "y1": 50}).json()
+        self.assertEqual([n["id"] for n in in_view["items"]], [note_id])
+        self.assertEqual(json.loads(client.get("/notes/export", headers=headers).text)["pos_x"], 30)
+
+        self.assertEqual(self._flush_positions(), 1)
+        self.assertEqual(len(position_buffer), 0)
+        self.session.expire_all()
+        stored = self.session.get(Note, note_id)
+        self.assertEqual((stored.pos_x, stored.pos_y, stored.version), (30, 31, 2))
+        self.assertEqual(client.get(f"/notes/{note_id}", headers=headers).json()["pos_y"], 31)
+
+    def test_api_move_note_changes_etags(self):
+        """Test that a buffered move changes both ETags"""
+        user = self._create_user()
+        note = self._create_note({**self.sample_note, "owner_id": user.id})
+        note_id = note.id
+        headers = self._auth_headers(user)
+        client = type(self).client
+        list_etag = client.get("/notes/", headers=headers).headers["ETag"]
+        note_etag = client.get(f"/notes/{note_id}", headers=headers).headers["ETag"]
+
+        client.patch(f"/notes/{note_id}/position", headers=headers, json={"pos_x": 1, "pos_y": 2})
+        self.assertEqual(client.get("/notes/", headers={**headers, "If-None-Match": list_etag}).status_code, 200)
+        self.assertEqual(client.get(f"/notes/{note_id}", headers={**headers, "If-None-Match": note_etag}).status_code, 200)
+
+    def test_api_move_note_owner_scoped(self):
+        """Test that moving a missing or foreign note returns 404 and buffers nothing"""
+        owner = self._create_user("owner")
+        other = self._create_user("other")
+        note = self._create_note({**self.sample_note, "owner_id": owner.id})
+
+        for note_id in (note.id, 999):
+            response = type(self).client.patch(
+                f"/notes/{note_id}/position", headers=self._auth_headers(other), json={"pos_x": 1, "pos_y": 1}
+            )
+            self.assertEqual(response.status_code, 404)
+        self.assertEqual(len(position_buffer), 0)
+
+    def test_api_move_note_write_through(self):
+        """Test that with buffering off each move is written at once and a deleted note gets 404"""
+        user = self._create_user()
+        note = self._create_note({**self.sample_note, "owner_id": user.id})
+        note_id = note.id
+        headers = self._auth_headers(user)
+        client = type(self).client
+
+        with mock.patch.object(position_buffer, "interval_ms", 0):
+            response = client.patch(f"/notes/{note_id}/position", headers=headers, json={"pos_x": 7, "pos_y": 8})
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(len(position_buffer), 0)
+            self.session.expire_all()
+            stored = self.session.get(Note, note_id)
+            self.assertEqual((stored.pos_x, stored.pos_y, stored.version), (7, 8, 2))
+
+            # As if another worker deleted it: nothing local knows
+            client.delete(f"/notes/{note_id}", headers=headers)
+            response = client.patch(f"/notes/{note_id}/position", headers=headers, json={"pos_x": 9, "pos_y": 9})
+            self.assertEqual(response.status_code, 404)
+
+    def test_api_update_absorbs_buffered_move(self):
+        """Test that a PUT after a buffered move keeps the move and drops it from the buffer"""
+        user = self._create_user()
+        note = self._create_note({**self.sample_note, "owner_id": user.id})
+        note_id = note.id
+        headers = self._auth_headers(user)
+
+        type(self).client.patch(f"/notes/{note_id}/position", headers=headers, json={"pos_x": 5, "pos_y": 6})
+        response = type(self).client.put(f"/notes/{note_id}", headers=headers, json={"body": "Edited", "pos_y": 9})
+        self.assertEqual((response.json()["pos_x"], response.json()["pos_y"]), (5, 9))
+        self.assertEqual(len(position_buffer), 0)
+        self.assertEqual(self._flush_positions(), 0)
+
+    def test_api_update_during_flush_keeps_explicit_position(self):
+        """Test that a PUT arriving while a flush is writing the older drag keeps its own position"""
+        user = self._create_user()
+        note = self._create_note({**self.sample_note, "owner_id": user.id})
+        note_id = note.id
+        headers = self._auth_headers(user)
+        type(self).client.patch(f"/notes/{note_id}/position", headers=headers, json={"pos_x": 10, "pos_y": 10})
+
+        real_apply = SQLModelRepository.apply_positions
+
+        async def run():
+            copied, go = asyncio.Event(), asyncio.Event()
+
+            async def paused_apply(repository, moves):
+                # The flush has taken its copy of the buffer; hold the write back
+                copied.set()
+                await go.wait()
+                return await real_apply(repository, moves)
+
+            with mock.patch.object(SQLModelRepository, "apply_positions", paused_apply):
+                flush = asyncio.create_task(position_buffer.flush(lambda: SQLModelRepository(open_async_session(type(self).async_engine))))
+                await copied.wait()
+                transport = httpx.ASGITransport(app=app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                    put = asyncio.create_task(client.put(f"/notes/{note_id}", headers=headers, json={"pos_x": 500, "pos_y": 600}))
+                    await asyncio.sleep(0.05)
+                    go.set()
+                    await flush
+                    return await put
+
+        response = asyncio.run(run())
+        self.assertEqual((response.json()["pos_x"], response.json()["pos_y"]), (500, 600))
+        self.session.expire_all()
+        stored = self.session.get(Note, note_id)
+        self.assertEqual((stored.pos_x, stored.pos_y, stored.version), (500, 600, 3))
+        self.assertEqual(len(position_buffer), 0)
+
+    def test_ws_notes_receives_owner_events(self):
+        """Test that the WebSocket feed pushes the owner's creates, moves, updates and deletes"""
+        owner = self._create_user("owner")
+        other = self._create_user("other")
+        headers = self._auth_headers(owner)
+        client = type(self).client
+        token = headers["Authorization"].split()[1]
+
+        with client.websocket_connect(f"/ws/notes?token={token}") as socket:
+            self.assertEqual(note_events.subscriber_count(owner.id), 1)
+            client.post("/notes/", headers=self._auth_headers(other), json=self.sample_note)
+            note_id = client.post("/notes/", headers=headers, json=self.sample_note).json()["id"]
+            client.patch(f"/notes/{note_id}/position", headers=headers, json={"pos_x": 3, "pos_y": 4})
+            client.put(f"/notes/{note_id}", headers=headers, json={"body": "Edited"})
+            client.delete(f"/notes/{note_id}", headers=headers)
+
+            events = [socket.receive_json() for _ in range(4)]
+        self.assertEqual(
+            [event["type"] for event in events],
+            ["note.created", "note.moved", "note.updated", "note.deleted"]
+        )
+        self.assertEqual(events[0]["note"]["owner_id"], owner.id)
+        self.assertEqual((events[1]["pos_x"], events[1]["pos_y"]), (3, 4))
+        self.assertEqual(events[2]["note"]["body"], "Edited")
+        self.assertEqual(events[3]["id"], note_id)
+
+    def test_ws_notes_token_in_subprotocol(self):
+        """Test that the access token can be offered as a subprotocol instead of in the URL"""
+        user = self._create_user()
+        token = self._auth_headers(user)["Authorization"].split()[1]
+        with type(self).client.websocket_connect("/ws/notes", subprotocols=["bearer", token]) as socket:
+            self.assertEqual(socket.accepted_subprotocol, "bearer")
+            self.assertEqual(note_events.subscriber_count(user.id), 1)
+
+    def test_ws_notes_closes_when_token_expires(self):
+        """Test that an open socket is closed with 1008 once its access token expires"""
+        user = self._create_user()
+        token = create_access_token({"sub": user.username}, expires_delta=timedelta(seconds=1))
+        with self.assertRaises(WebSocketDisconnect) as raised:
+            with type(self).client.websocket_connect("/ws/notes", subprotocols=["bearer", token]) as socket:
+                socket.receive_text()
+        self.assertEqual(raised.exception.code, 1008)
+        self.assertEqual(note_events.subscriber_count(user.id), 0)
+
+    def test_ws_notes_requires_access_token(self):
+        """Test that the WebSocket feed refuses missing and refresh tokens"""
+        user = self._create_user()
+        refresh = create_token_pair({"sub": user.username})["refresh_token"]
+        for url in ("/ws/notes", f"/ws/notes?token={refresh}"):
+            with self.assertRaises(WebSocketDisconnect) as raised:
+                with type(self).client.websocket_connect(url) as socket:
+                    socket.receive_text()
+            self.assertEqual(raised.exception.code, 1008)
+
+    def test_fast_json_is_byte_compatible(self):
+        """Test that FAST_JSON list responses match the validated responses byte for byte"""
+        user = self._create_user()
+        headers = self._auth_headers(user)
+        for body in ('Plain', 'Ünïcødé ✓ 😀', 'quote " backslash \\ tab \t newline \n ctrl \x01'):
+            self._create_note({**self.sample_note, "body": body, "owner_id": user.id})
+        other = self._create_note({**self.sample_note, "owner_id": user.id})
+        type(self).client.patch(f"/notes/{other.id}/position", headers=headers, json={"pos_x": 9, "pos_y": 9})
+
+        for url in ("/notes/?limit=2", "/notes/?x0=0&y0=0&x1=500&y1=500", "/notes/changes"):
+            standard = type(self).client.get(url, headers=headers)
+            with mock.patch("core.app.FAST_JSON", True):
+                fast = type(self).client.get(url, headers=headers)
+            self.assertEqual(fast.status_code, 200)
+            self.assertEqual(fast.content, standard.content)
+            self.assertEqual(fast.headers.get("ETag"), standard.headers.get("ETag"))
+
+    def test_metrics_records_routes_and_queries(self):
+        """Test that /metrics exposes per-route request and query metrics"""
+        user = self._create_user()
+        note = self._create_note({**self.sample_note, "owner_id": user.id})
+        labels = ("/notes/{note_id}", "GET")
+        requests_before = http_requests.value(*labels, "200")
+        queries_before = db_queries_per_request.sum(*labels)
+
+        type(self).client.get(f"/notes/{note.id}", headers=self._auth_headers(user))
+        self.assertEqual(http_requests.value(*labels, "200"), requests_before + 1)
+        # One lookup for the user and one for the note
+        self.assertEqual(db_queries_per_request.sum(*labels) - queries_before, 2)
+
+        response = type(self).client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain; version=0.0.4"))
+        self.assertIn('http_requests_total{route="/notes/{note_id}",method="GET",status="200"}', response.text)
+        self.assertIn('http_requests_in_flight{route="/metrics",method="GET"} 1', response.text)
+        self.assertIn("# TYPE db_queries_per_request histogram", response.text)
+        self.assertNotIn(f'route="/notes/{note.id}"', response.text)
+
+    def test_api_search_notes(self):
+        """Test full-text search ranking, snippets, owner scoping and pagination"""
+        owner = self._create_user("owner")
+        other = self._create_user("other")
+        headers = self._auth_headers(owner)
+        client = type(self).client
+        for body in ("buy milk and eggs", "milk <b>shake</b> recipe", "call mom"):
+            self._create_note({**self.sample_note, "body": body, "owner_id": owner.id})
+        self._create_note({**self.sample_note, "body": "milk for someone else", "owner_id": other.id})
+
+        response = client.get("/notes/search", headers=headers, params={"q": "milk"})
+        self.assertEqual(response.status_code, 200)
+        items = response.json()["items"]
+        self.assertEqual(sorted(item["body"] for item in items), ["buy milk and eggs", "milk <b>shake</b> recipe"])
+        snippets = {item["body"]: item["snippet"] for item in items}
+        self.assertEqual(snippets["milk <b>shake</b> recipe"], "<mark>milk</mark> &lt;b&gt;shake&lt;/b&gt; recipe")
+
+        # Every word must match, the last one as a prefix
+        items = client.get("/notes/search", headers=headers, params={"q": "milk eg"}).json()["items"]
+        self.assertEqual([item["body"] for item in items], ["buy milk and eggs"])
+
+        first = client.get("/notes/search", headers=headers, params={"q": "milk", "limit": 1}).json()
+        self.assertEqual(len(first["items"]), 1)
+        second = client.get("/notes/search", headers=headers, params={"q": "milk", "limit": 1, "cursor": first["next_cursor"]}).json()
+        self.assertEqual(len(second["items"]), 1)
+        self.assertIsNone(second["next_cursor"])
+        self.assertNotEqual(first["items"][0]["id"], second["items"][0]["id"])
+
+    def test_api_search_follows_writes(self):
+        """Test that the search index tracks updates and deletes, and rejects empty queries"""
+        user = self._create_user()
+        headers = self._auth_headers(user)
+        client = type(self).client
+        note_id = client.post("/notes/", headers=headers, json={**self.sample_note, "body": "draft agenda"}).json()["id"]
+
+        client.put(f"/notes/{note_id}", headers=headers, json={"body": "final agenda"})
+        search = lambda q: [item["id"] for item in client.get("/notes/search", headers=headers, params={"q": q}).json()["items"]]
+        self.assertEqual(search("draft"), [])
+        self.assertEqual(search("final"), [note_id])
+
+        client.delete(f"/notes/{note_id}", headers=headers)
+        self.assertEqual(search("agenda"), [])
+        # FTS syntax is treated as plain words
+        self.assertEqual(client.get("/notes/search", headers=headers, params={"q": 'agenda" OR *'}).status_code, 200)
+        self.assertEqual(client.get("/notes/search", headers=headers, params={"q": "***"}).status_code, 400)
+
+    def test_api_write_replayed_after_lock(self):
+        """Test that a write losing the SQLite lock is replayed, and answered 503 once retries run out"""
+        user = self._create_user()
+        headers = self._auth_headers(user)
+        client = type(self).client
+        attempts = []
+
+        async def locked_once(session, owner_id):
+            attempts.append(owner_id)
+            if len(attempts) == 1:
+                raise DatabaseLocked("database is locked")
+            return await bump_notes_version(session, owner_id)
+
+        retries_before = db_lock_retries.value()
+        with mock.patch("core.utils.retry.backoff", return_value=0):
+            with mock.patch("core.storage.sql.bump_notes_version", locked_once):
+                response = client.post("/notes/", headers=headers, json=self.sample_note)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(attempts), 2)
+            self.assertEqual(db_lock_retries.value(), retries_before + 1)
+
+            with mock.patch("core.storage.sql.bump_notes_version", mock.AsyncMock(side_effect=DatabaseLocked("database is locked"))):
+                response = client.post("/notes/", headers=headers, json=self.sample_note)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers["Retry-After"], "1")
+
+        self.assertEqual(len(self.session.exec(select(Note).where(Note.owner_id == user.id)).all()), 1)
+
+    # Statements per request, including the user lookup every authenticated
+    # route does. They must not grow with the number of notes involved.
+    QUERY_BUDGETS = {
+        "list": 1 + 1,
+        "get": 1 + 1,
+        "register": 3,      # username check, email check, insert
+        "create": 1 + 2,    # bump, insert ... returning
+        "update": 1 + 2,    # bump, update ... returning
+        "delete": 1 + 3,    # bump, delete ... returning, tombstone
+        "changes": 1 + 2,   # changed notes, tombstones
+        "batch": 1 + 6,     # load targets, bump, insert, update, delete, tombstones
+        "move": 1 + 1,      # ownership check
+        "export": 1 + 1,
+        "search": 1 + 1,
+    }
+
+    def test_query_budgets(self):
+        """Test that each note route stays within its query budget"""
+        user = self._create_user()
+        headers = self._auth_headers(user)
+        client = type(self).client
+        budgets = self.QUERY_BUDGETS
+        ids = [self._create_note({**self.sample_note, "owner_id": user.id}).id for _ in range(50)]
+
+        self._assert_query_budget(budgets["list"], lambda: client.get("/notes/", headers=headers))
+        self._assert_query_budget(budgets["list"], lambda: client.get("/notes/?x0=0&y0=0&x1=5000&y1=5000", headers=headers))
+        self._assert_query_budget(budgets["get"], lambda: client.get(f"/notes/{ids[0]}", headers=headers))
+        self._assert_query_budget(budgets["register"], lambda: client.post("/register", json={
+            "username": "budgetuser", "email": "budget@example.com", "password": "password123"
+        }))
+        self._assert_query_budget(budgets["create"], lambda: client.post("/notes/", headers=headers, json=self.sample_note))
+        self._assert_query_budget(budgets["update"], lambda: client.put(f"/notes/{ids[1]}", headers=headers, json={"body": "Edited"}))
+        self._assert_query_budget(budgets["delete"], lambda: client.delete(f"/notes/{ids[2]}", headers=headers))
+        self._assert_query_budget(budgets["changes"], lambda: client.get(
+            "/notes/changes", headers=headers, params={"since": encode_cursor(user.id, 0)}
+        ))
+        self._assert_query_budget(budgets["batch"], lambda: client.post("/notes/batch", headers=headers, json={"operations": [
+            *({"op": "update", "id": note_id, "note": {"pos_x": 1}} for note_id in ids[3:20]),
+            *({"op": "delete", "id": note_id} for note_id in ids[20:30]),
+            *({"op": "create", "note": self.sample_note} for _ in range(10)),
+        ]}))
+        self._assert_query_budget(budgets["move"], lambda: client.patch(
+            f"/notes/{ids[40]}/position", headers=headers, json={"pos_x": 1, "pos_y": 1}
+        ))
+        self._assert_query_budget(budgets["export"], lambda: client.get("/notes/export", headers=headers))
+        self._assert_query_budget(budgets["search"], lambda: client.get("/notes/search", headers=headers, params={"q": "test"}))
+
     def test_multiple_notes_independence(self):
         """Test that multiple notes can coexist independently"""
         note1 = self._create_note()
@@ -261,12 +1130,15 @@ class TestAuthAPI(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         """Set up test database engine and client once for all tests"""
-        cls.engine = create_engine(
-            "sqlite:///:memory:",
-            connect_args={"check_same_thread": False},
-            poolclass=StaticPool,
-        )
+        cls.db_dir = tempfile.mkdtemp()
+        cls.engine, cls.async_engine = create_test_engines(cls.db_dir)
         cls.client = TestClient(app)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Dispose engines and remove the test database"""
+        cls.engine.dispose()
+        shutil.rmtree(cls.db_dir, ignore_errors=True)
     
     def setUp(self):
         """Create fresh database and session for each test"""
@@ -274,13 +1146,11 @@ class TestAuthAPI(unittest.TestCase):
         self.session = Session(type(self).engine)
         
         # Override the dependency
-        def get_session_override():
-            try:
-                yield self.session
-            finally:
-                pass
+        async def get_async_session_override():
+            async with open_async_session(type(self).async_engine) as session:
+                yield session
         
-        app.dependency_overrides[get_session] = get_session_override
+        app.dependency_overrides[get_async_session] = get_async_session_override
         self.addCleanup(app.dependency_overrides.clear)
         
         # Sample user data
@@ -296,6 +1166,19 @@ class TestAuthAPI(unittest.TestCase):
         SQLModel.metadata.drop_all(self.engine)
         app.dependency_overrides.clear()
     
+    def test_register_idempotency_key(self):
+        """Test that a retried registration replays the first answer instead of reporting a duplicate"""
+        asyncio.run(idempotency_store.clear())
+        headers = {"Idempotency-Key": "signup-1"}
+        first = type(self).client.post("/register", json=self.sample_user, headers=headers)
+        retry = type(self).client.post("/register", json=self.sample_user, headers=headers)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.headers["idempotent-replayed"], "true")
+        self.assertEqual(len(self.session.exec(select(User)).all()), 1)
+        # Without the key, the duplicate is reported as usual
+        self.assertEqual(type(self).client.post("/register", json=self.sample_user).status_code, 400)
+
     def _register_user(self, user_data=None):
         """Helper method to register a user via API"""
         if user_data is None:
@@ -542,5 +1425,935 @@ class TestAuthAPI(unittest.TestCase):
         self.assertNotEqual(token1, token2)
 
 
+class TestExportMemory(unittest.TestCase):
+    """
+    Streams a large synthetic table through /notes/export and checks that peak
+    Python allocations stay under a fixed ceiling. Set EXPORT_TEST_ROWS=1000000
+    for the full 1M-row run; the default keeps the suite fast while still
+    exporting more JSON than the ceiling, so a buffering export would fail.
+    """
+    ROWS = int(os.getenv("EXPORT_TEST_ROWS", "50000"))
+    CEILING_MB = 16  # measured peak is ~8.5 MB at 50k and at 1M rows
+
+    @classmethod
+    def setUpClass(cls):
+        cls.db_dir = tempfile.mkdtemp()
+        cls.engine, cls.async_engine = create_test_engines(cls.db_dir)
+        SQLModel.metadata.create_all(cls.engine)
+        palette_cache.clear()
+        with Session(cls.engine) as session:
+            session.add(User(username="bigboard", email="bigboard@example.com", password_hash="x"))
+            session.commit()
+            colors = {"color_id": "yellow", "color_header": "#FFD700", "color_body": "#FFFACD", "color_text": "#000000"}
+            row = {
+                **split_palette(colors, ensure_palettes(session, [palette_key(colors)])),
+                "body": "x" * 400,
+                "pos_x": 100,
+                "pos_y": 200,
+                "owner_id": 1,
+            }
+            for start in range(0, cls.ROWS, 50000):
+                session.connection().execute(insert(Note.__table__), [row] * min(50000, cls.ROWS - start))
+            session.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.dispose()
+        shutil.rmtree(cls.db_dir, ignore_errors=True)
+
+    def setUp(self):
+        async def get_async_session_override():
+            async with open_async_session(type(self).async_engine) as session:
+                yield session
+
+        app.dependency_overrides[get_async_session] = get_async_session_override
+        app.dependency_overrides[get_session_factory] = lambda: (lambda: open_async_session(type(self).async_engine))
+        self.addCleanup(app.dependency_overrides.clear)
+
+    async def _stream_export(self):
+        """Drive the ASGI app directly; test clients buffer the whole body"""
+        token = create_access_token({"sub": "bigboard"})
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": "GET", "scheme": "http", "path": "/notes/export", "raw_path": b"/notes/export",
+            "query_string": b"", "root_path": "", "client": ("test", 1), "server": ("test", 80),
+            "headers": [(b"authorization", f"Bearer {token}".encode())],
+        }
+        received = {"status": None, "lines": 0, "bytes": 0}
+
+        async def receive():
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                received["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                body = message.get("body", b"")
+                received["lines"] += body.count(b"\n")
+                received["bytes"] += len(body)
+
+        await app(scope, receive, send)
+        return received
+
+    def test_export_memory_ceiling(self):
+        """Test that export memory stays flat regardless of table size"""
+        tracemalloc.start()
+        try:
+            received = asyncio.run(self._stream_export())
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(received["status"], 200)
+        self.assertEqual(received["lines"], type(self).ROWS)
+        self.assertGreater(received["bytes"], type(self).CEILING_MB * 1024 * 1024)
+        self.assertLess(peak, type(self).CEILING_MB * 1024 * 1024)
+
+
+class RepositoryConformance:
+    """
+    Behaviour every storage backend must share. Subclasses provide
+    open_repository(); each test runs one scenario against it.
+    """
+
+    note_values = {
+        "body": "This is a test note",
+        "color_id": "blue",
+        "color_header": "#0000FF",
+        "color_body": "#E0E0FF",
+        "color_text": "#000000",
+        "pos_x": 100,
+        "pos_y": 200,
+    }
+
+    def open_repository(self):
+        raise NotImplementedError
+
+    def _run(self, scenario):
+        async def main():
+            async with self.open_repository() as repository:
+                return await scenario(repository)
+        return asyncio.run(main())
+
+    async def _owner(self, repository, username="owner"):
+        user = await repository.create_user(username, f"{username}@example.com", "x")
+        return user.id
+
+    def test_users(self):
+        """Test registering users and looking them up by username and email"""
+        async def scenario(repository):
+            user = await repository.create_user("alice", "alice@example.com", "hash")
+            self.assertEqual(user.notes_version, 0)
+            self.assertEqual((await repository.get_user_by_username("alice")).id, user.id)
+            self.assertEqual((await repository.get_user_by_email("alice@example.com")).id, user.id)
+            self.assertIsNone(await repository.get_user_by_username("bob"))
+            self.assertIsNone(await repository.get_user_by_email("bob@example.com"))
+        self._run(scenario)
+
+    def test_note_writes_bump_version_and_revision(self):
+        """Test create/update/delete stamp revisions and stay scoped to the owner"""
+        async def scenario(repository):
+            owner_id = await self._owner(repository)
+            other_id = await self._owner(repository, "other")
+
+            note = await repository.create_note(owner_id, self.note_values)
+            note_id = note.id
+            self.assertEqual((note.owner_id, note.version, note.revision), (owner_id, 1, 1))
+            self.assertTrue(await repository.note_exists(owner_id, note_id))
+            self.assertFalse(await repository.note_exists(other_id, note_id))
+            self.assertIsNone(await repository.get_note(other_id, note_id))
+
+            note = await repository.update_note(owner_id, note_id, {"body": "Edited", "pos_x": 5})
+            self.assertEqual((note.body, note.pos_x, note.version, note.revision), ("Edited", 5, 2, 2))
+            self.assertIsNone(await repository.update_note(other_id, note_id, {"body": "Stolen"}))
+            # A miss writes nothing, not even the owner's revision
+            self.assertEqual((await repository.get_user_by_username("other")).notes_version, 0)
+            self.assertEqual((await repository.get_note(owner_id, note_id)).body, "Edited")
+
+            note = await repository.update_note(owner_id, note_id, {"color_header": "#123456"})
+            self.assertEqual((note.color_id, note.color_header, note.color_text), ("blue", "#123456", "#000000"))
+            self.assertEqual(note.version, 3)
+
+            self.assertIsNone(await repository.delete_note(other_id, note_id))
+            self.assertEqual(await repository.delete_note(owner_id, note_id), 4)
+            self.assertIsNone(await repository.get_note(owner_id, note_id))
+            self.assertIsNone(await repository.delete_note(owner_id, note_id))
+            self.assertEqual((await repository.get_user_by_username("owner")).notes_version, 4)
+        self._run(scenario)
+
+    def test_update_note_skips_nulls(self):
+        """Test that None values leave the columns as they are"""
+        async def scenario(repository):
+            owner_id = await self._owner(repository)
+            note_id = (await repository.create_note(owner_id, self.note_values)).id
+            note = await repository.update_note(owner_id, note_id, {"body": None, "color_id": None, "pos_x": 9})
+            self.assertEqual((note.body, note.color_id, note.pos_x, note.version), (self.note_values["body"], "blue", 9, 2))
+            note = await repository.get_note(owner_id, note_id)
+            self.assertEqual(NoteRead.model_validate(note).body, self.note_values["body"])
+        self._run(scenario)
+
+    def test_list_notes_keyset_and_viewport(self):
+        """Test keyset pages in id order, viewport filtering and include_ids"""
+        async def scenario(repository):
+            owner_id = await self._owner(repository)
+            other_id = await self._owner(repository, "other")
+            ids = [
+                (await repository.create_note(owner_id, {**self.note_values, "pos_x": i * 100, "pos_y": 0})).id
+                for i in range(5)
+            ]
+            await repository.create_note(other_id, self.note_values)
+
+            first = await repository.list_notes(owner_id, 0, 2)
+            self.assertEqual([note["id"] for note in first], ids[:2])
+            self.assertEqual(set(first[0]), set(NoteRead.model_fields))
+            rest = await repository.list_notes(owner_id, ids[1], 10)
+            self.assertEqual([note["id"] for note in rest], ids[2:])
+
+            in_view = await repository.list_notes(owner_id, 0, 10, (0, 0, 150, 10))
+            self.assertEqual([note["id"] for note in in_view], ids[:2])
+            with_moved = await repository.list_notes(owner_id, 0, 10, (0, 0, 150, 10), [ids[4]])
+            self.assertEqual([note["id"] for note in with_moved], ids[:2] + [ids[4]])
+        self._run(scenario)
+
+    def test_changes_since_reports_updates_and_deletions(self):
+        """Test the delta since a revision, and that a full sync has no deletions"""
+        async def scenario(repository):
+            owner_id = await self._owner(repository)
+            kept = (await repository.create_note(owner_id, self.note_values)).id
+            gone = (await repository.create_note(owner_id, self.note_values)).id
+            await repository.update_note(owner_id, kept, {"body": "Edited"})
+            await repository.delete_note(owner_id, gone)
+
+            changed, deleted, next_position = await repository.changes_since(owner_id, (2, None), 4, 10)
+            self.assertEqual([(note["id"], note["body"]) for note in changed], [(kept, "Edited")])
+            self.assertEqual(deleted, [gone])
+            self.assertIsNone(next_position)
+
+            changed, deleted, _ = await repository.changes_since(owner_id, (-1, None), 4, 10)
+            self.assertEqual([note["id"] for note in changed], [kept])
+            self.assertEqual(deleted, [])
+            self.assertEqual(await repository.changes_since(owner_id, (4, None), 4, 10), ([], [], None))
+            # Nothing past the revision the caller read
+            self.assertEqual(await repository.changes_since(owner_id, (2, None), 2, 10), ([], [], None))
+        self._run(scenario)
+
+    def test_changes_since_pages(self):
+        """Test that a cut page resumes mid-revision and carries only the deletions it covers"""
+        async def scenario(repository):
+            owner_id = await self._owner(repository)
+            early = (await repository.create_note(owner_id, self.note_values)).id
+            # Keeps SQLite from handing `early`'s id out again
+            await repository.create_note(owner_id, self.note_values)
+            await repository.delete_note(owner_id, early)
+            _, ids = await repository.apply_batch(owner_id, [self.note_values] * 3, [], [], {})
+            late = (await repository.create_note(owner_id, self.note_values)).id
+            await repository.delete_note(owner_id, late)
+
+            changed, deleted, next_position = await repository.changes_since(owner_id, (2, None), 6, 2)
+            self.assertEqual([note["id"] for note in changed], ids[:2])
+            self.assertEqual(deleted, [early])
+            self.assertEqual(next_position, (4, ids[1]))
+
+            changed, deleted, next_position = await repository.changes_since(owner_id, next_position, 6, 2)
+            self.assertEqual([note["id"] for note in changed], ids[2:])
+            self.assertEqual(deleted, [late])
+            self.assertIsNone(next_position)
+        self._run(scenario)
+
+    def test_prune_tombstones(self):
+        """Test that pruning drops old tombstones and records the newest revision dropped"""
+        async def scenario(repository):
+            owner_id = await self._owner(repository)
+            other_id = await self._owner(repository, "other")
+            ids = [(await repository.create_note(owner_id, self.note_values)).id for _ in range(3)]
+            await repository.delete_note(owner_id, ids[0])
+            await repository.delete_note(owner_id, ids[1])
+            cutoff = time.time() + 1
+            with mock.patch("time.time", return_value=cutoff + 1):
+                await repository.delete_note(owner_id, ids[2])
+
+            self.assertEqual(await repository.prune_tombstones(cutoff), 2)
+            self.assertEqual((await repository.get_user_by_username("owner")).pruned_revision, 5)
+            self.assertEqual((await repository.get_user_by_username("other")).pruned_revision, 0)
+            _, deleted, _ = await repository.changes_since(owner_id, (5, None), 6, 10)
+            self.assertEqual(deleted, [ids[2]])
+            self.assertEqual(await repository.prune_tombstones(cutoff), 0)
+            self.assertEqual((await repository.get_user_by_username("owner")).pruned_revision, 5)
+        self._run(scenario)
+
+    def test_search_notes(self):
+        """Test every word must match, the last as a prefix, with marked snippets"""
+        async def scenario(repository):
+            owner_id = await self._owner(repository)
+            other_id = await self._owner(repository, "other")
+            for body in ["apple banana", "banana bread", "cherry pie"]:
+                await repository.create_note(owner_id, {**self.note_values, "body": body})
+            await repository.create_note(other_id, {**self.note_values, "body": "banana"})
+
+            hits = await repository.search_notes(owner_id, "banan", 0, 10)
+            self.assertEqual(sorted(note["body"] for note, _ in hits), ["apple banana", "banana bread"])
+            hits = await repository.search_notes(owner_id, "Apple ban", 0, 10)
+            self.assertEqual(len(hits), 1)
+            note, snippet = hits[0]
+            self.assertEqual(note["body"], "apple banana")
+            self.assertEqual(snippet, f"{SNIPPET_OPEN}apple{SNIPPET_CLOSE} {SNIPPET_OPEN}banana{SNIPPET_CLOSE}")
+            self.assertEqual(len(await repository.search_notes(owner_id, "banan", 1, 10)), 1)
+            self.assertEqual(await repository.search_notes(owner_id, "durian", 0, 10), [])
+        self._run(scenario)
+
+    def test_export_notes_in_chunks(self):
+        """Test export yields NoteRead-ordered tuples in id order, chunk_size at a time"""
+        async def scenario(repository):
+            owner_id = await self._owner(repository)
+            ids = [(await repository.create_note(owner_id, self.note_values)).id for _ in range(5)]
+            chunks = [list(rows) async for rows in repository.export_notes(owner_id, 2)]
+            self.assertEqual([len(rows) for rows in chunks], [2, 2, 1])
+            notes = [dict(zip(NoteRead.model_fields, row)) for chunk in chunks for row in chunk]
+            self.assertEqual([note["id"] for note in notes], ids)
+            self.assertEqual(notes[0]["body"], self.note_values["body"])
+        self._run(scenario)
+
+    def test_apply_batch_and_positions(self):
+        """Test a batch writes under one revision, and buffered positions skip missing notes"""
+        async def scenario(repository):
+            owner_id = await self._owner(repository)
+            updated = (await repository.create_note(owner_id, self.note_values)).id
+            deleted = (await repository.create_note(owner_id, self.note_values)).id
+
+            row = (await repository.get_notes(owner_id, [updated, 999]))[updated]
+            self.assertEqual(set(await repository.get_notes(owner_id, [999])), set())
+            row.update(body="Batched", version=row["version"] + 1)
+            revision, new_ids = await repository.apply_batch(
+                owner_id, [self.note_values, {**self.note_values, "body": "Second"}], [row], {deleted}, {updated: 1}
+            )
+            self.assertEqual(revision, 3)
+            self.assertEqual(len(new_ids), 2)
+            self.assertLess(new_ids[0], new_ids[1])
+            self.assertEqual((await repository.get_note(owner_id, new_ids[1])).body, "Second")
+            note = await repository.get_note(owner_id, updated)
+            self.assertEqual((note.body, note.version, note.revision), ("Batched", 2, 3))
+            self.assertIsNone(await repository.get_note(owner_id, deleted))
+
+            written = await repository.apply_positions({owner_id: {updated: (7, 8), deleted: (0, 0)}})
+            self.assertEqual(written, 1)
+            note = await repository.get_note(owner_id, updated)
+            self.assertEqual((note.pos_x, note.pos_y, note.version, note.revision), (7, 8, 3, 4))
+        self._run(scenario)
+
+    def test_apply_batch_conflicts_with_later_writes(self):
+        """Test a batch update of a note written or deleted since it was read writes nothing"""
+        async def scenario(repository):
+            owner_id = await self._owner(repository)
+            other_id = await self._owner(repository, "other")
+            kept = (await repository.create_note(owner_id, self.note_values)).id
+            gone = (await repository.create_note(owner_id, self.note_values)).id
+            foreign = (await repository.create_note(other_id, self.note_values)).id
+            rows = await repository.get_notes(owner_id, [kept, gone])
+            foreign_row = (await repository.get_notes(other_id, [foreign]))[foreign]
+
+            await repository.update_note(owner_id, kept, {"body": "Meanwhile"})
+            await repository.delete_note(owner_id, gone)
+            for row in (rows[kept], rows[gone], foreign_row):
+                with self.assertRaises(NoteConflict):
+                    await repository.apply_batch(
+                        owner_id, [self.note_values], [{**row, "body": "Stale", "version": 2}], (), {row["id"]: 1}
+                    )
+            self.assertEqual((await repository.get_note(owner_id, kept)).body, "Meanwhile")
+            self.assertEqual((await repository.get_note(other_id, foreign)).body, self.note_values["body"])
+            self.assertEqual(len(await repository.list_notes(owner_id, 0, 10)), 1)
+            self.assertEqual((await repository.get_user_by_username("owner")).notes_version, 4)
+        self._run(scenario)
+
+
+class TestSQLModelRepository(RepositoryConformance, unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.db_dir = tempfile.mkdtemp()
+        cls.engine, cls.async_engine = create_test_engines(cls.db_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.dispose()
+        shutil.rmtree(cls.db_dir, ignore_errors=True)
+
+    def setUp(self):
+        SQLModel.metadata.create_all(type(self).engine)
+        self.addCleanup(SQLModel.metadata.drop_all, type(self).engine)
+        palette_cache.clear()
+
+    def open_repository(self):
+        return SQLModelRepository(open_async_session(type(self).async_engine))
+
+    def test_palettes_are_shared_and_reloaded(self):
+        """Test notes with the same colors share one palette row, resolved again after a cold start"""
+        async def scenario(repository):
+            owner_id = await self._owner(repository)
+            for color_id in ("blue", "blue", "red", "blue"):
+                await repository.create_note(owner_id, {**self.note_values, "color_id": color_id})
+            # Another worker's process: nothing cached yet
+            palette_cache.clear()
+            return await repository.list_notes(owner_id, 0, 10)
+
+        notes = self._run(scenario)
+        self.assertEqual([note["color_id"] for note in notes], ["blue", "blue", "red", "blue"])
+        self.assertEqual(notes[0]["color_header"], self.note_values["color_header"])
+        with Session(type(self).engine) as session:
+            self.assertEqual(len(session.exec(select(Palette)).all()), 2)
+            self.assertEqual(len(set(session.exec(select(Note.palette_id)).all())), 2)
+
+    def test_palettes_outgrowing_the_cache(self):
+        """Test that a page with more palettes than the cache holds still gets every color"""
+        async def scenario(repository):
+            owner_id = await self._owner(repository)
+            for color_id in ("red", "green", "blue"):
+                await repository.create_note(owner_id, {**self.note_values, "color_id": color_id})
+            palette_cache.clear()
+            return await repository.list_notes(owner_id, 0, 10), await repository.get_notes(owner_id, [1, 2, 3])
+
+        with mock.patch.object(palette_cache, "maxsize", 1):
+            notes, by_id = self._run(scenario)
+            self.assertEqual(len(palette_cache), 1)
+        self.assertEqual([note["color_id"] for note in notes], ["red", "green", "blue"])
+        self.assertEqual([by_id[note_id]["color_id"] for note_id in (1, 2, 3)], ["red", "green", "blue"])
+
+    def test_palettes_per_owner_limit(self):
+        """Test that an owner can't add palettes past the limit, but can reuse existing ones"""
+        async def scenario(repository):
+            owner_id = await self._owner(repository)
+            other_id = await self._owner(repository, "other")
+            for color_id in ("red", "green"):
+                await repository.create_note(owner_id, {**self.note_values, "color_id": color_id})
+            with self.assertRaises(PaletteLimitExceeded):
+                await repository.create_note(owner_id, {**self.note_values, "color_id": "blue"})
+            with self.assertRaises(PaletteLimitExceeded):
+                await repository.update_note(owner_id, 1, {"color_id": "blue"})
+            await repository.create_note(owner_id, {**self.note_values, "color_id": "red"})
+            await repository.create_note(other_id, {**self.note_values, "color_id": "blue"})
+            # Known to the database, so not a new palette, even once evicted
+            palette_cache.clear()
+            await repository.create_note(owner_id, {**self.note_values, "color_id": "blue"})
+
+        with mock.patch("core.storage.sql.PALETTES_PER_OWNER_MAX", 2):
+            self._run(scenario)
+        with Session(type(self).engine) as session:
+            self.assertEqual(len(session.exec(select(Palette)).all()), 3)
+
+    def test_prune_palettes(self):
+        """Test that pruning deletes only the palettes no note uses"""
+        async def scenario(repository):
+            owner_id = await self._owner(repository)
+            await repository.create_note(owner_id, {**self.note_values, "color_id": "red"})
+            await repository.create_note(owner_id, {**self.note_values, "color_id": "green"})
+            await repository.update_note(owner_id, 1, {"color_id": "green"})
+
+        self._run(scenario)
+        with Session(type(self).engine) as session:
+            self.assertEqual(prune_palettes(session), 1)
+            self.assertEqual(session.exec(select(Palette.color_id)).all(), ["green"])
+
+
+class TestInMemoryRepository(RepositoryConformance, unittest.TestCase):
+
+    def setUp(self):
+        self.repository = InMemoryRepository()
+
+    def open_repository(self):
+        return self.repository
+
+    def test_api_on_memory_backend(self):
+        """Test the routes run unchanged against the in-memory backend"""
+        app.dependency_overrides[get_repository] = lambda: self.repository
+        app.dependency_overrides[get_repository_factory] = lambda: (lambda: self.repository)
+        self.addCleanup(app.dependency_overrides.clear)
+        note_cache.clear()
+        position_buffer.clear()
+        client = TestClient(app)
+
+        response = client.post("/register", json={"username": "memuser", "email": "mem@example.com", "password": "Passw0rd!"})
+        self.assertEqual(response.status_code, 200)
+        headers = {"Authorization": f"Bearer {create_access_token({'sub': 'memuser'})}"}
+
+        response = client.post("/notes/", headers=headers, json={**self.note_values, "body": "memory board"})
+        self.assertEqual(response.status_code, 200)
+        note_id = response.json()["id"]
+        response = client.put(f"/notes/{note_id}", headers=headers, json={"body": "memory board edited"})
+        self.assertEqual(response.json()["body"], "memory board edited")
+
+        response = client.get("/notes/", headers=headers)
+        self.assertEqual([note["id"] for note in response.json()["items"]], [note_id])
+        response = client.get("/notes/search", headers=headers, params={"q": "edit"})
+        self.assertEqual(response.json()["items"][0]["snippet"], "memory board <mark>edited</mark>")
+        response = client.get("/notes/export", headers=headers)
+        self.assertEqual(json.loads(response.text)["body"], "memory board edited")
+        self.assertEqual(client.delete(f"/notes/{note_id}", headers=headers).status_code, 200)
+        self.assertEqual(client.get(f"/notes/{note_id}", headers=headers).status_code, 404)
+
+
+class TestPasswordHasher(unittest.TestCase):
+
+    def setUp(self):
+        self.hasher = PasswordHasher(kind="thread", workers=2, queue_limit=2)
+        self.addCleanup(self.hasher.shutdown)
+
+    def test_hash_and_verify_off_loop(self):
+        """Test that the async wrappers hash and verify correctly"""
+        async def run():
+            hashed = await self.hasher.hash("password123", rounds=4)
+            return (
+                await self.hasher.verify("password123", hashed),
+                await self.hasher.verify("wrongpassword", hashed),
+            )
+
+        self.assertEqual(asyncio.run(run()), (True, False))
+        self.assertEqual(self.hasher.pending, 0)
+
+    def test_queue_limit_rejects_excess_jobs(self):
+        """Test that jobs beyond the queue limit fail fast"""
+        async def run():
+            return await asyncio.gather(
+                *(self.hasher.hash("password123", rounds=4) for _ in range(3)),
+                return_exceptions=True,
+            )
+
+        results = asyncio.run(run())
+        busy = [r for r in results if isinstance(r, PasswordPoolBusy)]
+        self.assertEqual(len(busy), 1)
+        self.assertEqual(self.hasher.pending, 0)
+
+
+class TestImport(unittest.TestCase):
+
+    def setUp(self):
+        self.db_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.db_dir, ignore_errors=True)
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.db_dir, 'import.sqlite3')}")
+        self.addCleanup(self.engine.dispose)
+        palette_cache.clear()
+
+        self.users = os.path.join(self.db_dir, "users.ndjson")
+        with open(self.users, "w") as f:
+            for name in ("alice", "bob"):
+                f.write(json.dumps({"username": name, "email": f"{name}@example.com", "password": "password123"}) + "\n")
+            f.write("{not json\n")
+            f.write(json.dumps({"username": "alice", "email": "other@example.com", "password": "password123"}) + "\n")
+
+        self.notes = os.path.join(self.db_dir, "notes.csv")
+        with open(self.notes, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["owner", "body", "color_id", "color_header", "color_body", "color_text", "pos_x", "pos_y"])
+            for i in range(7):
+                writer.writerow(["alice" if i % 2 else "bob", f"imported {i}", "yellow", "#FFD700", "#FFFACD", "#000000", i, i])
+            writer.writerow(["carol", "no such owner", "yellow", "#FFD700", "#FFFACD", "#000000", 0, 0])
+            writer.writerow(["alice", "off the board", "yellow", "#FFD700", "#FFFACD", "#000000", 6000, 0])
+
+    def _importer(self, **options):
+        self.out, self.errors = io.StringIO(), io.StringIO()
+        return Importer(self.engine, batch_size=3, workers=2, rounds=4, out=self.out, errors=self.errors, **options)
+
+    def test_import_users_and_notes(self):
+        """Test that valid records are loaded, indexed and stamped, and bad ones reported by line"""
+        users, notes = self._importer().run(users=self.users, notes=self.notes)
+        self.assertEqual((users.rows, users.imported, users.rejected), (4, 2, 2))
+        self.assertEqual((notes.rows, notes.imported, notes.rejected), (9, 7, 2))
+        self.assertIn(f"{self.users}:3: invalid JSON", self.errors.getvalue())
+        self.assertIn(f"{self.users}:4: Username already registered", self.errors.getvalue())
+        self.assertIn(f"{self.notes}:9: owner: no user named 'carol'", self.errors.getvalue())
+        self.assertIn(f"{self.notes}:10: pos_x: Input should be less than or equal to 5000", self.errors.getvalue())
+        self.assertIn("rows/s", self.out.getvalue())
+
+        with Session(self.engine) as session:
+            alice = session.exec(select(User).where(User.username == "alice")).one()
+            self.assertTrue(verify_password("password123", alice.password_hash))
+            notes = session.exec(select(Note).where(Note.owner_id == alice.id)).all()
+            self.assertEqual(len(notes), 3)
+            # One bump per chunk that held alice's notes
+            self.assertEqual(alice.notes_version, 2)
+            self.assertEqual(max(note.revision for note in notes), alice.notes_version)
+            self.assertEqual(len(session.exec(select(Palette)).all()), 1)
+        db = sqlite3.connect(os.path.join(self.db_dir, "import.sqlite3"))
+        indexes = {name for (name,) in db.execute("SELECT name FROM sqlite_master WHERE tbl_name = 'note'")}
+        matches = db.execute("SELECT count(*) FROM note_fts WHERE note_fts MATCH 'imported'").fetchone()[0]
+        db.close()
+        self.assertTrue({"ix_note_owner_id_id", "ix_note_owner_id_grid_cell", "note_fts_insert"} <= indexes)
+        self.assertEqual(matches, 7)
+
+    def test_import_notes_locks_out_other_connections(self):
+        """Test that a notes import refuses a database in use and keeps others out while it runs"""
+        path = os.path.join(self.db_dir, "import.sqlite3")
+        self._importer().run(users=self.users)
+        server = sqlite3.connect(path, timeout=0.1)
+        server.execute("BEGIN")
+        server.execute("SELECT count(*) FROM note").fetchall()
+        impatient = create_engine(f"sqlite:///{path}", connect_args={"timeout": 0.1})
+        self.addCleanup(impatient.dispose)
+        with self.assertRaises(DatabaseInUse):
+            Importer(impatient, out=io.StringIO()).run(notes=self.notes)
+        server.rollback()
+        self.assertIsNotNone(server.execute("SELECT 1 FROM sqlite_master WHERE name = 'note_fts_insert'").fetchone())
+
+        from core.utils import importer
+        real_split = importer.split_palette
+        refused = []
+
+        def probe(values, palette_ids):
+            try:
+                server.execute("SELECT count(*) FROM note").fetchall()
+            except sqlite3.OperationalError:
+                refused.append(values)
+            return real_split(values, palette_ids)
+
+        with mock.patch("core.utils.importer.split_palette", side_effect=probe):
+            notes, = self._importer().run(notes=self.notes)
+        self.assertEqual(len(refused), notes.imported)
+        self.assertEqual(server.execute("SELECT count(*) FROM note").fetchone(), (7,))
+        server.close()
+
+    def test_import_resumes_after_interruption(self):
+        """Test that a failed chunk leaves indexes rebuilt and a rerun picks up after the last commit"""
+        from core.utils import importer
+        real_split = importer.split_palette
+        calls = []
+
+        def fail_second_chunk(values, palette_ids):
+            calls.append(values)
+            if len(calls) == 4:
+                raise RuntimeError("interrupted")
+            return real_split(values, palette_ids)
+
+        with mock.patch("core.utils.importer.split_palette", side_effect=fail_second_chunk):
+            with self.assertRaises(RuntimeError):
+                self._importer().run(users=self.users, notes=self.notes)
+        with Session(self.engine) as session:
+            self.assertEqual(len(session.exec(select(Note)).all()), 3)
+            checkpoint = session.get(ImportCheckpoint, f"notes:{os.path.abspath(self.notes)}")
+            self.assertEqual(checkpoint.rows, 3)
+        db = sqlite3.connect(os.path.join(self.db_dir, "import.sqlite3"))
+        self.assertIsNotNone(db.execute("SELECT 1 FROM sqlite_master WHERE name = 'note_fts_insert'").fetchone())
+        db.close()
+
+        users, notes = self._importer().run(users=self.users, notes=self.notes)
+        self.assertEqual((users.resumed_at, users.rows), (4, 0))
+        self.assertEqual((notes.resumed_at, notes.rows, notes.imported), (3, 6, 4))
+        with Session(self.engine) as session:
+            bodies = sorted(note.body for note in session.exec(select(Note)).all())
+        self.assertEqual(bodies, [f"imported {i}" for i in range(7)])
+
+        [notes] = self._importer(restart=True).run(notes=self.notes)
+        self.assertEqual((notes.resumed_at, notes.imported), (0, 7))
+
+
+class TestIdempotency(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = 0
+        self.status = 201
+
+        async def handler(scope, receive, send):
+            body = b""
+            while True:
+                message = await receive()
+                body += message.get("body", b"")
+                if not message.get("more_body"):
+                    break
+            self.calls += 1
+            # Yield so concurrent requests overlap
+            await asyncio.sleep(0.01)
+            payload = json.dumps({"call": self.calls, "echo": body.decode()}).encode()
+            await send({"type": "http.response.start", "status": self.status, "headers": [(b"content-type", b"application/json")]})
+            await send({"type": "http.response.body", "body": payload})
+
+        self.store = InMemoryIdempotencyStore()
+        self.app = IdempotencyMiddleware(handler, store=self.store, routes=[("POST", "/items")], wait_seconds=0.2)
+
+    async def _post(self, client, key="k1", body="a"):
+        return await client.post("/items", content=body, headers={"Idempotency-Key": key} if key else {})
+
+    def _run(self, *requests):
+        async def run():
+            transport = httpx.ASGITransport(app=self.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await asyncio.gather(*(self._post(client, *request) for request in requests))
+        return asyncio.run(run())
+
+    def test_concurrent_requests_with_one_key_run_once(self):
+        """Test that requests sharing a key are serialized and all get the first response"""
+        responses = self._run(*[("k1", "a")] * 5)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual({response.json()["call"] for response in responses}, {1})
+        self.assertEqual(sum(response.headers.get("idempotent-replayed") == "true" for response in responses), 4)
+        self.assertEqual({response.status_code for response in responses}, {201})
+
+    def test_different_keys_and_no_key_run_separately(self):
+        """Test that only requests with the same key are deduplicated"""
+        self._run(("k1", "a"), ("k2", "a"), (None, "a"), (None, "a"))
+        self.assertEqual(self.calls, 4)
+
+    def test_reused_key_with_other_body_is_rejected(self):
+        """Test that a key can't be replayed for a different request"""
+        self._run(("k1", "a"))
+        [response] = self._run(("k1", "b"))
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.calls, 1)
+
+    def test_server_errors_are_not_stored(self):
+        """Test that a 5xx leaves the key free for a real retry"""
+        self.status = 500
+        self._run(("k1", "a"))
+        self.status = 201
+        [response] = self._run(("k1", "a"))
+        self.assertEqual((response.status_code, self.calls), (201, 2))
+
+    def test_key_held_elsewhere_answers_conflict(self):
+        """Test that a key claimed by another worker gets 409 once the wait runs out"""
+        asyncio.run(self.store.reserve("anonymous:POST:/items:k1", "other"))
+        [response] = self._run(("k1", "a"))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.headers["retry-after"], "1")
+        self.assertEqual(self.calls, 0)
+
+    def test_entries_expire(self):
+        """Test that a stored response stops being replayed after the TTL"""
+        self.store.ttl = 0
+        self._run(("k1", "a"))
+        self._run(("k1", "a"))
+        self.assertEqual(self.calls, 2)
+
+    def test_sqlite_store(self):
+        """Test that the SQLite store claims, stores, releases and shares keys through its table"""
+        db_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, db_dir, ignore_errors=True)
+        engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(db_dir, 'keys.sqlite3')}", poolclass=NullPool)
+
+        async def run():
+            async with engine.begin() as conn:
+                await conn.run_sync(SQLModel.metadata.create_all)
+            store, other_worker = SQLiteIdempotencyStore(engine), SQLiteIdempotencyStore(engine)
+            results = [await store.reserve("k", "f"), await other_worker.reserve("k", "f")]
+            await store.release("k")
+            results.append(await other_worker.reserve("k", "f"))
+            await other_worker.complete("k", StoredResponse("f", 200, [("content-type", "application/json")], b"{}"))
+            results.append(await store.reserve("k", "f"))
+            await engine.dispose()
+            return results
+
+        self.assertEqual(
+            asyncio.run(run()),
+            [None, PENDING, None, StoredResponse("f", 200, [("content-type", "application/json")], b"{}")]
+        )
+
+
+class TestNoteEventHub(unittest.TestCase):
+
+    def test_fan_out_to_owner_subscribers_only(self):
+        """Test that an event reaches every subscriber of its owner and nobody else"""
+        async def scenario():
+            hub = NoteEventHub(maxsize=4)
+            mine = [hub.subscribe(1) for _ in range(3)]
+            theirs = hub.subscribe(2)
+            self.assertEqual(hub.publish(1, {"type": "note.deleted", "id": 7}), 3)
+            for subscription in mine:
+                self.assertEqual(json.loads(await subscription.get()), {"type": "note.deleted", "id": 7})
+            self.assertTrue(theirs.queue.empty())
+
+        asyncio.run(scenario())
+
+    def test_slow_consumer_is_dropped(self):
+        """Test that a full queue cuts off that subscriber without blocking the others"""
+        async def scenario():
+            hub = NoteEventHub(maxsize=2)
+            slow = hub.subscribe(1)
+            fast = hub.subscribe(1)
+            for i in range(3):
+                hub.publish(1, {"seq": i})
+                await fast.get()
+            self.assertIsNone(await slow.get())
+            self.assertEqual(slow.close_code, SLOW_CONSUMER_CLOSE)
+            self.assertEqual(hub.subscriber_count(1), 1)
+            self.assertEqual(hub.stats()["dropped"], 1)
+
+        asyncio.run(scenario())
+
+
+class TestCompression(unittest.TestCase):
+
+    def _run(self, app, accept_encoding="gzip"):
+        """Drive `app` through CompressionMiddleware; returns the start message and the body messages"""
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {"type": "http", "method": "GET", "path": "/", "headers": [(b"accept-encoding", accept_encoding.encode())]}
+        asyncio.run(CompressionMiddleware(app, minimum_size=100, encodings=["gzip"])(scope, receive, send))
+        return messages[0], messages[1:]
+
+    def _app(self, chunks, content_type=b"application/json"):
+        async def app(scope, receive, send):
+            headers = [(b"content-type", content_type)]
+            if len(chunks) == 1:
+                headers.append((b"content-length", str(len(chunks[0])).encode()))
+            await send({"type": "http.response.start", "status": 200, "headers": headers})
+            for index, chunk in enumerate(chunks):
+                await send({"type": "http.response.body", "body": chunk, "more_body": index < len(chunks) - 1})
+        return app
+
+    def test_compresses_large_body_with_exact_length(self):
+        """Test a single-message body over the threshold is gzipped with a matching Content-Length"""
+        body = json.dumps([{"color_header": "#0000FF", "color_body": "#E0E0FF"}] * 50).encode()
+        start, bodies = self._run(self._app([body]))
+        headers = dict(start["headers"])
+        self.assertEqual(headers[b"content-encoding"], b"gzip")
+        self.assertEqual(headers[b"vary"], b"Accept-Encoding")
+        self.assertEqual(int(headers[b"content-length"]), len(bodies[0]["body"]))
+        self.assertLess(len(bodies[0]["body"]), len(body) // 5)
+        self.assertEqual(gzip.decompress(bodies[0]["body"]), body)
+
+    def test_leaves_small_unaccepted_and_binary_bodies_alone(self):
+        """Test bodies under the threshold, clients without gzip and non-text types pass through"""
+        small = b'{"detail": "Note deleted"}'
+        large = b"x" * 1000
+        for inner_app, accept_encoding, expected in (
+            (self._app([small]), "gzip", small),
+            (self._app([b"x" * 40, b"x" * 40]), "gzip", b"x" * 80),
+            (self._app([large]), "identity", large),
+            (self._app([large]), "gzip;q=0, br", large),
+            (self._app([large], b"image/png"), "gzip", large),
+        ):
+            start, bodies = self._run(inner_app, accept_encoding)
+            self.assertNotIn(b"content-encoding", dict(start["headers"]))
+            self.assertEqual(b"".join(message["body"] for message in bodies), expected)
+
+    def test_streams_chunk_by_chunk(self):
+        """Test a streamed body stays streamed: chunked, no Content-Length, one gzip stream"""
+        chunks = [json.dumps({"id": i, "body": "x" * 200}).encode() + b"\n" for i in range(20)]
+        start, bodies = self._run(self._app(chunks))
+        headers = dict(start["headers"])
+        self.assertEqual(headers[b"content-encoding"], b"gzip")
+        self.assertNotIn(b"content-length", headers)
+        self.assertGreater(len(bodies), 1)
+        self.assertFalse(bodies[-1]["more_body"])
+        self.assertEqual(gzip.decompress(b"".join(message["body"] for message in bodies)), b"".join(chunks))
+
+    def test_negotiate(self):
+        """Test Accept-Encoding negotiation follows server preference and q-values"""
+        self.assertEqual(negotiate("gzip, br", ["zstd", "br", "gzip"]), "br")
+        self.assertEqual(negotiate("br;q=0, gzip;q=0.5", ["br", "gzip"]), "gzip")
+        self.assertEqual(negotiate("*", ["br", "gzip"]), "br")
+        self.assertEqual(negotiate("*;q=0, gzip", ["br", "gzip"]), "gzip")
+        self.assertIsNone(negotiate("identity", ["gzip"]))
+        self.assertIsNone(negotiate("", ["gzip"]))
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram_renders_cumulative_buckets(self):
+        """Test Prometheus histogram exposition"""
+        histogram = Histogram("demo_seconds", "Demo.", ("route",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 3.0):
+            histogram.observe(value, "/x")
+        self.assertEqual(histogram.render(), [
+            "# HELP demo_seconds Demo.",
+            "# TYPE demo_seconds histogram",
+            'demo_seconds_bucket{route="/x",le="0.1"} 1',
+            'demo_seconds_bucket{route="/x",le="1.0"} 3',
+            'demo_seconds_bucket{route="/x",le="+Inf"} 4',
+            'demo_seconds_sum{route="/x"} 4.05',
+            'demo_seconds_count{route="/x"} 4',
+        ])
+
+    def test_password_hasher_records_bcrypt_time(self):
+        """Test that bcrypt time is observed per operation"""
+        hasher = PasswordHasher(workers=1, queue_limit=2)
+        self.addCleanup(hasher.shutdown)
+        before = bcrypt_latency.count("hash")
+        asyncio.run(hasher.hash("secret-password", rounds=4))
+        self.assertEqual(bcrypt_latency.count("hash"), before + 1)
+
+
+class TestLockRetry(unittest.TestCase):
+
+    def test_lock_contention_raises_database_locked(self):
+        """Test that SQLite's "database is locked" surfaces as DatabaseLocked"""
+        db_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, db_dir, ignore_errors=True)
+        db_path = os.path.join(db_dir, "locked.sqlite3")
+        engine = create_engine(f"sqlite:///{db_path}", connect_args={"timeout": 0})
+        self.addCleanup(engine.dispose)
+        retry_locked_writes(engine)
+
+        holder = sqlite3.connect(db_path, isolation_level=None)
+        self.addCleanup(holder.close)
+        holder.execute("BEGIN IMMEDIATE")
+        with self.assertRaises(DatabaseLocked):
+            with engine.begin() as conn:
+                conn.exec_driver_sql("CREATE TABLE t (x INTEGER)")
+        holder.execute("ROLLBACK")
+        with engine.begin() as conn:
+            conn.exec_driver_sql("CREATE TABLE t (x INTEGER)")
+
+    def test_backoff_is_jittered_and_capped(self):
+        """Test full-jitter backoff bounds"""
+        for attempt in range(10):
+            delay = backoff(attempt, base_ms=10, cap_ms=100)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(0.1, 0.01 * 2 ** attempt))
+
+
+class TestTokenCache(unittest.TestCase):
+
+    def setUp(self):
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+
+    def test_helpers_share_one_verification(self):
+        """Test that repeated helpers on one token hit the cache"""
+        token = create_access_token({"sub": "testuser"})
+        self.assertEqual(decode_token(token)["sub"], "testuser")
+        self.assertTrue(verify_token_type(token, "access"))
+        self.assertIsNotNone(get_token_expiration(token))
+
+        stats = token_cache.stats()
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hits"], 2)
+
+    def test_stats_on_metrics(self):
+        """Test that token cache hits, misses and size reach /metrics"""
+        token = create_access_token({"sub": "testuser"})
+        decode_token(token)
+        decode_token(token)
+        lines = TestClient(app).get("/metrics").text.splitlines()
+        self.assertIn("token_cache_hits_total 1", lines)
+        self.assertIn("token_cache_misses_total 1", lines)
+        self.assertIn("token_cache_size 1", lines)
+
+    def test_invalid_token_not_cached(self):
+        """Test that tokens failing verification are never cached"""
+        token = create_access_token({"sub": "testuser"}) + "tampered"
+        self.assertIsNone(decode_token(token))
+        self.assertIsNone(decode_token(token))
+        self.assertEqual(token_cache.stats()["size"], 0)
+
+    def test_entry_expires_with_token(self):
+        """Test that an entry is dropped once the token's exp has passed"""
+        cache = TokenCache(maxsize=10, ttl=300)
+        cache.put("expired", {"sub": "testuser", "exp": 1})
+        self.assertIsNone(cache.get("expired"))
+
+    def test_lru_eviction(self):
+        """Test that the cache stays within maxsize, evicting least recently used"""
+        cache = TokenCache(maxsize=2, ttl=300)
+        cache.put("a", {"sub": "a"})
+        cache.put("b", {"sub": "b"})
+        cache.get("a")
+        cache.put("c", {"sub": "c"})
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats()["size"], 2)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
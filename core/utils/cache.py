@@ -0,0 +1,125 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Protocol, Tuple
+
+NOTE_CACHE_SIZE: int = int(os.getenv("NOTE_CACHE_SIZE", "10000"))
+
+
+class CacheBackend(Protocol):
+    """Minimal byte store a NoteCache can sit on (in-process LRU, Redis, ...)."""
+
+    def get(self, key: str) -> Optional[bytes]: ...
+    def set(self, key: str, value: bytes) -> None: ...
+    def delete(self, key: str) -> None: ...
+    def clear(self) -> None: ...
+
+
+class InMemoryLRUCache:
+    """Thread-safe, size-bounded LRU byte store."""
+
+    def __init__(self, maxsize: int = NOTE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class NoteCache:
+    """
+    Read-through cache of serialized NoteRead payloads, keyed by owner and
+    note id so a hit never needs an ownership check. Writers must call
+    invalidate() for every note they change or delete.
+
+    A reader that misses should take `generation` before querying and pass it
+    to set(); if any invalidation happened meanwhile the fill is dropped, so a
+    read that raced a write can't re-cache the old row.
+    """
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _key(owner_id: int, note_id: int) -> str:
+        return f"note:{owner_id}:{note_id}"
+
+    def get(self, owner_id: int, note_id: int) -> Optional[Tuple[str, bytes]]:
+        """Return (etag, payload) for a cached note, or None on a miss."""
+        value = self.backend.get(self._key(owner_id, note_id))
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        etag, _, payload = value.partition(b"\n")
+        return etag.decode("ascii"), payload
+
+    def contains(self, owner_id: int, note_id: int) -> bool:
+        """Whether the note is cached, without counting a hit or miss (an ownership check, not a read)."""
+        return self.backend.get(self._key(owner_id, note_id)) is not None
+
+    def set(
+        self,
+        owner_id: int,
+        note_id: int,
+        etag: str,
+        payload: bytes,
+        generation: Optional[int] = None,
+    ) -> None:
+        if generation is not None and generation != self.generation:
+            return
+        # Backends only store bytes, so the ETag rides in front of the payload
+        self.backend.set(self._key(owner_id, note_id), etag.encode("ascii") + b"\n" + payload)
+
+    def invalidate(self, owner_id: int, *note_ids: int) -> None:
+        self.generation += 1
+        for note_id in note_ids:
+            self.backend.delete(self._key(owner_id, note_id))
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self.backend.clear()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+note_cache = NoteCache(InMemoryLRUCache())
@@ -0,0 +1,174 @@
+import os
+import zlib
+from typing import Callable, Dict, List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Responses smaller than this go out as is: below ~1 KB the headers and the
+# CPU cost outweigh the bytes saved
+COMPRESSION_MIN_BYTES: int = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL: int = int(os.getenv("GZIP_LEVEL", "6"))
+# Brotli's default (11) is meant for static assets; 4-5 is the usual setting
+# for dynamic responses, close to gzip's speed with a better ratio
+BROTLI_QUALITY: int = int(os.getenv("BROTLI_QUALITY", "4"))
+ZSTD_LEVEL: int = int(os.getenv("ZSTD_LEVEL", "3"))
+
+# Media types worth compressing; images, archives and the like already are
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/x-ndjson", "application/javascript")
+
+
+class _Encoder:
+    """Streaming compressor for one response: compress() per chunk, finish() once at the end."""
+
+    def __init__(self, compress: Callable[[bytes], bytes], finish: Callable[[], bytes]):
+        self.compress = compress
+        self.finish = finish
+
+
+def _gzip() -> _Encoder:
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return _Encoder(compressor.compress, compressor.flush)
+
+
+def _brotli() -> _Encoder:
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    return _Encoder(compressor.process, compressor.finish)
+
+
+def _zstd() -> _Encoder:
+    compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    return _Encoder(compressor.compress, compressor.flush)
+
+
+ENCODERS: Dict[str, Callable[[], _Encoder]] = {"gzip": _gzip}
+if brotli is not None:
+    ENCODERS["br"] = _brotli
+if zstandard is not None:
+    ENCODERS["zstd"] = _zstd
+
+# Server preference, best first; clients pick among these with Accept-Encoding.
+# Unset means every installed encoding; "" turns compression off
+_configured = os.getenv("COMPRESSION_ENCODINGS")
+if _configured is None:
+    COMPRESSION_ENCODINGS: List[str] = [name for name in ("zstd", "br", "gzip") if name in ENCODERS]
+else:
+    COMPRESSION_ENCODINGS = [name.strip() for name in _configured.split(",") if name.strip()]
+    _missing = [name for name in COMPRESSION_ENCODINGS if name not in ENCODERS]
+    if _missing:
+        raise RuntimeError(f"COMPRESSION_ENCODINGS: {', '.join(_missing)} not available (pip install brotli zstandard)")
+
+
+def negotiate(accept_encoding: str, preferred: List[str]) -> Optional[str]:
+    """
+    The first of `preferred` the client accepts (q > 0), or None. A "*"
+    entry covers encodings the client didn't name.
+    """
+    accepted: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    for encoding in preferred:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+class CompressionMiddleware:
+    """
+    Pure ASGI middleware compressing responses with the best encoding both
+    sides support. Bodies under `minimum_size` are sent untouched. A
+    streamed body (more_body) is compressed chunk by chunk as it's sent, so
+    exports keep their flat memory profile; single-message bodies get an
+    exact Content-Length. Responses that already carry a Content-Encoding,
+    or whose type doesn't compress, pass straight through.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES, encodings: Optional[List[str]] = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encodings = COMPRESSION_ENCODINGS if encodings is None else encodings
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.encodings:
+            return await self.app(scope, receive, send)
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""), self.encodings)
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        encoder = None
+        pending: List[bytes] = []  # streamed chunks held until minimum_size is reached
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, encoder, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                media_type = headers.get("content-type", "")
+                passthrough = (
+                    "content-encoding" in headers
+                    or not media_type.startswith(COMPRESSIBLE_TYPES)
+                    or message["status"] in (204, 304)
+                )
+                if passthrough:
+                    await send(message)
+                else:
+                    start = message  # headers depend on what the body turns out to be
+                return
+            if passthrough or message["type"] != "http.response.body":
+                return await send(message)
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if encoder is None:
+                pending.append(body)
+                size = sum(len(chunk) for chunk in pending)
+                if size < self.minimum_size:
+                    if more_body:
+                        return
+                    # Ended before reaching the threshold: send it as it came
+                    passthrough = True
+                    await send(start)
+                    return await send({"type": "http.response.body", "body": b"".join(pending)})
+
+                encoder = ENCODERS[encoding]()
+                headers = MutableHeaders(raw=start["headers"])
+                headers["content-encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                body = b"".join(pending)
+                pending.clear()
+                if more_body:
+                    # Length unknown until the stream ends: go chunked
+                    del headers["content-length"]
+                else:
+                    compressed = encoder.compress(body) + encoder.finish()
+                    headers["content-length"] = str(len(compressed))
+                    await send(start)
+                    return await send({"type": "http.response.body", "body": compressed})
+                await send(start)
+
+            chunk = encoder.compress(body)
+            if not more_body:
+                chunk += encoder.finish()
+            if chunk or not more_body:
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import os
+import threading
+from typing import Any, Dict, Optional, Set
+
+WS_QUEUE_SIZE: int = int(os.getenv("WS_QUEUE_SIZE", "256"))
+
+# Close code for a dropped slow consumer: "try again later", then resync
+# from GET /notes/changes
+SLOW_CONSUMER_CLOSE = 1013
+# Close code once the access token a socket opened with expires: policy
+# violation, as for a bad token; reconnect with a fresh one
+TOKEN_EXPIRED_CLOSE = 1008
+
+
+class Subscription:
+    """
+    One connection's bounded outbox. Messages are pre-serialized text; None
+    is the end-of-stream marker, after which `close_code` says why.
+    """
+
+    def __init__(self, owner_id: int, maxsize: int):
+        self.owner_id = owner_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue(maxsize)
+        self.closed = False
+        self.close_code: Optional[int] = None
+
+    async def get(self) -> Optional[str]:
+        return await self.queue.get()
+
+    def _offer(self, message: str) -> bool:
+        """Queue a message; on overflow, drop the backlog and end the stream. Loop thread only."""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            self._end(SLOW_CONSUMER_CLOSE)
+            return False
+
+    def _end(self, close_code: Optional[int]) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.close_code = close_code
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class NoteEventHub:
+    """
+    In-process pub/sub for note changes, one channel per owner. publish()
+    serializes an event once and offers it to every subscriber without ever
+    waiting: a subscriber whose queue is full is cut off instead of slowing
+    down the publisher or the other sockets.
+
+    Subscribers are reached directly when they share the publisher's event
+    loop and through call_soon_threadsafe otherwise. Events only reach
+    sockets in this process, so with several workers each one fans out the
+    changes it handled itself.
+    """
+
+    def __init__(self, maxsize: int = WS_QUEUE_SIZE):
+        self.maxsize = maxsize
+        self._channels: Dict[int, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def subscribe(self, owner_id: int) -> Subscription:
+        subscription = Subscription(owner_id, self.maxsize)
+        with self._lock:
+            self._channels.setdefault(owner_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            channel = self._channels.get(subscription.owner_id)
+            if channel is not None:
+                channel.discard(subscription)
+                if not channel:
+                    del self._channels[subscription.owner_id]
+
+    def close(self, subscription: Subscription, close_code: Optional[int] = None) -> None:
+        """End a subscription's stream and unsubscribe it; `close_code` is for the socket, None if it went away."""
+        self.unsubscribe(subscription)
+        self._call(subscription, subscription._end, close_code)
+
+    def publish(self, owner_id: int, event: Dict[str, Any]) -> int:
+        """Send `event` to the owner's subscribers; returns how many were offered it."""
+        with self._lock:
+            channel = self._channels.get(owner_id)
+            subscribers = list(channel) if channel else []
+        if not subscribers:
+            return 0
+
+        message = json.dumps(event, separators=(",", ":"))
+        self.published += 1
+        for subscription in subscribers:
+            self._call(subscription, self._deliver, subscription, message)
+        return len(subscribers)
+
+    def _deliver(self, subscription: Subscription, message: str) -> None:
+        if subscription.closed:
+            return
+        if subscription._offer(message):
+            self.delivered += 1
+        else:
+            self.dropped += 1
+            self.unsubscribe(subscription)
+
+    @staticmethod
+    def _call(subscription: Subscription, callback, *args) -> None:
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is subscription.loop:
+            callback(*args)
+        else:
+            try:
+                subscription.loop.call_soon_threadsafe(callback, *args)
+            except RuntimeError:
+                # That connection's loop has already shut down
+                pass
+
+    def subscriber_count(self, owner_id: Optional[int] = None) -> int:
+        with self._lock:
+            if owner_id is not None:
+                return len(self._channels.get(owner_id, ()))
+            return sum(len(channel) for channel in self._channels.values())
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "subscribers": self.subscriber_count(),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+note_events = NoteEventHub()
@@ -0,0 +1,308 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, List, NamedTuple, Protocol, Set, Tuple, Union
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from ..models import IdempotencyRecord
+from .jwt import decode_token
+from .metrics import idempotency_outcomes
+
+# "memory" keeps responses in this process; "sqlite" keeps them in the
+# idempotency_key table, so a retry that lands on another worker is replayed too
+IDEMPOTENCY_STORE: str = os.getenv("IDEMPOTENCY_STORE", "memory")
+IDEMPOTENCY_TTL: int = int(os.getenv("IDEMPOTENCY_TTL", "86400"))  # seconds a response stays replayable
+IDEMPOTENCY_MAX_KEYS: int = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))  # memory store only
+# How long a request waits for another worker still running the same key
+# before answering 409; also how long a crashed worker's claim blocks the key
+IDEMPOTENCY_WAIT_SECONDS: float = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))
+if IDEMPOTENCY_STORE not in ("memory", "sqlite"):
+    raise RuntimeError("IDEMPOTENCY_STORE must be memory or sqlite")
+
+IDEMPOTENCY_HEADER = b"idempotency-key"
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+POLL_SECONDS = 0.05
+PURGE_EVERY = 100  # completions between sweeps of expired rows (sqlite store)
+
+
+class StoredResponse(NamedTuple):
+    fingerprint: str
+    status: int
+    headers: List[Tuple[str, str]]
+    body: bytes
+
+
+# reserve() result while another request holds the key
+PENDING = "pending"
+Reservation = Union[None, str, StoredResponse]
+
+
+class IdempotencyStore(Protocol):
+    """
+    TTL-bounded store of responses by idempotency key. reserve() is atomic:
+    it returns None when the caller now holds the key (and must complete()
+    or release() it), PENDING while another request holds it, or the stored
+    response.
+    """
+
+    async def reserve(self, key: str, fingerprint: str) -> Reservation: ...
+    async def complete(self, key: str, response: StoredResponse) -> None: ...
+    async def release(self, key: str) -> None: ...
+    async def clear(self) -> None: ...
+
+
+class InMemoryIdempotencyStore:
+    """Per-process store; keys expire after `ttl` seconds and the oldest go first beyond `maxsize`."""
+
+    def __init__(self, ttl: int = IDEMPOTENCY_TTL, maxsize: int = IDEMPOTENCY_MAX_KEYS):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, Tuple[float, Union[str, StoredResponse]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _set(self, key: str, ttl: float, value: Union[str, StoredResponse]) -> None:
+        self._entries[key] = (time.time() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def reserve(self, key: str, fingerprint: str) -> Reservation:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() < entry[0]:
+                return entry[1]
+            self._set(key, IDEMPOTENCY_WAIT_SECONDS, PENDING)
+            return None
+
+    async def complete(self, key: str, response: StoredResponse) -> None:
+        with self._lock:
+            self._set(key, self.ttl, response)
+
+    async def release(self, key: str) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == PENDING:
+                del self._entries[key]
+
+    async def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_records = IdempotencyRecord.__table__
+
+
+class SQLiteIdempotencyStore:
+    """
+    Store in the idempotency_key table, shared by every worker on the
+    database. A claim is a row whose status is still NULL; it expires after
+    IDEMPOTENCY_WAIT_SECONDS in case its worker died. Expired rows are swept
+    every PURGE_EVERY completions.
+    """
+
+    def __init__(self, engine, ttl: int = IDEMPOTENCY_TTL):
+        self.engine = engine
+        self.ttl = ttl
+        self._completions = 0
+
+    async def reserve(self, key: str, fingerprint: str) -> Reservation:
+        now = time.time()
+        async with self.engine.begin() as conn:
+            await conn.execute(delete(_records).where(_records.c.key == key, _records.c.expires_at <= now))
+            claimed = (await conn.execute(
+                sqlite_insert(_records)
+                .values(key=key, fingerprint=fingerprint, expires_at=now + IDEMPOTENCY_WAIT_SECONDS)
+                .on_conflict_do_nothing()
+                .returning(_records.c.key)
+            )).first()
+            if claimed is not None:
+                return None
+            row = (await conn.execute(
+                select(_records.c.fingerprint, _records.c.status, _records.c.headers, _records.c.body)
+                .where(_records.c.key == key)
+            )).one()
+        if row.status is None:
+            return PENDING
+        return StoredResponse(row.fingerprint, row.status, [tuple(header) for header in json.loads(row.headers)], row.body)
+
+    async def complete(self, key: str, response: StoredResponse) -> None:
+        now = time.time()
+        async with self.engine.begin() as conn:
+            await conn.execute(
+                update(_records)
+                .where(_records.c.key == key)
+                .values(status=response.status, headers=json.dumps(response.headers), body=response.body, expires_at=now + self.ttl)
+            )
+            self._completions += 1
+            if self._completions % PURGE_EVERY == 0:
+                await conn.execute(delete(_records).where(_records.c.expires_at <= now))
+
+    async def release(self, key: str) -> None:
+        async with self.engine.begin() as conn:
+            await conn.execute(delete(_records).where(_records.c.key == key, _records.c.status.is_(None)))
+
+    async def clear(self) -> None:
+        async with self.engine.begin() as conn:
+            await conn.execute(delete(_records))
+
+
+def _json_response(status: int, detail: str, headers: Iterable[Tuple[bytes, bytes]] = ()) -> Tuple[dict, dict]:
+    body = json.dumps({"detail": detail}).encode("utf-8")
+    return (
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("ascii")),
+                *headers,
+            ],
+        },
+        {"type": "http.response.body", "body": body},
+    )
+
+
+class IdempotencyMiddleware:
+    """
+    Pure ASGI middleware giving `routes` (method, path) pairs Idempotency-Key
+    support. The first request with a key runs normally and its response is
+    stored, unless it is a 5xx, which the client may retry for real. Later
+    requests with the same key and the same body get the stored response,
+    marked `Idempotent-Replayed: true`, without reaching the route; with a
+    different body they get 422.
+
+    Keys are scoped to the caller (the bearer token's subject, or anonymous)
+    and the route. Requests with the same key are serialized: within a worker
+    on a lock per key, across workers by polling the store's claim for up to
+    `wait_seconds`, after which the client gets 409 with Retry-After.
+
+    Sits inside LockRetryMiddleware: a replayed attempt releases its claim
+    on the way out and takes it again on the way back in.
+    """
+
+    def __init__(self, app, store: IdempotencyStore, routes: Iterable[Tuple[str, str]] = (),
+                 wait_seconds: float = IDEMPOTENCY_WAIT_SECONDS):
+        self.app = app
+        self.store = store
+        self.routes: Set[Tuple[str, str]] = set(routes)
+        self.wait_seconds = wait_seconds
+        self._locks: Dict[str, list] = {}  # key -> [lock, requests holding or waiting]
+
+    @asynccontextmanager
+    async def _hold(self, key: str):
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (scope["method"], scope["path"]) not in self.routes:
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        key = headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return await self.app(scope, receive, send)
+        if not 0 < len(key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+            for message in _json_response(400, f"Idempotency-Key must be 1 to {IDEMPOTENCY_KEY_MAX_LENGTH} characters"):
+                await send(message)
+            return
+
+        caller = "anonymous"
+        scheme, _, token = headers.get(b"authorization", b"").decode("latin-1").partition(" ")
+        if scheme.lower() == "bearer":
+            payload = decode_token(token)
+            if not payload or payload.get("type") != "access":
+                # The route answers 401; nothing worth keeping
+                return await self.app(scope, receive, send)
+            caller = f"user:{payload.get('sub')}"
+
+        # The whole body is needed for the fingerprint; these routes take small JSON
+        messages = []
+        while True:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request" or not message.get("more_body"):
+                break
+        body = b"".join(message.get("body", b"") for message in messages)
+        request = f"{scope['method']} {scope['path']}?{scope.get('query_string', b'').decode('latin-1')}"
+        fingerprint = hashlib.sha256(request.encode("utf-8") + b"\n" + body).hexdigest()
+        store_key = f"{caller}:{scope['method']}:{scope['path']}:{key.decode('latin-1')}"
+
+        async with self._hold(store_key):
+            deadline = time.monotonic() + self.wait_seconds
+            while (stored := await self.store.reserve(store_key, fingerprint)) == PENDING:
+                if time.monotonic() >= deadline:
+                    idempotency_outcomes.inc("in_progress")
+                    for message in _json_response(409, "A request with this Idempotency-Key is still in progress",
+                                                  [(b"retry-after", b"1")]):
+                        await send(message)
+                    return
+                await asyncio.sleep(POLL_SECONDS)
+
+            if stored is not None:
+                if stored.fingerprint != fingerprint:
+                    idempotency_outcomes.inc("mismatch")
+                    for message in _json_response(422, "Idempotency-Key was already used with a different request"):
+                        await send(message)
+                    return
+                idempotency_outcomes.inc("replayed")
+                await send({
+                    "type": "http.response.start",
+                    "status": stored.status,
+                    "headers": [
+                        *((name.encode("latin-1"), value.encode("latin-1")) for name, value in stored.headers),
+                        (b"idempotent-replayed", b"true"),
+                    ],
+                })
+                await send({"type": "http.response.body", "body": stored.body})
+                return
+
+            await self._run(scope, messages, receive, send, store_key, fingerprint)
+
+    async def _run(self, scope, messages, receive, send, store_key, fingerprint):
+        replay = iter(messages)
+
+        async def receive_again():
+            message = next(replay, None)
+            return message if message is not None else await receive()
+
+        status = None
+        response_headers: List[Tuple[str, str]] = []
+        chunks: List[bytes] = []
+
+        async def recording_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_headers.extend(
+                    (name.decode("latin-1"), value.decode("latin-1")) for name, value in message.get("headers", [])
+                )
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_again, recording_send)
+        except BaseException:
+            await self.store.release(store_key)
+            raise
+        if status is None or status >= 500:
+            await self.store.release(store_key)
+            return
+        idempotency_outcomes.inc("stored")
+        await self.store.complete(store_key, StoredResponse(fingerprint, status, response_headers, b"".join(chunks)))
@@ -0,0 +1,317 @@
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import delete, or_, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session, SQLModel, select
+
+from ..models import ImportCheckpoint, Note, NoteCreate, User, UserCreate
+from ..storage.sql import ensure_palettes, split_palette
+from .palettes import palette_key
+from .retry import DatabaseLocked
+from .search import NOTE_FTS_CREATE, NOTE_FTS_REBUILD
+from .security import BCRYPT_ROUNDS, PASSWORD_EXECUTOR, PASSWORD_WORKERS, hash_password
+
+IMPORT_PROGRESS_SECONDS: float = float(os.getenv("IMPORT_PROGRESS_SECONDS", "5"))
+
+# (line number in the file, parsed record); None stands for a line that isn't JSON
+Record = Tuple[int, Optional[dict]]
+# (line number, why the record was skipped)
+Reject = Tuple[int, str]
+
+_users = TypeAdapter(List[UserCreate])
+_notes = TypeAdapter(List[NoteCreate])
+
+# Rebuilt once at the end of a notes import instead of updated per row: the
+# secondary indexes on `note`, and the FTS index fed by the insert trigger
+_FTS_INSERT_TRIGGER = "note_fts_insert"
+
+
+def read_records(path: str) -> Iterator[Record]:
+    """Records of an NDJSON (.ndjson, .jsonl) or CSV (.csv, with a header row) file, in file order."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".ndjson", ".jsonl"):
+        with open(path, encoding="utf-8") as file:
+            for line, text in enumerate(file, 1):
+                if not text.strip():
+                    continue
+                try:
+                    yield line, json.loads(text)
+                except ValueError:
+                    yield line, None
+    elif extension == ".csv":
+        with open(path, encoding="utf-8", newline="") as file:
+            reader = csv.DictReader(file)
+            for record in reader:
+                yield reader.line_num, record
+    else:
+        raise ValueError(f"{path}: unknown format, expected .ndjson, .jsonl or .csv")
+
+
+def validate_batch(adapter: TypeAdapter, records: List[Record]) -> Tuple[List[Tuple[int, dict, Any]], List[Reject]]:
+    """
+    Validate a chunk in one call. Returns ((line, record, model) for the
+    valid ones, rejects). Only a chunk with errors is validated a second
+    time, without the rows the first pass pointed at.
+    """
+    parsed = [(line, record) for line, record in records if isinstance(record, dict)]
+    rejects = [
+        (line, "invalid JSON" if record is None else "not a JSON object")
+        for line, record in records if not isinstance(record, dict)
+    ]
+    try:
+        models = adapter.validate_python([record for _, record in parsed])
+    except ValidationError as exc:
+        errors: Dict[int, str] = {}
+        for error in exc.errors():
+            index, *field = error["loc"]
+            errors.setdefault(index, f"{'.'.join(map(str, field))}: {error['msg']}")
+        rejects += [(parsed[index][0], message) for index, message in errors.items()]
+        parsed = [item for index, item in enumerate(parsed) if index not in errors]
+        models = adapter.validate_python([record for _, record in parsed])
+    return [(line, record, model) for (line, record), model in zip(parsed, models)], sorted(rejects)
+
+
+def _chunks(records: Iterable[Record], size: int) -> Iterator[List[Record]]:
+    iterator = iter(records)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+class DatabaseInUse(RuntimeError):
+    """Another connection holds the database; a notes import needs it to itself."""
+
+
+def lock_database(connection: Connection) -> None:
+    """
+    Keep the database to `connection` until it is closed. In exclusive
+    locking mode the write lock taken here is held across every later commit,
+    so no server can query `note` while its indexes are dropped. Raises
+    DatabaseInUse if another connection is mid-transaction, or (under WAL)
+    has the database open at all.
+    """
+    connection.exec_driver_sql("PRAGMA locking_mode = EXCLUSIVE")
+    try:
+        connection.exec_driver_sql("BEGIN EXCLUSIVE")
+        connection.commit()
+    except (DatabaseLocked, OperationalError):
+        connection.rollback()
+        raise DatabaseInUse("the database is in use; stop the server before importing notes")
+
+
+def defer_note_indexes(session: Session) -> None:
+    connection = session.connection()
+    for index in Note.__table__.indexes:
+        index.drop(connection, checkfirst=True)
+    connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {_FTS_INSERT_TRIGGER}")
+    session.commit()
+
+
+def restore_note_indexes(session: Session) -> None:
+    """Build what defer_note_indexes dropped; also repairs a run that was killed before it could."""
+    connection = session.connection()
+    for index in Note.__table__.indexes:
+        index.create(connection, checkfirst=True)
+    for statement in NOTE_FTS_CREATE:
+        connection.exec_driver_sql(statement)
+    connection.exec_driver_sql(NOTE_FTS_REBUILD)
+    session.commit()
+
+
+class ImportStats:
+    def __init__(self, source: str, resumed_at: int):
+        self.source = source
+        self.resumed_at = resumed_at  # records a previous run had already committed
+        self.rows = 0  # records read by this run
+        self.imported = 0
+        self.rejected = 0
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        resumed = f", resumed after {self.resumed_at:,}" if self.resumed_at else ""
+        return (
+            f"{self.source}: {self.rows:,} rows{resumed}, {self.imported:,} imported, {self.rejected:,} rejected "
+            f"in {self.seconds:.1f} s ({self.rows_per_second:,.0f} rows/s)"
+        )
+
+
+class Importer:
+    """
+    Loads users and notes from files straight into the database, in chunks of
+    `batch_size` records. Each chunk is validated in one call, inserted with
+    one executemany and committed together with the file's ImportCheckpoint,
+    so an interrupted import resumes after the last committed chunk. Run it
+    again with the same files to resume; `restart=True` starts them over.
+
+    Users are inserted before notes, which name their owner by username.
+    Passwords are hashed on a pool of `workers`, which bcrypt keeps busy on
+    every core. Rejected records are reported as `path:line: reason` on
+    `errors` and skipped.
+    """
+
+    def __init__(
+        self,
+        engine,
+        batch_size: int = 1000,
+        executor: str = PASSWORD_EXECUTOR,
+        workers: int = PASSWORD_WORKERS,
+        rounds: int = BCRYPT_ROUNDS,
+        restart: bool = False,
+        out: TextIO = sys.stdout,
+        errors: TextIO = sys.stderr,
+    ):
+        if executor not in ("thread", "process"):
+            raise ValueError("executor must be 'thread' or 'process'")
+        if batch_size <= 0 or workers <= 0:
+            raise ValueError("batch_size and workers must be positive")
+        self.engine = engine
+        self.batch_size = batch_size
+        self.executor = executor
+        self.workers = workers
+        self.rounds = rounds
+        self.restart = restart
+        self.out = out
+        self.errors = errors
+        self._owners: Dict[str, int] = {}
+
+    def run(self, users: Optional[str] = None, notes: Optional[str] = None) -> List[ImportStats]:
+        SQLModel.metadata.create_all(self.engine)
+        results = []
+        with Session(self.engine) as session:
+            if users:
+                pool = ProcessPoolExecutor if self.executor == "process" else ThreadPoolExecutor
+                with pool(max_workers=self.workers) as executor:
+                    results.append(self._import(session, "users", users, self._users_chunk, executor))
+        if notes:
+            # Under WAL our own idle pooled connections would count as users
+            self.engine.dispose()
+            connection = self.engine.connect()
+            try:
+                lock_database(connection)
+                with Session(bind=connection) as session:
+                    defer_note_indexes(session)
+                    try:
+                        results.append(self._import(session, "notes", notes, self._notes_chunk, None))
+                    finally:
+                        # Whatever stopped the import, leave the table fully indexed
+                        session.rollback()
+                        start = time.perf_counter()
+                        restore_note_indexes(session)
+                        print(f"note indexes rebuilt in {time.perf_counter() - start:.1f} s", file=self.out)
+            finally:
+                # Closed rather than pooled, so the lock goes with it
+                connection.invalidate()
+                connection.close()
+        return results
+
+    def _import(self, session: Session, kind: str, path: str, insert_chunk, executor: Optional[Executor]) -> ImportStats:
+        source = f"{kind}:{os.path.abspath(path)}"
+        if self.restart:
+            session.exec(delete(ImportCheckpoint).where(ImportCheckpoint.source == source))
+            session.commit()
+        checkpoint = session.get(ImportCheckpoint, source)
+        done = checkpoint.rows if checkpoint else 0
+        stats = ImportStats(path, done)
+
+        start = last_report = time.perf_counter()
+        for chunk in _chunks(itertools.islice(read_records(path), done, None), self.batch_size):
+            imported, rejects = insert_chunk(session, chunk, executor)
+            done += len(chunk)
+            # Same transaction as the chunk's rows: either both land or neither does
+            session.exec(
+                sqlite_insert(ImportCheckpoint)
+                .values(source=source, rows=done)
+                .on_conflict_do_update(index_elements=["source"], set_={"rows": done})
+            )
+            session.commit()
+            stats.rows += len(chunk)
+            stats.imported += imported
+            stats.rejected += len(rejects)
+            for line, reason in rejects:
+                print(f"{path}:{line}: {reason}", file=self.errors)
+            now = time.perf_counter()
+            if now - last_report >= IMPORT_PROGRESS_SECONDS:
+                print(f"{path}: {done:,} rows, {stats.rows / (now - start):,.0f} rows/s", file=self.out)
+                last_report = now
+        stats.seconds = time.perf_counter() - start
+        print(stats, file=self.out)
+        return stats
+
+    def _users_chunk(self, session: Session, chunk: List[Record], executor: Executor) -> Tuple[int, List[Reject]]:
+        valid, rejects = validate_batch(_users, chunk)
+        usernames = {user.username for _, _, user in valid}
+        emails = {user.email for _, _, user in valid}
+        taken = session.exec(
+            select(User.username, User.email).where(or_(User.username.in_(usernames), User.email.in_(emails)))
+        ).all()
+        taken_usernames = {username for username, _ in taken}
+        taken_emails = {email for _, email in taken}
+
+        fresh = []
+        for line, _, user in valid:
+            if user.username in taken_usernames:
+                rejects.append((line, "Username already registered"))
+            elif user.email in taken_emails:
+                rejects.append((line, "Email already registered"))
+            else:
+                taken_usernames.add(user.username)
+                taken_emails.add(user.email)
+                fresh.append(user)
+
+        # Split so every worker gets a share of the chunk
+        chunksize = max(1, len(fresh) // (self.workers * 4))
+        hashes = executor.map(hash_password, [user.password for user in fresh], itertools.repeat(self.rounds), chunksize=chunksize)
+        rows = [
+            {"username": user.username, "email": user.email, "password_hash": password_hash}
+            for user, password_hash in zip(fresh, hashes)
+        ]
+        if rows:
+            session.connection().execute(User.__table__.insert(), rows)
+        return len(rows), sorted(rejects)
+
+    def _notes_chunk(self, session: Session, chunk: List[Record], executor: None) -> Tuple[int, List[Reject]]:
+        valid, rejects = validate_batch(_notes, chunk)
+        # Notes name their owner by username; ids from the old system mean nothing here
+        owners = [str(record.get("owner") or "") for _, record, _ in valid]
+        wanted = set(owners) - self._owners.keys()
+        if wanted:
+            self._owners.update(session.exec(select(User.username, User.id).where(User.username.in_(wanted))).all())
+
+        owned = []
+        for (line, _, note), owner in zip(valid, owners):
+            owner_id = self._owners.get(owner)
+            if owner_id is None:
+                rejects.append((line, f"owner: no user named {owner!r}"))
+            else:
+                owned.append((owner_id, note.model_dump()))
+        if not owned:
+            return 0, sorted(rejects)
+
+        # Commits new palettes on its own, before the chunk's transaction
+        palette_ids = ensure_palettes(session, [palette_key(values) for _, values in owned])
+        # One revision per owner per chunk, so /notes/changes and the ETag see the import
+        revisions = dict(session.exec(
+            update(User)
+            .where(User.id.in_({owner_id for owner_id, _ in owned}))
+            .values(notes_version=User.notes_version + 1)
+            .returning(User.id, User.notes_version)
+        ).all())
+        rows = [
+            {**split_palette(values, palette_ids), "owner_id": owner_id, "revision": revisions[owner_id]}
+            for owner_id, values in owned
+        ]
+        session.connection().execute(Note.__table__.insert(), rows)
+        return len(rows), sorted(rejects)
@@ -1,4 +1,8 @@
 import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 from typing import Optional, Dict, Any
 
@@ -25,6 +29,8 @@ SECRET_KEY: str = get_secret_key()
 ALGORITHM: str = os.getenv("JWT_ALGORITHM", "HS256")
 REFRESH_TOKEN_EXPIRE_DAYS: int = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
 ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+TOKEN_CACHE_SIZE: int = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+TOKEN_CACHE_TTL: int = int(os.getenv("TOKEN_CACHE_TTL", "300"))
 
 
 def _now_ts() -> int:
@@ -50,7 +56,8 @@ def create_access_token(
     to_encode.update({
         "exp": expire_ts,
         "iat": now_ts,
-        "type": "access"
+        "type": "access",
+        "jti": secrets.token_urlsafe(8)  # keeps tokens issued in the same second distinct
     })
 
     encoded = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
@@ -68,7 +75,8 @@ def create_refresh_token(data: Dict[str, Any]) -> str:
     to_encode.update({
         "exp": expire_ts,
         "iat": now_ts,
-        "type": "refresh"
+        "type": "refresh",
+        "jti": secrets.token_urlsafe(8)
     })
 
     encoded = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
@@ -77,14 +85,86 @@ def create_refresh_token(data: Dict[str, Any]) -> str:
     return encoded
 
 
+class TokenCache:
+    """
+    Bounded LRU cache of verified token payloads, keyed by the raw token.
+    An entry lives for at most `ttl` seconds and never past the token's own
+    `exp`, so a cached token can't outlive what jwt.decode would accept.
+    A maxsize of 0 disables caching.
+    """
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE, ttl: int = TOKEN_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, payload = entry
+            if time.time() >= expires_at:
+                del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return dict(payload)
+
+    def put(self, token: str, payload: Dict[str, Any]) -> None:
+        if self.maxsize <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        exp = payload.get("exp")
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, exp)
+        with self._lock:
+            self._entries[token] = (expires_at, dict(payload))
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+token_cache = TokenCache()
+
+
 def decode_token(token: str) -> Optional[Dict[str, Any]]:
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
+    token_cache.put(token, payload)
+    return payload
 
 
 def verify_token_type(token: str, expected_type: str) -> bool:
@@ -0,0 +1,52 @@
+import base64
+from typing import List, Optional, Tuple
+
+
+def _encode(*parts: int) -> str:
+    raw = ":".join(map(str, parts)).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode(cursor: str) -> List[int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8")
+        parts = [int(part) for part in raw.split(":")]
+    except Exception:
+        raise ValueError("malformed cursor")
+    if parts[0] < 1 or any(part < 0 for part in parts[1:]):
+        raise ValueError("malformed cursor")
+    return parts
+
+
+def encode_cursor(owner_id: int, last_id: int) -> str:
+    """Encode a keyset position on (owner_id, id) as an opaque URL-safe string."""
+    return _encode(owner_id, last_id)
+
+
+def decode_cursor(cursor: str) -> Tuple[int, int]:
+    """Inverse of encode_cursor. Raises ValueError on anything malformed."""
+    parts = _decode(cursor)
+    if len(parts) != 2:
+        raise ValueError("malformed cursor")
+    return parts[0], parts[1]
+
+
+def encode_sync_cursor(owner_id: int, revision: int, after_id: Optional[int] = None) -> str:
+    """
+    Encode a delta sync position: every change up to `revision` delivered,
+    or with `after_id`, `revision` itself only up to that note id.
+    """
+    if after_id is None:
+        return _encode(owner_id, revision)
+    return _encode(owner_id, revision, after_id)
+
+
+def decode_sync_cursor(cursor: str) -> Tuple[int, int, Optional[int]]:
+    """Inverse of encode_sync_cursor: (owner_id, revision, after_id or None). Raises ValueError on anything malformed."""
+    parts = _decode(cursor)
+    if len(parts) == 2:
+        return parts[0], parts[1], None
+    if len(parts) != 3:
+        raise ValueError("malformed cursor")
+    return parts[0], parts[1], parts[2]
@@ -0,0 +1,87 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+PALETTE_CACHE_SIZE: int = int(os.getenv("PALETTE_CACHE_SIZE", "10000"))
+# Distinct palettes an owner's notes may use before writes that would add a
+# new palette row are refused; existing palettes are never refused
+PALETTES_PER_OWNER_MAX: int = int(os.getenv("PALETTES_PER_OWNER_MAX", "100"))
+
+# The note fields a palette row stores, in NoteRead order
+PALETTE_FIELDS = ("color_id", "color_header", "color_body", "color_text")
+
+PaletteKey = Tuple[str, str, str, str]
+
+
+class PaletteLimitExceeded(Exception):
+    """A write needs a new palette and its owner already uses PALETTES_PER_OWNER_MAX."""
+
+
+def palette_key(values: dict) -> PaletteKey:
+    return tuple(values[field] for field in PALETTE_FIELDS)
+
+
+class PaletteCache:
+    """
+    Process-wide LRU map between palette ids and their colors, both ways,
+    holding at most `maxsize` palettes. Palette rows are never changed, so
+    an entry can't go stale; a palette that was evicted (or never seen) is
+    looked up in the database again by whoever needs it (load_palettes,
+    ensure_palettes).
+
+    Only add palettes whose row is committed; a rolled-back id could later
+    be handed to a different palette.
+    """
+
+    def __init__(self, maxsize: int = PALETTE_CACHE_SIZE):
+        # A single note's palette must survive being added
+        self.maxsize = max(1, maxsize)
+        self._by_id: "OrderedDict[int, PaletteKey]" = OrderedDict()
+        self._by_key: Dict[PaletteKey, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def get(self, palette_id: int) -> Optional[PaletteKey]:
+        with self._lock:
+            key = self._by_id.get(palette_id)
+            if key is not None:
+                self._by_id.move_to_end(palette_id)
+            return key
+
+    def id_for(self, key: PaletteKey) -> Optional[int]:
+        with self._lock:
+            palette_id = self._by_key.get(key)
+            if palette_id is not None:
+                self._by_id.move_to_end(palette_id)
+            return palette_id
+
+    def get_many(self, palette_ids: Iterable[int]) -> Dict[int, PaletteKey]:
+        """The cached ones of these palettes, by id."""
+        found = {}
+        with self._lock:
+            for palette_id in set(palette_ids):
+                key = self._by_id.get(palette_id)
+                if key is not None:
+                    self._by_id.move_to_end(palette_id)
+                    found[palette_id] = key
+        return found
+
+    def add(self, palette_id: int, key: PaletteKey) -> None:
+        with self._lock:
+            self._by_id[palette_id] = key
+            self._by_id.move_to_end(palette_id)
+            self._by_key[key] = palette_id
+            while len(self._by_id) > self.maxsize:
+                _, evicted = self._by_id.popitem(last=False)
+                del self._by_key[evicted]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._by_id.clear()
+            self._by_key.clear()
+
+
+palette_cache = PaletteCache()
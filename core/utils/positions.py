@@ -0,0 +1,148 @@
+import asyncio
+import itertools
+import os
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from ..storage.base import Repository
+from .cache import note_cache
+
+# 0 turns buffering off: every move is written by its own request
+POSITION_FLUSH_INTERVAL_MS: int = int(os.getenv("POSITION_FLUSH_INTERVAL_MS", "250"))
+
+# (pos_x, pos_y, seq); seq tells a flush whether the entry moved again meanwhile
+PendingPosition = Tuple[int, int, int]
+
+
+class PositionBuffer:
+    """
+    Write-behind buffer for note positions. Dragging a note produces a stream
+    of moves; only the last one per note is kept, and flush() writes them all
+    in one repository write. Readers overlay pending positions with get() so a
+    client always sees its own moves, flushed or not.
+
+    Entries stay in the buffer until their flush commits, and are only removed
+    if no newer move arrived in between. Lives on the event loop, so the only
+    lock is the one a flush holds while it writes: a write folding a pending
+    move into its own row takes it too (folding()), so the flush can't land
+    an older position over that write afterwards. Positions are buffered per
+    process: a PUT handled by another worker can't fold them in, and the
+    flush would land the older position over it. With several workers, set
+    `interval_ms` to 0 (write_through) and each move is written by its own
+    request.
+    """
+
+    def __init__(self, interval_ms: int = POSITION_FLUSH_INTERVAL_MS):
+        self.interval_ms = interval_ms
+        self._pending: Dict[int, Dict[int, PendingPosition]] = {}  # owner_id -> note_id -> entry
+        self._flush_lock = asyncio.Lock()
+        self._seq = itertools.count(1)
+        self.moves = 0
+        self.flushes = 0
+        self.rows_written = 0
+
+    def __len__(self) -> int:
+        return sum(len(notes) for notes in self._pending.values())
+
+    @property
+    def write_through(self) -> bool:
+        """True when buffering is off and the move route writes each move itself."""
+        return self.interval_ms <= 0
+
+    def put(self, owner_id: int, note_id: int, pos_x: int, pos_y: int) -> None:
+        self._pending.setdefault(owner_id, {})[note_id] = (pos_x, pos_y, next(self._seq))
+        self.moves += 1
+
+    def get(self, owner_id: int, note_id: int) -> Optional[PendingPosition]:
+        return self._pending.get(owner_id, {}).get(note_id)
+
+    def pending_for(self, owner_id: int) -> Dict[int, PendingPosition]:
+        return self._pending.get(owner_id, {})
+
+    def owner_token(self, owner_id: int) -> int:
+        """Latest pending seq for the owner, 0 if nothing is pending; changes with every move."""
+        notes = self._pending.get(owner_id)
+        return max(entry[2] for entry in notes.values()) if notes else 0
+
+    def discard(self, owner_id: int, note_id: int, seq: Optional[int] = None) -> None:
+        """Drop a pending move, but only if it's still the one tagged `seq` (when given)."""
+        notes = self._pending.get(owner_id)
+        if not notes or note_id not in notes:
+            return
+        if seq is None or notes[note_id][2] == seq:
+            del notes[note_id]
+            if not notes:
+                del self._pending[owner_id]
+
+    def apply(self, owner_id: int, note: dict) -> dict:
+        """Return `note` (a NoteRead-shaped dict) with any pending position laid over it."""
+        entry = self.get(owner_id, note["id"])
+        if entry is None:
+            return note
+        return {**note, "pos_x": entry[0], "pos_y": entry[1]}
+
+    def clear(self) -> None:
+        self._pending.clear()
+        self._flush_lock = asyncio.Lock()
+
+    @asynccontextmanager
+    async def folding(self, owner_id: int, note_ids: Iterable[int]):
+        """
+        Wrap a write that folds these notes' pending moves into its own rows:
+        read the moves with get() inside the block, and discard() them before
+        leaving it. Waits out a flush in progress, since that flush may be
+        writing one of the moves; free when none of the notes has a move.
+        """
+        if any(self.get(owner_id, note_id) is not None for note_id in note_ids):
+            async with self._flush_lock:
+                yield
+        else:
+            yield
+
+    async def flush(self, repository_factory: Callable[[], Repository]) -> int:
+        """
+        Write every pending position in one transaction (apply_positions):
+        each moved note gets version + 1 and its owner's new revision, exactly
+        like a PUT. Returns the number of notes written.
+        """
+        async with self._flush_lock:
+            snapshot = {owner_id: dict(notes) for owner_id, notes in self._pending.items() if notes}
+            if not snapshot:
+                return 0
+
+            async with repository_factory() as repository:
+                written = await repository.apply_positions({
+                    owner_id: {note_id: (x, y) for note_id, (x, y, _) in notes.items()}
+                    for owner_id, notes in snapshot.items()
+                })
+
+            for owner_id, notes in snapshot.items():
+                note_cache.invalidate(owner_id, *notes)
+                for note_id, (_, _, seq) in notes.items():
+                    self.discard(owner_id, note_id, seq)
+        self.flushes += 1
+        self.rows_written += written
+        return written
+
+    async def run(self, repository_factory: Callable[[], Repository]) -> None:
+        """Flush every `interval_ms` until cancelled. A failed flush keeps its entries for the next round."""
+        if self.write_through:
+            return
+        while True:
+            await asyncio.sleep(self.interval_ms / 1000)
+            try:
+                await self.flush(repository_factory)
+            except Exception as e:
+                # put e in a log file
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": len(self),
+            "moves": self.moves,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+        }
+
+
+position_buffer = PositionBuffer()
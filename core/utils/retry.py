@@ -0,0 +1,102 @@
+import asyncio
+import json
+import os
+import random
+from typing import List
+
+from .metrics import db_lock_retries
+
+# A request that loses the SQLite write lock (after busy_timeout has already
+# waited) is replayed from the top up to DB_LOCK_RETRIES times, sleeping a
+# random 0..min(cap, base * 2**attempt) ms between tries ("full jitter"), so
+# workers that collided once don't collide again in lockstep
+DB_LOCK_RETRIES: int = int(os.getenv("DB_LOCK_RETRIES", "5"))
+DB_LOCK_BACKOFF_MS: int = int(os.getenv("DB_LOCK_BACKOFF_MS", "10"))
+DB_LOCK_BACKOFF_CAP_MS: int = int(os.getenv("DB_LOCK_BACKOFF_CAP_MS", "500"))
+
+_LOCKED_MESSAGES = ("database is locked", "database is busy", "database table is locked")
+
+BUSY_BODY = json.dumps({"detail": "Database busy, try again shortly"}).encode("utf-8")
+
+
+class DatabaseLocked(RuntimeError):
+    """Raised in place of SQLite's "database is locked"; nothing was committed, so the request can be replayed."""
+
+
+def is_locked_error(exc: BaseException) -> bool:
+    return any(message in str(exc) for message in _LOCKED_MESSAGES)
+
+
+def raise_database_locked(context) -> None:
+    """handle_error listener turning lock contention into DatabaseLocked."""
+    if is_locked_error(context.original_exception):
+        raise DatabaseLocked(str(context.original_exception)) from context.original_exception
+
+
+def backoff(attempt: int, base_ms: int = DB_LOCK_BACKOFF_MS, cap_ms: int = DB_LOCK_BACKOFF_CAP_MS) -> float:
+    """Seconds to sleep before retry number `attempt` (0-based)."""
+    return random.uniform(0, min(cap_ms, base_ms * 2 ** attempt)) / 1000
+
+
+class LockRetryMiddleware:
+    """
+    Pure ASGI middleware replaying a request whose handler let DatabaseLocked
+    escape. Body messages are kept as they are read, so every attempt sees the
+    whole body; once the response has started nothing is retried. When the
+    retries run out the client gets 503 with Retry-After, like a saturated
+    password pool.
+    """
+
+    def __init__(self, app, retries: int = DB_LOCK_RETRIES):
+        self.app = app
+        self.retries = retries
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        # Whatever the app reads is recorded, so a replay can be fed the same
+        # body; reading stays lazy, as without this middleware
+        messages: List[dict] = []
+
+        async def recording_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                messages.append(message)
+            return message
+
+        started = False
+
+        async def send_wrapper(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        for attempt in range(self.retries + 1):
+            replay = iter(list(messages))
+
+            async def receive_again():
+                # What earlier attempts read first, then the real channel
+                message = next(replay, None)
+                return message if message is not None else await recording_receive()
+
+            try:
+                return await self.app(scope, receive_again, send_wrapper)
+            except DatabaseLocked:
+                if started:
+                    raise
+                if attempt < self.retries:
+                    db_lock_retries.inc()
+                    await asyncio.sleep(backoff(attempt))
+
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(BUSY_BODY)).encode("ascii")),
+                (b"retry-after", b"1"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": BUSY_BODY})
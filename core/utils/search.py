@@ -0,0 +1,76 @@
+import html
+import re
+from typing import List, Optional, Tuple
+
+# Full-text index over note bodies. It's an external-content FTS5 table: the
+# text lives only in `note`, and the triggers below keep the index in step
+# with every insert, body change and delete, whichever code path writes.
+NOTE_FTS_TABLE = "note_fts"
+
+NOTE_FTS_CREATE: List[str] = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {NOTE_FTS_TABLE} USING fts5(
+        body, content='note', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS note_fts_insert AFTER INSERT ON note BEGIN
+        INSERT INTO {NOTE_FTS_TABLE}(rowid, body) VALUES (new.id, new.body);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS note_fts_delete AFTER DELETE ON note BEGIN
+        INSERT INTO {NOTE_FTS_TABLE}({NOTE_FTS_TABLE}, rowid, body) VALUES ('delete', old.id, old.body);
+    END""",
+    # Bulk updates rewrite every column, so skip re-indexing unless the text changed
+    f"""CREATE TRIGGER IF NOT EXISTS note_fts_update AFTER UPDATE OF body ON note
+    WHEN old.body IS NOT new.body BEGIN
+        INSERT INTO {NOTE_FTS_TABLE}({NOTE_FTS_TABLE}, rowid, body) VALUES ('delete', old.id, old.body);
+        INSERT INTO {NOTE_FTS_TABLE}(rowid, body) VALUES (new.id, new.body);
+    END""",
+]
+
+NOTE_FTS_REBUILD = f"INSERT INTO {NOTE_FTS_TABLE}({NOTE_FTS_TABLE}) VALUES ('rebuild')"
+
+NOTE_FTS_DROP: List[str] = [
+    "DROP TRIGGER IF EXISTS note_fts_update",
+    "DROP TRIGGER IF EXISTS note_fts_delete",
+    "DROP TRIGGER IF EXISTS note_fts_insert",
+    f"DROP TABLE IF EXISTS {NOTE_FTS_TABLE}",
+]
+
+# snippet() wraps matches in these control characters; render_snippet()
+# escapes the text and only then turns them into <mark> tags
+SNIPPET_OPEN = "\x02"
+SNIPPET_CLOSE = "\x03"
+SNIPPET_ELLIPSIS = "…"
+SNIPPET_TOKENS = 12
+
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+
+def search_terms(q: str) -> List[str]:
+    """The words of a query or body, as the unicode61 tokenizer splits them."""
+    return _TERM.findall(q)
+
+
+def term_spans(text: str) -> List[Tuple[int, int]]:
+    """(start, end) offsets of each word search_terms() finds in `text`."""
+    return [match.span() for match in _TERM.finditer(text)]
+
+
+def match_query(q: str) -> Optional[str]:
+    """
+    Turn free text into an FTS5 MATCH expression: every word must appear, and
+    the last one may be a prefix (search-as-you-type). Words are quoted, so
+    FTS5 syntax in the input ("AND", "*", quotes, column filters) is inert.
+    Returns None if the text has no searchable words.
+    """
+    terms = search_terms(q)
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def render_snippet(raw: Optional[str]) -> str:
+    """HTML-escape a snippet() result and mark its matches with <mark>."""
+    if not raw:
+        return ""
+    return html.escape(raw, quote=False).replace(SNIPPET_OPEN, "<mark>").replace(SNIPPET_CLOSE, "</mark>")
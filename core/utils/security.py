@@ -1,9 +1,21 @@
 from __future__ import annotations
+import asyncio
+import os
+import threading
 import bcrypt
 import secrets
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from typing import Optional
+from .metrics import bcrypt_latency
 BCRYPT_ROUNDS = 12
 
+# Password work runs on its own pool so bcrypt never blocks the event loop.
+# "thread" is enough since bcrypt releases the GIL; "process" isolates it fully.
+PASSWORD_EXECUTOR: str = os.getenv("PASSWORD_EXECUTOR", "thread")
+PASSWORD_WORKERS: int = int(os.getenv("PASSWORD_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_QUEUE_LIMIT: int = int(os.getenv("PASSWORD_QUEUE_LIMIT", "64"))
+
 
 def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
     if not isinstance(password, str) or password == "":
@@ -24,6 +36,95 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         return False
 
 
+def _timed(func, *args):
+    # Runs in the worker (thread or process), so only bcrypt itself is timed,
+    # not the wait for a free worker
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+class PasswordPoolBusy(RuntimeError):
+    """Raised when more password jobs are pending than the queue limit allows."""
+
+
+class PasswordHasher:
+    """
+    Runs hash/verify calls on a bounded worker pool.
+    At most `queue_limit` jobs may be pending (running or queued) at once;
+    beyond that, calls fail fast with PasswordPoolBusy instead of piling up.
+    """
+
+    def __init__(
+        self,
+        kind: str = PASSWORD_EXECUTOR,
+        workers: int = PASSWORD_WORKERS,
+        queue_limit: int = PASSWORD_QUEUE_LIMIT,
+    ):
+        if kind not in ("thread", "process"):
+            raise ValueError("kind must be 'thread' or 'process'")
+        if workers <= 0 or queue_limit <= 0:
+            raise ValueError("workers and queue_limit must be positive")
+        self.kind = kind
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor: Optional[Executor] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                if self.kind == "process":
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                else:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers, thread_name_prefix="password"
+                    )
+            return self._executor
+
+    async def _run(self, op: str, func, *args):
+        with self._lock:
+            if self._pending >= self.queue_limit:
+                raise PasswordPoolBusy("password worker pool is saturated")
+            self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            result, elapsed = await loop.run_in_executor(self._get_executor(), _timed, func, *args)
+            bcrypt_latency.observe(elapsed, op)
+            return result
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    async def hash(self, password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+        return await self._run("hash", hash_password, password, rounds)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run("verify", verify_password, plain_password, hashed_password)
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+password_hasher = PasswordHasher()
+
+
+async def hash_password_async(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    return await password_hasher.hash(password, rounds)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.verify(plain_password, hashed_password)
+
+
 def generate_reset_token(length: int = 32) -> str:
     return secrets.token_urlsafe(length)
 
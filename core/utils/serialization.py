@@ -0,0 +1,38 @@
+import os
+from typing import Any, Dict, Iterable, List, Sequence
+
+from fastapi.responses import JSONResponse
+from pydantic_core import to_json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Opt-in: list routes serialize rows straight to bytes and the default
+# response class becomes ORJSONResponse. Output is byte-identical either way.
+FAST_JSON: bool = os.getenv("FAST_JSON", "0").lower() in ("1", "true", "yes")
+
+if FAST_JSON and orjson is None:
+    raise RuntimeError("FAST_JSON needs orjson: pip install orjson")
+
+if orjson is not None:
+    from fastapi.responses import ORJSONResponse
+
+
+def default_response_class():
+    return ORJSONResponse if FAST_JSON else JSONResponse
+
+
+def rows_to_dicts(fields: Sequence[str], rows: Iterable[Sequence[Any]]) -> List[Dict[str, Any]]:
+    """Zip column tuples into dicts keyed (and ordered) like the response model."""
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def dump_json(content: Any) -> bytes:
+    """
+    Compact UTF-8 JSON in exactly the bytes JSONResponse would produce, written
+    by pydantic-core without building or validating a response model. Only for
+    data that already has the model's shape, like rows read from the database.
+    """
+    return to_json(content)
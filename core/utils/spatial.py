@@ -0,0 +1,26 @@
+from typing import List
+
+# Notes are bucketed into square grid cells so viewport queries can seek the
+# (owner_id, grid_cell) index instead of scanning every note on the board.
+# The cell is a SQLite generated column, so it stays in sync on every write.
+GRID_CELL_SIZE = 250
+GRID_STRIDE = 32  # must exceed the number of cells per axis (5000 // 250 + 1)
+GRID_CELL_EXPR = f"(pos_x / {GRID_CELL_SIZE}) * {GRID_STRIDE} + (pos_y / {GRID_CELL_SIZE})"
+
+# Up to this many cells (~2000x2000 px) a viewport is selective enough that
+# seeking the grid index and sorting the matches beats walking ids in order.
+GRID_SEEK_MAX_CELLS = 64
+
+
+def grid_cell(pos_x: int, pos_y: int) -> int:
+    """Python mirror of GRID_CELL_EXPR."""
+    return (pos_x // GRID_CELL_SIZE) * GRID_STRIDE + (pos_y // GRID_CELL_SIZE)
+
+
+def grid_cells_for(x0: int, y0: int, x1: int, y1: int) -> List[int]:
+    """All cells overlapping the inclusive rectangle (x0, y0)-(x1, y1)."""
+    return [
+        cx * GRID_STRIDE + cy
+        for cx in range(x0 // GRID_CELL_SIZE, x1 // GRID_CELL_SIZE + 1)
+        for cy in range(y0 // GRID_CELL_SIZE, y1 // GRID_CELL_SIZE + 1)
+    ]
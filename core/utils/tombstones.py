@@ -0,0 +1,27 @@
+import asyncio
+import os
+import time
+from typing import Callable
+
+from ..storage.base import Repository
+
+# Deletions stay reportable to delta sync this long; a cursor older than that gets 410
+TOMBSTONE_RETENTION_DAYS: float = float(os.getenv("TOMBSTONE_RETENTION_DAYS", "30"))
+TOMBSTONE_PRUNE_INTERVAL_SECONDS: float = float(os.getenv("TOMBSTONE_PRUNE_INTERVAL_SECONDS", "3600"))
+
+
+async def prune_tombstones(repository_factory: Callable[[], Repository]) -> int:
+    """Drop tombstones older than the retention window. Returns how many went."""
+    async with repository_factory() as repository:
+        return await repository.prune_tombstones(time.time() - TOMBSTONE_RETENTION_DAYS * 86400)
+
+
+async def run_pruner(repository_factory: Callable[[], Repository]) -> None:
+    """Prune every TOMBSTONE_PRUNE_INTERVAL_SECONDS until cancelled."""
+    while True:
+        await asyncio.sleep(TOMBSTONE_PRUNE_INTERVAL_SECONDS)
+        try:
+            await prune_tombstones(repository_factory)
+        except Exception as e:
+            # put e in a log file
+            pass
@@ -1,3 +1,4 @@
+import os
 import sys
 import argparse
 import unittest
@@ -85,10 +86,42 @@ class ColoredTextTestRunner(unittest.TextTestRunner):
         return result
 
 
-def runserver(host="127.0.0.1", port=8000, reload=True):
-    """Start the development server"""
+def runserver(host="127.0.0.1", port=8000, reload=True, workers=1):
+    """Start the development server, or with workers > 1, one process per worker"""
     import uvicorn
-    uvicorn.run("core.app:app", host=host, port=port, reload=reload)
+
+    if workers > 1:
+        if reload:
+            raise RuntimeError("--workers needs --no-reload")
+        # Each worker would serve its own, unshared set of users and notes
+        if os.environ.get("STORAGE_BACKEND", "sqlmodel") == "memory":
+            raise RuntimeError("--workers needs STORAGE_BACKEND=sqlmodel")
+        # A move buffered on one worker could flush over a newer PUT handled
+        # by another, so every move is written by its own request
+        if int(os.environ.get("POSITION_FLUSH_INTERVAL_MS", "0")) != 0:
+            raise RuntimeError("--workers needs POSITION_FLUSH_INTERVAL_MS=0")
+        os.environ["POSITION_FLUSH_INTERVAL_MS"] = "0"
+        # Workers inherit the environment. WAL lets every worker read while one
+        # writes; the note cache is per process and would miss invalidations
+        # made by the other workers, so it is off unless asked for
+        os.environ.setdefault("DB_PROFILE", "production")
+        os.environ.setdefault("NOTE_CACHE_SIZE", "0")
+        # A retry may land on another worker, so Idempotency-Key responses
+        # have to live in the database
+        os.environ.setdefault("IDEMPOTENCY_STORE", "sqlite")
+    if os.environ.get("STORAGE_BACKEND", "sqlmodel") != "memory":
+        from sqlmodel import Session
+        from core.database import engine, initialize_db
+        from core.storage.sql import prune_palettes
+
+        # Create the schema (and switch the file to WAL) once, before the
+        # workers race each other to do it. No worker is up yet either, so
+        # none can hold a pruned palette id in its cache
+        initialize_db()
+        with Session(engine) as session:
+            prune_palettes(session)
+        engine.dispose()
+    uvicorn.run("core.app:app", host=host, port=port, reload=reload, workers=workers)
 
 
 def test(verbosity=2):
@@ -105,6 +138,27 @@ def test(verbosity=2):
     return 0 if result.wasSuccessful() else 1
 
 
+def bench(**options):
+    """Load-test the in-process app"""
+    from benchmarks.load import run
+
+    print(f"\n{Colors.BOLD}Running benchmark...{Colors.RESET}\n")
+    return run(**options)
+
+
+def import_data(users=None, notes=None, **options):
+    """Bulk-load users and notes from NDJSON/CSV files into the configured database"""
+    from core.database import engine
+    from core.utils.importer import Importer
+
+    if not (users or notes):
+        raise RuntimeError("nothing to import: pass --users and/or --notes")
+    print(f"\n{Colors.BOLD}Importing...{Colors.RESET}\n")
+    results = Importer(engine, **options).run(users=users, notes=notes)
+    engine.dispose()
+    return 0 if results else 1
+
+
 def main():
     parser = argparse.ArgumentParser(description='Management commands for Notes API')
     subparsers = parser.add_subparsers(dest='command', help='Command to run')
@@ -114,12 +168,48 @@ def main():
     parser_runserver.add_argument('--host', default='127.0.0.1', help='Host (default: 127.0.0.1)')
     parser_runserver.add_argument('--port', type=int, default=8000, help='Port (default: 8000)')
     parser_runserver.add_argument('--no-reload', action='store_true', help='Disable auto-reload')
+    parser_runserver.add_argument('--workers', type=int, default=1,
+                                  help='Worker processes; more than 1 needs --no-reload (default: 1)')
     
     # test command
     parser_test = subparsers.add_parser('test', help='Run tests')
     parser_test.add_argument('-v', '--verbosity', type=int, choices=[0, 1, 2], default=2,
                             help='Verbosity level (default: 2)')
     
+    # bench command
+    parser_bench = subparsers.add_parser('bench', help='Load-test the app against a scratch database')
+    parser_bench.add_argument('--users', type=int, default=10, help='Seeded users (default: 10)')
+    parser_bench.add_argument('--notes', type=int, default=200, help='Seeded notes per user (default: 200)')
+    parser_bench.add_argument('--requests', type=int, default=500, help='Requests per scenario (default: 500)')
+    parser_bench.add_argument('--auth-requests', type=int, default=50,
+                              help='Requests for the bcrypt-bound register/login scenarios (default: 50)')
+    parser_bench.add_argument('--concurrency', type=int, default=32, help='Requests in flight (default: 32)')
+    parser_bench.add_argument('--scenarios', nargs='+', choices=['register', 'login', 'list', 'get', 'update', 'delete'],
+                              help='Scenarios to run, in order (default: all)')
+    parser_bench.add_argument('--profile', choices=['dev', 'production'], default='production',
+                              help='SQLite profile for the scratch database (default: production)')
+    parser_bench.add_argument('--output', help='Write results as JSON to this file')
+    parser_bench.add_argument('--baseline', help='Compare against results saved with --output')
+    parser_bench.add_argument('--tolerance', type=float, default=0.10,
+                              help='Allowed slowdown vs the baseline before failing (default: 0.10)')
+    
+    # import command
+    parser_import = subparsers.add_parser(
+        'import', help='Bulk-load users and notes from NDJSON or CSV files (stop the server first when importing notes)',
+        description='Bulk-load users and notes from NDJSON or CSV files. Stop the server before importing '
+                    'notes: the notes phase locks the whole database until its indexes are rebuilt, and refuses '
+                    'to start while another connection is using it.'
+    )
+    parser_import.add_argument('--users', help='Users file: username, email, password per record')
+    parser_import.add_argument('--notes', help="Notes file: NoteCreate's fields plus owner (a username) per record")
+    parser_import.add_argument('--batch-size', type=int, default=1000, help='Records per transaction (default: 1000)')
+    parser_import.add_argument('--executor', choices=['thread', 'process'], default='thread',
+                               help='Pool that hashes passwords (default: thread)')
+    parser_import.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                               help='Password hashing workers (default: one per core)')
+    parser_import.add_argument('--restart', action='store_true',
+                               help='Ignore the checkpoints of earlier runs and import the files from the start')
+    
     args = parser.parse_args()
     
     if not args.command:
@@ -128,9 +218,21 @@ def main():
     
     try:
         if args.command == 'runserver':
-            runserver(host=args.host, port=args.port, reload=not args.no_reload)
+            runserver(host=args.host, port=args.port, reload=not args.no_reload, workers=args.workers)
         elif args.command == 'test':
             return test(verbosity=args.verbosity)
+        elif args.command == 'import':
+            return import_data(
+                users=args.users, notes=args.notes, batch_size=args.batch_size, executor=args.executor,
+                workers=args.workers, restart=args.restart
+            )
+        elif args.command == 'bench':
+            return bench(
+                users=args.users, notes=args.notes, requests=args.requests, auth_requests=args.auth_requests,
+                concurrency=args.concurrency,
+                scenarios=args.scenarios, profile=args.profile, output=args.output,
+                baseline=args.baseline, tolerance=args.tolerance
+            )
     except KeyboardInterrupt:
         print("\n\nInterrupted")
         return 130
@@ -11,6 +11,7 @@ sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 # Import your models and engine
 from core import models
 from core.database import engine
+from core.utils.search import NOTE_FTS_TABLE
 from sqlmodel import SQLModel
 
 # this is the Alembic Config object, which provides
@@ -26,6 +27,14 @@ if config.config_file_name is not None:
 # for 'autogenerate' support
 target_metadata = SQLModel.metadata
 
+
+def include_name(name, type_, parent_names):
+    # The FTS5 index (and the shadow tables SQLite keeps for it) is managed by
+    # hand-written migrations, so autogenerate must not try to drop it
+    if type_ == "table" and name.startswith(NOTE_FTS_TABLE):
+        return False
+    return True
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -47,6 +56,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_name=include_name,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -75,7 +85,8 @@ def run_migrations_online() -> None:
     with connectable.connect() as connection:
         context.configure(
             connection=connection, 
-            target_metadata=target_metadata
+            target_metadata=target_metadata,
+            include_name=include_name
         )
 
         with context.begin_transaction():
@@ -0,0 +1,29 @@
+"""note owner_id id index
+
+Revision ID: 8c41d2f7a9e3
+Revises: 2f5b3bdd6f52
+Create Date: 2026-10-17 10:12:04.512873
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c41d2f7a9e3'
+down_revision: Union[str, Sequence[str], None] = '2f5b3bdd6f52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_note_owner_id_id', 'note', ['owner_id', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_note_owner_id_id', table_name='note')
@@ -0,0 +1,69 @@
+"""note palettes
+
+Revision ID: a3c5e8f1d294
+Revises: f2a7c93d1e60
+Create Date: 2026-10-17 19:12:40.551823
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3c5e8f1d294'
+down_revision: Union[str, Sequence[str], None] = 'f2a7c93d1e60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLOR_COLUMNS = ('color_id', 'color_header', 'color_body', 'color_text')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'palette',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('color_id', sqlmodel.sql.sqltypes.AutoString(length=20), nullable=False),
+        sa.Column('color_header', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('color_body', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('color_text', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('color_id', 'color_header', 'color_body', 'color_text', name='uq_palette_colors')
+    )
+    # One palette per distinct color set already in use
+    op.execute(
+        "INSERT INTO palette (color_id, color_header, color_body, color_text) "
+        "SELECT DISTINCT color_id, color_header, color_body, color_text FROM note "
+        "ORDER BY color_id, color_header, color_body, color_text"
+    )
+    # SQLite can't ADD a column with a REFERENCES clause without a batch
+    # rebuild, and batch mode can't copy the virtual grid_cell column. Foreign
+    # keys aren't enforced here (no PRAGMA foreign_keys), so the reference is
+    # only declared on the model
+    op.add_column('note', sa.Column('palette_id', sa.Integer(), server_default='0', nullable=False))
+    # Each lookup is a seek on uq_palette_colors
+    op.execute(
+        "UPDATE note SET palette_id = (SELECT palette.id FROM palette WHERE "
+        "palette.color_id = note.color_id AND palette.color_header = note.color_header "
+        "AND palette.color_body = note.color_body AND palette.color_text = note.color_text)"
+    )
+    # Native DROP COLUMN (SQLite 3.35+) rewrites the rows without the strings;
+    # VACUUM afterwards to hand the freed pages back to the filesystem
+    for column in COLOR_COLUMNS:
+        op.drop_column('note', column)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.add_column('note', sa.Column('color_id', sqlmodel.sql.sqltypes.AutoString(length=20), server_default='', nullable=False))
+    for column in COLOR_COLUMNS[1:]:
+        op.add_column('note', sa.Column(column, sqlmodel.sql.sqltypes.AutoString(), server_default='', nullable=False))
+    op.execute(
+        "UPDATE note SET (color_id, color_header, color_body, color_text) = "
+        "(SELECT color_id, color_header, color_body, color_text FROM palette WHERE palette.id = note.palette_id)"
+    )
+    op.drop_column('note', 'palette_id')
+    op.drop_table('palette')
@@ -0,0 +1,34 @@
+"""note grid cell
+
+Revision ID: b7e90a1c5d24
+Revises: 8c41d2f7a9e3
+Create Date: 2026-10-17 11:03:47.208316
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+
+from alembic import op
+import sqlalchemy as sa
+
+from core.utils.spatial import GRID_CELL_EXPR
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e90a1c5d24'
+down_revision: Union[str, Sequence[str], None] = '8c41d2f7a9e3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # SQLite can only ADD a generated column when it is VIRTUAL
+    op.add_column('note', sa.Column('grid_cell', sa.Integer(), sa.Computed(GRID_CELL_EXPR, persisted=False), nullable=True))
+    op.create_index('ix_note_owner_id_grid_cell', 'note', ['owner_id', 'grid_cell'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_note_owner_id_grid_cell', table_name='note')
+    op.drop_column('note', 'grid_cell')
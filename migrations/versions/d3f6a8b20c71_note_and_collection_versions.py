@@ -0,0 +1,31 @@
+"""note and collection versions
+
+Revision ID: d3f6a8b20c71
+Revises: b7e90a1c5d24
+Create Date: 2026-10-17 13:26:51.774019
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3f6a8b20c71'
+down_revision: Union[str, Sequence[str], None] = 'b7e90a1c5d24'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('user', sa.Column('notes_version', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('note', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('note', 'version')
+    op.drop_column('user', 'notes_version')
@@ -0,0 +1,43 @@
+"""note revisions and tombstones
+
+Revision ID: e51c09d4b7a8
+Revises: d3f6a8b20c71
+Create Date: 2026-10-17 14:02:18.640552
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e51c09d4b7a8'
+down_revision: Union[str, Sequence[str], None] = 'd3f6a8b20c71'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('note', sa.Column('revision', sa.Integer(), server_default='0', nullable=False))
+    op.create_index('ix_note_owner_id_revision', 'note', ['owner_id', 'revision'], unique=False)
+    op.create_table(
+        'note_tombstone',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('note_id', sa.Integer(), nullable=False),
+        sa.Column('owner_id', sa.Integer(), nullable=False),
+        sa.Column('revision', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['owner_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_note_tombstone_owner_id_revision', 'note_tombstone', ['owner_id', 'revision'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_note_tombstone_owner_id_revision', table_name='note_tombstone')
+    op.drop_table('note_tombstone')
+    op.drop_index('ix_note_owner_id_revision', table_name='note')
+    op.drop_column('note', 'revision')
@@ -0,0 +1,35 @@
+"""note body full-text index
+
+Revision ID: f2a7c93d1e60
+Revises: e51c09d4b7a8
+Create Date: 2026-10-17 16:41:05.218377
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+
+from alembic import op
+import sqlalchemy as sa
+
+from core.utils.search import NOTE_FTS_CREATE, NOTE_FTS_DROP, NOTE_FTS_REBUILD
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2a7c93d1e60'
+down_revision: Union[str, Sequence[str], None] = 'e51c09d4b7a8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for statement in NOTE_FTS_CREATE:
+        op.execute(statement)
+    # Index the notes that already exist
+    op.execute(NOTE_FTS_REBUILD)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for statement in NOTE_FTS_DROP:
+        op.execute(statement)
@@ -0,0 +1,35 @@
+"""tombstone retention
+
+Revision ID: f7a3c5e91b20
+Revises: d41b7e9c2a58
+Create Date: 2026-10-17 23:41:12.305518
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f7a3c5e91b20'
+down_revision: Union[str, Sequence[str], None] = 'd41b7e9c2a58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing tombstones start their retention window now
+    op.add_column('note_tombstone', sa.Column('deleted_at', sa.Float(), server_default='0', nullable=False))
+    op.execute("UPDATE note_tombstone SET deleted_at = CAST(strftime('%s', 'now') AS REAL)")
+    op.create_index(op.f('ix_note_tombstone_deleted_at'), 'note_tombstone', ['deleted_at'], unique=False)
+    op.add_column('user', sa.Column('pruned_revision', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('user', 'pruned_revision')
+    op.drop_index(op.f('ix_note_tombstone_deleted_at'), table_name='note_tombstone')
+    op.drop_column('note_tombstone', 'deleted_at')